@@ -0,0 +1,208 @@
+"""批量执行 JSONL 任务文件。
+
+每行一个任务: {"provider": ..., "model_name": ..., "message": ...}
+结果按完成顺序以 JSONL 输出，并带上输入行号 index（从0开始）。
+
+命令行用法:
+    python -m app.batch jobs.jsonl -o results.jsonl --concurrency 4 --provider-concurrency deepseek=8
+
+输出文件已存在时会跳过其中已成功的行，因此中断后重新执行同一命令即可续跑。
+"""
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from app.models.catalog import resolve_target
+from app.models.factory import AIModelFactory
+from app.cache import generate_with_cache
+
+DEFAULT_CONCURRENCY = 4
+
+
+def parse_provider_concurrency(value: Optional[str]) -> Dict[str, int]:
+    """解析 "deepseek=8,openai=2" 形式的按提供商并发配置"""
+    limits = {}
+    if not value:
+        return limits
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        provider, _, limit = item.partition("=")
+        if not limit:
+            raise ValueError(f"无效的并发配置: {item}")
+        limits[provider.strip()] = int(limit)
+    return limits
+
+
+def parse_index_ranges(value: Optional[str]) -> Set[int]:
+    """解析 "0-99,105" 形式的行号集合"""
+    indices = set()
+    if not value:
+        return indices
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        start, sep, end = item.partition("-")
+        if sep:
+            indices.update(range(int(start), int(end) + 1))
+        else:
+            indices.add(int(item))
+    return indices
+
+
+def load_jobs(lines: Iterable[str], skip: Optional[Set[int]] = None) -> List[Tuple[int, str]]:
+    """读取任务行，忽略空行和需要跳过的行，返回 (行号, 原始内容)"""
+    skip = skip or set()
+    return [
+        (index, line)
+        for index, line in enumerate(lines)
+        if line.strip() and index not in skip
+    ]
+
+
+async def run_job(index: int, job: Dict) -> Dict:
+    provider = job["provider"]
+    model_name = job.get("model_name")
+    messages = [{"role": "user", "content": job["message"]}]
+    try:
+        provider, model_name = resolve_target(provider, model_name, messages)
+        ai_model = AIModelFactory.get_model(provider, model_name)
+        response, _ = await generate_with_cache(
+            ai_model,
+            provider,
+            model_name,
+            messages,
+            bypass=bool(job.get("bypass_cache", False))
+        )
+    except Exception as e:
+        return {
+            "index": index,
+            "status": "error",
+            "provider": provider,
+            "model": model_name,
+            "detail": str(e)
+        }
+
+    return {
+        "index": index,
+        "status": "success",
+        "provider": provider,
+        "model": model_name,
+        "message": response
+    }
+
+
+def parse_job(line: str) -> Dict:
+    job = json.loads(line)
+    if not isinstance(job, dict) or "provider" not in job or "message" not in job:
+        raise ValueError("缺少 provider 或 message 字段")
+    return job
+
+
+async def run_batch(
+    jobs: List[Tuple[int, str]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    provider_concurrency: Optional[Dict[str, int]] = None
+) -> AsyncIterator[Dict]:
+    """并发执行任务，每个提供商独立限制并发数，按完成顺序产出结果"""
+    provider_concurrency = provider_concurrency or {}
+    semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def limited(index: int, line: str) -> Dict:
+        try:
+            job = parse_job(line)
+        except ValueError as e:
+            return {"index": index, "status": "error", "detail": f"无效的任务行: {e}"}
+
+        provider = job["provider"]
+        if provider not in semaphores:
+            semaphores[provider] = asyncio.Semaphore(provider_concurrency.get(provider, concurrency))
+        async with semaphores[provider]:
+            return await run_job(index, job)
+
+    tasks = [asyncio.create_task(limited(index, line)) for index, line in jobs]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # 消费方提前退出（如客户端断开）时取消剩余任务
+        for task in tasks:
+            task.cancel()
+
+
+def completed_indices(path: str) -> Set[int]:
+    """从已有结果文件中读取已成功完成的行号"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # 中断时可能留下半行
+                continue
+            if result.get("status") == "success":
+                done.add(result["index"])
+    return done
+
+
+async def run_file(
+    input_path: str,
+    output_path: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    provider_concurrency: Optional[Dict[str, int]] = None
+) -> Tuple[int, int]:
+    skip = completed_indices(output_path)
+    with open(input_path, encoding="utf-8") as f:
+        jobs = load_jobs(f, skip)
+
+    # 上次中断可能留下不完整的最后一行，需要先补上换行，避免与新结果粘连
+    needs_newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    succeeded = failed = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        if needs_newline:
+            out.write("\n")
+        async for result in run_batch(jobs, concurrency, provider_concurrency):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if result["status"] == "success":
+                succeeded += 1
+            else:
+                failed += 1
+            print(f"[{succeeded + failed}/{len(jobs)}] 第{result['index']}行: {result['status']}", file=sys.stderr)
+    return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量执行 JSONL 任务文件")
+    parser.add_argument("input", help="任务文件，每行一个 {provider, model_name, message}")
+    parser.add_argument("-o", "--output", required=True, help="结果文件（JSONL），已存在时跳过已成功的行")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="每个提供商的默认并发数")
+    parser.add_argument("--provider-concurrency", default=None, help="按提供商覆盖并发数，如 deepseek=8,openai=2")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    succeeded, failed = asyncio.run(run_file(
+        args.input,
+        args.output,
+        args.concurrency,
+        parse_provider_concurrency(args.provider_concurrency)
+    ))
+    print(f"完成: 成功 {succeeded}, 失败 {failed}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
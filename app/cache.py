@@ -0,0 +1,261 @@
+"""确定性提示词的响应缓存：内存 LRU 层 + 可选的 SQLite 磁盘层。
+
+通过环境变量配置:
+    CACHE_ENABLED=1                是否启用缓存
+    CACHE_TTL=86400                过期时间（秒）
+    CACHE_MAX_ENTRIES=1024         内存层最大条目数
+    CACHE_SQLITE_PATH=cache.db     磁盘层路径，不设置则只使用内存层
+    CACHE_MAX_DISK_ENTRIES=100000  磁盘层最大条目数
+
+多 worker 部署时（见 app.shared_state）未设置 CACHE_SQLITE_PATH 也会以共享状态作为磁盘层，
+一个进程缓存的响应其他进程同样可以命中。磁盘层的读写可能等待其他进程释放 SQLite 写锁，
+异步代码应使用 aget/aset，在线程中访问磁盘层，避免阻塞事件循环。
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from app.models.base import BaseAIModel
+from app.shared_state import SharedState, SQLiteState, get_shared_state
+from app.singleflight import SingleFlight
+from app.ratelimit import call_with_limits
+
+
+# 响应缓存在共享状态中的命名空间
+CACHE_NAMESPACE = "responses"
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    # 统一换行符并去掉首尾空白，避免无意义的差异导致缓存未命中
+    return [
+        {
+            "role": message.get("role", "user"),
+            "content": message.get("content", "").replace("\r\n", "\n").strip()
+        }
+        for message in messages
+    ]
+
+
+def make_cache_key(
+    provider: str,
+    model_name: Optional[str],
+    messages: List[Dict[str, str]],
+    params: Optional[Dict[str, Any]] = None
+) -> str:
+    payload = json.dumps({
+        "provider": provider,
+        "model": model_name,
+        "messages": normalize_messages(messages),
+        "params": params or {}
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        ttl: float = 86400,
+        max_entries: int = 1024,
+        sqlite_path: Optional[str] = None,
+        max_disk_entries: int = 100000,
+        enabled: bool = True,
+        shared: Optional[SharedState] = None
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        # key -> (响应内容, 上游耗时, 过期时间)
+        self._memory: "OrderedDict[str, Tuple[str, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 磁盘层：独立的 SQLite 文件，或多 worker 部署时各进程共享的状态
+        self._disk: Optional[SharedState] = None
+        self._owns_disk = False
+        if sqlite_path:
+            self._disk = SQLiteState(sqlite_path)
+            self._owns_disk = True
+        elif shared is not None and shared.shared:
+            self._disk = shared
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            ttl=float(os.getenv("CACHE_TTL", 86400)),
+            max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 1024)),
+            sqlite_path=os.getenv("CACHE_SQLITE_PATH") or None,
+            max_disk_entries=int(os.getenv("CACHE_MAX_DISK_ENTRIES", 100000)),
+            enabled=os.getenv("CACHE_ENABLED", "1").lower() not in ("0", "false", "no"),
+            shared=get_shared_state()
+        )
+
+    def get(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """返回 (响应内容, 命中层 memory/disk)，未命中时为 (None, None)"""
+        value = self._get_memory(key)
+        if value is not None:
+            return value, "memory"
+        raw = self._disk.get(CACHE_NAMESPACE, key, touch=True) if self._disk is not None else None
+        return self._disk_result(key, raw)
+
+    async def aget(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """与 get 相同，磁盘层在线程中读取"""
+        value = self._get_memory(key)
+        if value is not None:
+            return value, "memory"
+        raw = None
+        if self._disk is not None:
+            raw = await asyncio.to_thread(self._disk.get, CACHE_NAMESPACE, key, True)
+        return self._disk_result(key, raw)
+
+    def set(self, key: str, value: str, latency: float) -> None:
+        raw = self._set_memory(key, value, latency)
+        if self._disk is not None:
+            self._set_disk(key, raw)
+
+    async def aset(self, key: str, value: str, latency: float) -> None:
+        """与 set 相同，磁盘层在线程中写入"""
+        raw = self._set_memory(key, value, latency)
+        if self._disk is not None:
+            await asyncio.to_thread(self._set_disk, key, raw)
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, latency, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._record_hit(latency, "memory")
+                    return value
+                del self._memory[key]
+            return None
+
+    def _disk_result(self, key: str, raw: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        with self._lock:
+            if raw is not None:
+                value, latency, expires_at = json.loads(raw)
+                self._put_memory(key, (value, latency, expires_at))
+                self._record_hit(latency, "disk")
+                return value, "disk"
+            self.misses += 1
+            return None, None
+
+    def _set_memory(self, key: str, value: str, latency: float) -> str:
+        """写入内存层，返回写入磁盘层的序列化内容"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._put_memory(key, (value, latency, expires_at))
+        return json.dumps([value, latency, expires_at], ensure_ascii=False)
+
+    def _set_disk(self, key: str, raw: str) -> None:
+        # 超出容量时淘汰最久未访问的条目
+        self._disk.set(CACHE_NAMESPACE, key, raw, ttl=self.ttl, max_entries=self.max_disk_entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear(CACHE_NAMESPACE)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "memory_entries": len(self._memory),
+            "enabled": self.enabled,
+            "disk_enabled": self._disk is not None,
+            "disk_shared": self._disk is not None and not self._owns_disk
+        }
+
+    def close(self) -> None:
+        # 共享状态由 close_shared_state 统一关闭
+        if self._disk is not None and self._owns_disk:
+            self._disk.close()
+        self._disk = None
+
+    def _put_memory(self, key: str, entry: Tuple[str, float, float]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _record_hit(self, latency: float, tier: str) -> None:
+        self.hits += 1
+        self.saved_seconds += latency
+        if tier == "memory":
+            self.memory_hits += 1
+        else:
+            self.disk_hits += 1
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """进程级缓存实例，首次使用时按环境变量创建（此时 .env 已加载）"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache.from_env()
+    return _response_cache
+
+
+# 相同缓存 key 的并发未命中请求只发起一次上游调用
+inflight = SingleFlight()
+
+
+async def generate_with_cache(
+    ai_model: BaseAIModel,
+    provider: str,
+    model_name: Optional[str],
+    messages: List[Dict[str, str]],
+    bypass: bool = False,
+    generate: Optional[Callable[[], Awaitable[str]]] = None,
+    params: Optional[Dict[str, Any]] = None
+) -> Tuple[str, str]:
+    """带缓存和请求合并地生成响应，返回 (响应内容, 缓存状态)
+
+    缓存状态为 HIT-memory / HIT-disk / MISS / COALESCED（复用了进行中的相同请求）/ BYPASS。
+    generate 替换默认的 ai_model.generate_response(messages)，params 写入缓存 key，
+    区分同一组消息的不同调用方式（如约束输出）。
+    """
+    generate = generate or (lambda: ai_model.generate_response(messages))
+
+    async def upstream() -> str:
+        # 所有上游调用都经过按提供商的限流、并发控制与重试
+        return await call_with_limits(provider, model_name, messages, generate)
+
+    if bypass:
+        return await upstream(), "BYPASS"
+
+    cache = get_response_cache()
+    key = make_cache_key(provider, model_name, messages, params)
+    if cache.enabled:
+        cached, tier = await cache.aget(key)
+        if cached is not None:
+            return cached, f"HIT-{tier}"
+
+    async def fetch() -> str:
+        start = time.perf_counter()
+        response = await upstream()
+        if response and cache.enabled:
+            await cache.aset(key, response, time.perf_counter() - start)
+        return response
+
+    response, shared = await inflight.do(key, fetch)
+    return response, "COALESCED" if shared else "MISS"
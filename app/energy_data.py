@@ -0,0 +1,121 @@
+"""7天能源数据（REGIONID,DATATYPE,DATAVALUE,CALENDAR_DATE）的预聚合。
+
+原始CSV直接放进提示词会占用大量token，这里用 pandas 的向量化操作把数据
+压缩为按地区/数据类型的统计量、每日汇总、异常值以及可选的降采样表。
+"""
+from typing import Dict, Optional, Union
+import io
+
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = ["REGIONID", "DATATYPE", "DATAVALUE", "CALENDAR_DATE"]
+DATE_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+RAW = "raw"
+SUMMARY = "summary"
+SUMMARY_DOWNSAMPLED = "summary+downsampled"
+SOURCE_MODES = (RAW, SUMMARY, SUMMARY_DOWNSAMPLED)
+
+
+def load_energy_csv(source: Union[str, io.IOBase]) -> pd.DataFrame:
+    """读取CSV文本或文件对象，只保留需要的列"""
+    if isinstance(source, str):
+        source = io.StringIO(source.strip())
+    df = pd.read_csv(
+        source,
+        usecols=lambda column: column.strip() in REQUIRED_COLUMNS,
+        dtype={"REGIONID": "category", "DATATYPE": "category"},
+        skipinitialspace=True
+    )
+    df.columns = [column.strip() for column in df.columns]
+    missing = set(REQUIRED_COLUMNS) - set(df.columns)
+    if missing:
+        raise ValueError(f"数据源缺少列: {', '.join(sorted(missing))}")
+    df["DATAVALUE"] = pd.to_numeric(df["DATAVALUE"], errors="coerce")
+    df["CALENDAR_DATE"] = pd.to_datetime(df["CALENDAR_DATE"], format=DATE_FORMAT, errors="coerce")
+    return df.dropna(subset=["DATAVALUE", "CALENDAR_DATE"])
+
+
+def summarize_energy_data(df: pd.DataFrame, anomaly_threshold: float = 3.5, max_anomalies: int = 20) -> Dict[str, pd.DataFrame]:
+    """按地区/数据类型计算统计量、每日汇总和异常值"""
+    keys = ["REGIONID", "DATATYPE"]
+    grouped = df.groupby(keys, observed=True)["DATAVALUE"]
+
+    stats = grouped.agg(["count", "min", "max", "mean", "std"]).reset_index()
+
+    daily = df.assign(DATE=df["CALENDAR_DATE"].dt.normalize()).pivot_table(
+        index=keys, columns="DATE", values="DATAVALUE", aggfunc="sum", observed=True
+    )
+    # 只对汇总后的少量列做日期格式化，避免逐行 strftime
+    daily.columns = [f"{date:%Y-%m-%d}" for date in daily.columns]
+    daily = daily.reset_index()
+
+    # 基于中位数绝对偏差的稳健 z 分数，避免极值本身拉高标准差
+    median = grouped.transform("median")
+    mad = (df["DATAVALUE"] - median).abs().groupby([df[k] for k in keys], observed=True).transform("median")
+    robust_z = 0.6745 * (df["DATAVALUE"] - median) / mad.replace(0, np.nan)
+    anomalies = (
+        df.assign(Z=robust_z)
+        .loc[lambda d: d["Z"].abs() > anomaly_threshold, keys + ["CALENDAR_DATE", "DATAVALUE", "Z"]]
+        .assign(ABS_Z=lambda d: d["Z"].abs())
+        .nlargest(max_anomalies, "ABS_Z")
+        .drop(columns="ABS_Z")
+    )
+
+    return {"stats": stats, "daily": daily, "anomalies": anomalies}
+
+
+def downsample_energy_data(df: pd.DataFrame, freq: str = "6h") -> pd.DataFrame:
+    """按时间窗口对每个地区/数据类型取平均值"""
+    return (
+        df.groupby(["REGIONID", "DATATYPE", pd.Grouper(key="CALENDAR_DATE", freq=freq)], observed=True)["DATAVALUE"]
+        .mean()
+        .reset_index()
+    )
+
+
+def format_summary(df: pd.DataFrame, summary: Dict[str, pd.DataFrame], downsampled: Optional[pd.DataFrame] = None) -> str:
+    """把预聚合结果格式化为紧凑的文本，供提示词使用"""
+    start, end = df["CALENDAR_DATE"].min(), df["CALENDAR_DATE"].max()
+    regions = ", ".join(sorted(df["REGIONID"].astype(str).unique()))
+    datatypes = ", ".join(sorted(df["DATATYPE"].astype(str).unique()))
+    sections = [
+        f"Rows: {len(df)}; Period: {start:%Y-%m-%d %H:%M} ~ {end:%Y-%m-%d %H:%M}",
+        f"Regions: {regions}",
+        f"Data types: {datatypes}",
+        "",
+        "Statistics per region and data type:",
+        summary["stats"].to_csv(index=False, float_format="%.1f").strip(),
+        "",
+        "Daily totals:",
+        summary["daily"].to_csv(index=False, float_format="%.1f").strip(),
+        "",
+    ]
+    if len(summary["anomalies"]):
+        sections += [
+            "Anomalies (robust z-score):",
+            summary["anomalies"].to_csv(index=False, float_format="%.1f", date_format="%Y-%m-%d %H:%M").strip(),
+        ]
+    else:
+        sections.append("Anomalies: none")
+    if downsampled is not None:
+        sections += [
+            "",
+            "Downsampled values (mean per window):",
+            downsampled.to_csv(index=False, float_format="%.1f", date_format="%Y-%m-%d %H:%M").strip(),
+        ]
+    return "\n".join(sections)
+
+
+def prepare_source(source: str, mode: str = SUMMARY, freq: str = "6h") -> str:
+    """按模式返回放入提示词的数据源文本：raw 原样返回，summary 为统计摘要，summary+downsampled 额外附带降采样表"""
+    if mode not in SOURCE_MODES:
+        raise ValueError(f"不支持的数据源模式: {mode}")
+    if mode == RAW:
+        return source
+    df = load_energy_csv(source)
+    if df.empty:
+        raise ValueError("数据源中没有有效的数据行")
+    downsampled = downsample_energy_data(df, freq) if mode == SUMMARY_DOWNSAMPLED else None
+    return format_summary(df, summarize_energy_data(df), downsampled)
@@ -0,0 +1,418 @@
+"""CheckEval 清单评估：对每个问题给出结构化的 Yes/No 结果并汇总得分。
+
+两种模式：
+    batched  - 所有问题放进同一个提示词，一次调用后逐题解析答案
+    parallel - 每个问题单独调用，在多个 (provider, model) 之间轮流分配并发执行
+
+constrained=True 时改用模型层的约束输出（generate_yes_no）：支持的提供商以 JSON 格式或单个 token
+回答，输出 token 大幅减少，并由 logprobs 给出每题 P(Yes)，汇总为校准后的 expected_score；
+不支持的提供商退回普通文本并按正则解析。
+
+提示词超出模型上下文时，数据源按 token 预算切块并发评估（map），再逐题合并（reduce）：
+- 正面问题（'Yes' 为正面答案，如 "Does the report include all ...?"）所有数据块都回答 Yes 时才为 Yes
+- 反面问题（'Yes' 表示存在问题，如 "Is any ... missing?"）任一数据块回答 Yes 即为 Yes
+问题可以用 {"text": ..., "positive": false} 显式标明方向，未标明时按措辞（missing/omitted/遗漏等）判断。
+"""
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import json
+import math
+import re
+import time
+
+from app.cache import generate_with_cache
+from app.metrics import collect_usage
+from app.models.catalog import AUTO, resolve_target
+from app.models.factory import AIModelFactory
+from app.prompts import CHECKEVAL_EVALUATE, get_template
+from app.tokens import estimate_messages_tokens, prompt_budget, split_by_tokens
+
+BATCHED = "batched"
+PARALLEL = "parallel"
+
+_YES_NO = re.compile(r"\b(yes|no)\b|(是|否)", re.IGNORECASE)
+_NUMBERED = re.compile(r"^\s*(?:Q|Question\s*)?(\d+)\s*[.、:：)\]]\s*(.*)$", re.IGNORECASE)
+# 回答 Yes 表示存在问题的措辞
+_NEGATIVE = re.compile(r"\b(missing|omit(?:s|ted)?|left out|lack(?:s|ing)?|absent)\b|遗漏|缺少|缺失|漏掉", re.IGNORECASE)
+
+ALL_YES = "all_yes"
+ANY_YES = "any_yes"
+
+
+def build_messages(aspect: str, definition: str, source: str, report: str, questions: List[str],
+                   version: Optional[int] = None) -> List[Dict[str, str]]:
+    """按 checkeval.evaluate 模板渲染评估消息，version 为 None 时使用最新版本
+
+    最新版本中不变的指令、数据源和报告在前，逐次变化的问题放在最后一条消息中，同一次评估的
+    所有调用共享完全相同的前缀，OpenAI/DeepSeek 的自动前缀缓存和 Gemini 的上下文缓存因此可以复用这部分 token。
+    """
+    return get_template(CHECKEVAL_EVALUATE, version).render_messages({
+        "aspect": aspect, "definition": definition, "source": source, "report": report, "questions": questions
+    })
+
+
+def parse_answer(text: str) -> Optional[str]:
+    """从一段回答中提取第一个 Yes/No，兼容 **Yes**、Answer: No、是/否 等写法"""
+    match = _YES_NO.search(text or "")
+    if not match:
+        return None
+    word = (match.group(1) or match.group(2)).lower()
+    return "Yes" if word in ("yes", "是") else "No"
+
+
+def parse_batched_answers(text: str, count: int) -> List[Optional[str]]:
+    """解析一次回答中的多题答案，优先按编号匹配，否则按出现顺序匹配"""
+    answers: List[Optional[str]] = [None] * count
+    numbered = False
+    for line in (text or "").splitlines():
+        match = _NUMBERED.match(line)
+        if not match:
+            continue
+        index = int(match.group(1)) - 1
+        if 0 <= index < count and answers[index] is None:
+            answers[index] = parse_answer(match.group(2))
+            numbered = True
+    if numbered:
+        return answers
+
+    in_order = [parse_answer(m.group(0)) for m in _YES_NO.finditer(text or "")]
+    if len(in_order) == count:
+        return in_order
+    return answers
+
+
+def summarize(results: List[Dict]) -> Dict:
+    yes = sum(1 for r in results if r["answer"] == "Yes")
+    no = sum(1 for r in results if r["answer"] == "No")
+    answered = yes + no
+    # 有 P(Yes) 的问题按概率计分，得到校准后的期望得分
+    probs = [r["p_yes"] for r in results if r.get("p_yes") is not None]
+    return {
+        "yes": yes,
+        "no": no,
+        "unknown": len(results) - answered,
+        "errors": sum(1 for r in results if r.get("error")),
+        "score": yes / answered if answered else None,
+        "expected_score": sum(probs) / len(probs) if probs else None
+    }
+
+
+async def _yes_no(ai_model, messages: List[Dict[str, str]], count: int) -> str:
+    # 以 JSON 字符串返回，便于复用响应缓存
+    return json.dumps(await ai_model.generate_yes_no(messages, count))
+
+
+async def _call(provider: str, model_name: Optional[str], messages: List[Dict[str, str]], usage: Dict,
+                constrained: Optional[int] = None) -> Tuple[Dict, float]:
+    """返回 ({"text", "answers", "p_yes"}, 耗时)；constrained 为问题数时使用约束输出"""
+    ai_model = AIModelFactory.get_model(provider, model_name)
+    usage["calls"] += 1
+    usage["tokens_sent"] += estimate_messages_tokens(messages, provider, model_name)
+    start = time.perf_counter()
+    try:
+        if constrained:
+            response, _ = await generate_with_cache(
+                ai_model, provider, model_name, messages,
+                generate=lambda: _yes_no(ai_model, messages, constrained),
+                params={"yes_no": constrained}
+            )
+            data = json.loads(response)
+        else:
+            response, _ = await generate_with_cache(ai_model, provider, model_name, messages)
+            data = {"text": response or "", "answers": None, "p_yes": None}
+    finally:
+        usage["completed"] += 1
+        if usage.get("progress"):
+            usage["progress"](usage["completed"], usage["total"])
+    return data, time.perf_counter() - start
+
+
+async def evaluate_batched(
+    aspect: str, definition: str, source: str, report: str, questions: List[str],
+    provider: str, model_name: Optional[str], usage: Dict, semaphore: asyncio.Semaphore,
+    constrained: bool = False, prompt_version: Optional[int] = None
+) -> List[Dict]:
+    messages = build_messages(aspect, definition, source, report, questions, prompt_version)
+    async with semaphore:
+        try:
+            data, latency = await _call(provider, model_name, messages, usage, len(questions) if constrained else None)
+        except Exception as e:
+            # 与 parallel 模式一致：调用失败时这次调用覆盖的问题都记为出错，不影响整个评估
+            return [
+                {
+                    "question": question, "answer": None, "p_yes": None, "provider": provider,
+                    "model": model_name, "latency": None, "error": str(e)
+                }
+                for question in questions
+            ]
+    answers = data["answers"] or parse_batched_answers(data["text"], len(questions))
+    probs = data["p_yes"] or [None] * len(questions)
+    return [
+        {
+            "question": question,
+            "answer": answer,
+            "p_yes": p_yes,
+            "provider": provider,
+            "model": model_name,
+            # 批量模式下所有问题共享一次调用的耗时
+            "latency": latency,
+            "raw": data["text"]
+        }
+        for question, answer, p_yes in zip(questions, answers, probs)
+    ]
+
+
+async def evaluate_parallel(
+    aspect: str, definition: str, source: str, report: str, questions: List[str],
+    targets: List[Tuple[str, Optional[str]]], usage: Dict, semaphore: asyncio.Semaphore,
+    constrained: bool = False, prompt_version: Optional[int] = None
+) -> List[Dict]:
+    async def one(index: int, question: str) -> Dict:
+        provider, model_name = targets[index % len(targets)]
+        messages = build_messages(aspect, definition, source, report, [question], prompt_version)
+        async with semaphore:
+            try:
+                data, latency = await _call(provider, model_name, messages, usage, 1 if constrained else None)
+            except Exception as e:
+                return {
+                    "question": question, "answer": None, "p_yes": None, "provider": provider,
+                    "model": model_name, "latency": None, "error": str(e)
+                }
+        return {
+            "question": question,
+            "answer": (data["answers"] or [parse_answer(data["text"])])[0],
+            "p_yes": (data["p_yes"] or [None])[0],
+            "provider": provider,
+            "model": model_name,
+            "latency": latency,
+            "raw": data["text"]
+        }
+
+    return await asyncio.gather(*(one(i, q) for i, q in enumerate(questions)))
+
+
+def consensus(answer_lists: List[List[Optional[str]]]) -> Dict:
+    """多个模型对同一组问题的答案做多数投票，并统计一致性
+
+    answer_lists 为每个模型的逐题答案；agreement 为多数答案占已解析答案的比例，
+    pairwise_agreement 为所有模型两两之间答案相同的比例。
+    """
+    count = max((len(answers) for answers in answer_lists), default=0)
+    questions = []
+    agree_pairs = total_pairs = 0
+    for index in range(count):
+        votes = [answers[index] if index < len(answers) else None for answers in answer_lists]
+        yes, no = votes.count("Yes"), votes.count("No")
+        answered = yes + no
+        majority = "Yes" if yes > no else "No" if no > yes else None
+        questions.append({
+            "votes": votes,
+            "yes": yes,
+            "no": no,
+            "unknown": len(votes) - answered,
+            "majority": majority,
+            "agreement": max(yes, no) / answered if answered else None,
+            "unanimous": answered == len(votes) and (yes == 0 or no == 0)
+        })
+        parsed = [v for v in votes if v is not None]
+        for i in range(len(parsed)):
+            for j in range(i + 1, len(parsed)):
+                total_pairs += 1
+                agree_pairs += parsed[i] == parsed[j]
+
+    agreements = [q["agreement"] for q in questions if q["agreement"] is not None]
+    majority_results = [{"answer": q["majority"]} for q in questions]
+    return {
+        "questions": questions,
+        **summarize(majority_results),
+        "mean_agreement": sum(agreements) / len(agreements) if agreements else None,
+        "pairwise_agreement": agree_pairs / total_pairs if total_pairs else None,
+        "unanimous": sum(1 for q in questions if q["unanimous"])
+    }
+
+
+def is_positive(question: str) -> bool:
+    """按措辞判断 'Yes' 是否为正面答案：询问是否遗漏/缺少的问题回答 Yes 表示存在问题"""
+    return not _NEGATIVE.search(question)
+
+
+def normalize_questions(questions: List[Union[str, Dict]]) -> Tuple[List[str], List[bool]]:
+    """问题可以是文本或 {"text": ..., "positive": ...}，返回 (去除空白后的问题, 每题 'Yes' 是否为正面答案)"""
+    texts, positive = [], []
+    for question in questions:
+        if isinstance(question, dict):
+            text, flag = str(question.get("text", "")).strip(), question.get("positive")
+        else:
+            text, flag = question.strip(), None
+        if text:
+            texts.append(text)
+            positive.append(is_positive(text) if flag is None else bool(flag))
+    return texts, positive
+
+
+def reduce_answers(answers: List[Optional[str]], positive: bool = True) -> Optional[str]:
+    """合并各数据块的答案
+
+    正面问题：任一块为 No 则为 No，全部为 Yes 才为 Yes；
+    反面问题：任一块为 Yes 则为 Yes，全部为 No 才为 No；其余情况无法判断。
+    """
+    decisive, other = ("No", "Yes") if positive else ("Yes", "No")
+    if decisive in answers:
+        return decisive
+    if answers and all(answer == other for answer in answers):
+        return other
+    return None
+
+
+def reduce_p_yes(probs: List[Optional[float]], positive: bool = True) -> Optional[float]:
+    """与 reduce_answers 一致，按各块独立估计：正面问题为各块 P(Yes) 之积，反面问题为 1 - ∏(1 - P(Yes))"""
+    if not probs or any(p is None for p in probs):
+        return None
+    if positive:
+        return math.prod(probs)
+    return 1 - math.prod(1 - p for p in probs)
+
+
+def split_source(
+    aspect: str, definition: str, source: str, report: str, questions: List[str],
+    targets: List[Tuple[str, Optional[str]]], mode: str, prompt_version: Optional[int] = None
+) -> List[str]:
+    """提示词超出任一目标模型的上下文时，按最小的剩余预算切分数据源"""
+    # parallel 模式下每次调用只包含一个问题，按最长的问题估算
+    prompt_questions = questions if mode == BATCHED else [max(questions, key=len)]
+    active_targets = targets[:1] if mode == BATCHED else targets
+
+    budgets = []
+    for provider, model_name in active_targets:
+        budget = prompt_budget(provider, model_name)
+        if budget is None:
+            continue
+        full = estimate_messages_tokens(
+            build_messages(aspect, definition, source, report, prompt_questions, prompt_version), provider, model_name
+        )
+        if full <= budget:
+            continue
+        overhead = estimate_messages_tokens(
+            build_messages(aspect, definition, "", report, prompt_questions, prompt_version), provider, model_name
+        )
+        if overhead >= budget:
+            raise ValueError(f"报告和问题本身已超出 {provider} {model_name or ''} 的上下文，无法切分数据源")
+        budgets.append((budget - overhead, provider, model_name))
+
+    if not budgets:
+        return [source]
+    budget, provider, model_name = min(budgets)
+    return split_by_tokens(source, budget, provider, model_name)
+
+
+def resolve_auto_targets(
+    aspect: str, definition: str, source: str, report: str, questions: List[str],
+    targets: List[Tuple[str, Optional[str]]], mode: str, constrained: bool, prompt_version: Optional[int] = None
+) -> List[Tuple[str, Optional[str]]]:
+    """auto 目标按完整的评估提示词选择模型；没有模型能容纳完整提示词时按不含数据源的提示词选择，再切分数据源"""
+    if not any(provider == AUTO for provider, _ in targets):
+        return targets
+    prompt_questions = questions if mode == BATCHED else [max(questions, key=len)]
+    # 批量模式的约束输出为 JSON 数组
+    json_output = constrained and mode == BATCHED and len(questions) > 1
+    resolved = []
+    for provider, model_name in targets:
+        try:
+            messages = build_messages(aspect, definition, source, report, prompt_questions, prompt_version)
+            resolved.append(resolve_target(provider, model_name, messages, json_output=json_output))
+        except ValueError:
+            messages = build_messages(aspect, definition, "", report, prompt_questions, prompt_version)
+            resolved.append(resolve_target(provider, model_name, messages, json_output=json_output))
+    return resolved
+
+
+async def evaluate(
+    aspect: str, definition: str, source: str, report: str, questions: List[Union[str, Dict]],
+    targets: List[Tuple[str, Optional[str]]], mode: str = BATCHED, concurrency: int = 8,
+    source_mode: str = "raw", progress: Optional[Callable[[int, int], None]] = None,
+    constrained: bool = False, prompt_version: Optional[int] = None
+) -> Dict:
+    """progress(已完成调用数, 总调用数) 在每次模型调用结束后被调用；constrained 见模块说明；
+    prompt_version 为 checkeval.evaluate 模板的版本，None 时使用最新版本，所用版本记录在结果的 prompt 中"""
+    questions, positive = normalize_questions(questions)
+    if not questions:
+        raise ValueError("没有需要评估的问题")
+    if not targets:
+        raise ValueError("至少需要一个评估模型")
+    if mode not in (BATCHED, PARALLEL):
+        raise ValueError(f"不支持的评估模式: {mode}")
+    template = get_template(CHECKEVAL_EVALUATE, prompt_version)
+    prompt_version = template.version
+
+    start = time.perf_counter()
+    if source_mode != "raw":
+        # pandas 较重，只在需要预聚合时导入；解析放到线程中，避免阻塞事件循环
+        from app.energy_data import prepare_source
+        source = await asyncio.to_thread(prepare_source, source, source_mode)
+
+    targets = await asyncio.to_thread(
+        resolve_auto_targets, aspect, definition, source, report, questions, targets, mode, constrained, prompt_version
+    )
+    chunks = await asyncio.to_thread(
+        split_source, aspect, definition, source, report, questions, targets, mode, prompt_version
+    )
+    total = len(chunks) if mode == BATCHED else len(chunks) * len(questions)
+    usage = {"calls": 0, "tokens_sent": 0, "completed": 0, "total": total, "progress": progress}
+    if progress:
+        progress(0, total)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def evaluate_chunk(chunk: str) -> List[Dict]:
+        if mode == BATCHED:
+            provider, model_name = targets[0]
+            return await evaluate_batched(
+                aspect, definition, chunk, report, questions, provider, model_name, usage, semaphore,
+                constrained, prompt_version
+            )
+        return await evaluate_parallel(
+            aspect, definition, chunk, report, questions, targets, usage, semaphore, constrained, prompt_version
+        )
+
+    # map: 各数据块并发评估
+    with collect_usage() as provider_usage:
+        partials = await asyncio.gather(*(evaluate_chunk(chunk) for chunk in chunks))
+    if len(partials) == 1:
+        results = partials[0]
+    else:
+        # reduce: 逐题合并各块答案
+        results = []
+        for index, question in enumerate(questions):
+            per_chunk = [partial[index] for partial in partials]
+            latencies = [r["latency"] for r in per_chunk if r.get("latency") is not None]
+            errors = [r["error"] for r in per_chunk if r.get("error")]
+            merged = {
+                "question": question,
+                "answer": reduce_answers([r["answer"] for r in per_chunk], positive[index]),
+                "p_yes": reduce_p_yes([r["p_yes"] for r in per_chunk], positive[index]),
+                # 合并规则：all_yes 所有块为 Yes 才为 Yes，any_yes 任一块为 Yes 即为 Yes
+                "reduce": ALL_YES if positive[index] else ANY_YES,
+                "provider": per_chunk[0]["provider"],
+                "model": per_chunk[0]["model"],
+                "latency": max(latencies) if latencies else None,
+                "chunk_answers": [r["answer"] for r in per_chunk]
+            }
+            if errors:
+                merged["error"] = errors[0]
+            results.append(merged)
+    for result, flag in zip(results, positive):
+        result["positive"] = flag
+
+    return {
+        "mode": mode,
+        "constrained": constrained,
+        # 所用的提示词模板版本，便于复现结果
+        "prompt": {"name": template.name, "version": template.version},
+        "results": results,
+        **summarize(results),
+        "chunks": len(chunks),
+        "calls": usage["calls"],
+        "tokens_sent": usage["tokens_sent"],
+        # 提供商实际返回的 token 用量，cached_tokens 为命中提示词前缀缓存的部分
+        "usage": provider_usage,
+        "latency": time.perf_counter() - start
+    }
@@ -0,0 +1,73 @@
+"""多模型并发对比：同一个提示词同时发给多个 (provider, model)，按完成顺序返回结果。
+
+总耗时取决于最慢的模型而不是所有模型之和；给出问题数时把每个模型的回答解析为
+逐题 Yes/No，并计算多数投票和一致性统计。
+"""
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from app.cache import generate_with_cache
+from app.evaluation import consensus, parse_answer, parse_batched_answers
+from app.models.factory import AIModelFactory
+
+Target = Tuple[str, Optional[str]]
+
+
+async def _run_target(index: int, provider: str, model_name: Optional[str],
+                      messages: List[Dict[str, str]], bypass_cache: bool, questions: Optional[int]) -> Dict:
+    record = {"index": index, "provider": provider, "model": model_name}
+    start = time.perf_counter()
+    try:
+        ai_model = AIModelFactory.get_model(provider, model_name)
+        response, cache_status = await generate_with_cache(
+            ai_model, provider, model_name, messages, bypass=bypass_cache
+        )
+    except Exception as e:
+        record.update(status="error", error=str(e) or type(e).__name__, latency=time.perf_counter() - start)
+        return record
+    record.update(status="success", message=response, cache_status=cache_status, latency=time.perf_counter() - start)
+    if questions:
+        record["answers"] = parse_batched_answers(response, questions) if questions > 1 else [parse_answer(response)]
+    return record
+
+
+async def fan_out(
+    targets: List[Target],
+    messages: List[Dict[str, str]],
+    bypass_cache: bool = False,
+    questions: Optional[int] = None
+) -> AsyncIterator[Dict]:
+    """并发调用所有目标，按完成顺序产出每个目标的结果，最后产出汇总（type 为 summary）"""
+    if not targets:
+        raise ValueError("至少需要一个目标模型")
+    start = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(_run_target(i, provider, model_name, messages, bypass_cache, questions))
+        for i, (provider, model_name) in enumerate(targets)
+    ]
+    results = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            results.append(result)
+            yield {"type": "result", **result}
+    finally:
+        # 客户端断开时取消尚未完成的调用
+        for task in tasks:
+            task.cancel()
+
+    summary = {
+        "type": "summary",
+        "targets": len(targets),
+        "succeeded": sum(1 for r in results if r["status"] == "success"),
+        "latency": time.perf_counter() - start,
+        "per_target": [
+            {key: r.get(key) for key in ("index", "provider", "model", "status", "latency")}
+            for r in sorted(results, key=lambda r: r["index"])
+        ]
+    }
+    if questions:
+        answered = [r["answers"] for r in sorted(results, key=lambda r: r["index"]) if r["status"] == "success"]
+        summary["consensus"] = consensus(answered)
+    yield summary
@@ -0,0 +1,493 @@
+"""持久化的异步任务队列：长时间运行的评估不再占用一个 HTTP 连接。
+
+POST /jobs 立即返回任务 id，由后台的异步 worker 池执行；任务状态、进度和结果保存在
+本地 SQLite 中，服务重启后未完成的任务会重新排队执行。
+
+任务分为两条优先级通道：
+    interactive - 交互式聊天，worker 空闲时总是优先执行
+    bulk        - 批量 CheckEval 评估，最多占用 JOBS_BULK_WORKERS 个 worker，
+                  保证至少有一个 worker 留给交互式请求
+
+多 worker 进程部署时（见 app.shared_state）各进程共用同一个任务库：执行前原子地认领任务，
+空闲时定期从任务库领取其他进程提交的任务，取消请求和进度也通过任务库在进程之间传递。
+停机时不再领取新任务，等待执行中的任务完成（最多 drain_timeout 秒），仍未完成的任务重新排队，
+由其他进程或下次启动时继续执行。任务库的读写可能等待其他进程释放 SQLite 写锁（或等待落盘），
+JobQueue 通过 JobStore 的 a* 方法在线程中访问任务库，不阻塞事件循环。
+
+通过环境变量配置:
+    JOBS_SQLITE_PATH=jobs.db   任务存储路径
+    JOBS_WORKERS=4             worker 数量（每个进程）
+    JOBS_BULK_WORKERS=3        bulk 通道最多占用的 worker 数，默认 JOBS_WORKERS-1
+    JOBS_POLL_INTERVAL=1       多进程部署时检查任务库的间隔（秒）
+"""
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.shared_state import get_shared_state
+
+CHAT = "chat"
+EVALUATE = "evaluate"
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+DEFAULT_LANES = {CHAT: INTERACTIVE, EVALUATE: BULK}
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL = (SUCCEEDED, FAILED, CANCELLED)
+
+_COLUMNS = ("id", "kind", "lane", "status", "progress", "result", "error", "created_at", "started_at", "finished_at", "worker")
+
+
+class JobStore:
+    """任务的 SQLite 存储，payload 与结果以 JSON 文本保存"""
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._lock = threading.Lock()
+        # WAL 模式下多个进程可以同时读取任务状态
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT, lane TEXT, status TEXT, payload TEXT, progress TEXT, "
+            "result TEXT, error TEXT, created_at REAL, started_at REAL, finished_at REAL, worker TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "worker" not in columns:
+            # 旧版本创建的任务库没有执行进程列
+            self._db.execute("ALTER TABLE jobs ADD COLUMN worker TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.commit()
+
+    def create(self, job_id: str, kind: str, lane: str, payload: Dict) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, lane, status, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, lane, QUEUED, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            self._db.commit()
+
+    def update(self, job_id: str, expected: Optional[str] = None, **fields: Any) -> bool:
+        """更新任务字段；指定 expected 时只在任务处于该状态时更新，返回是否更新成功"""
+        for key in ("progress", "result"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        query = f"UPDATE jobs SET {assignments} WHERE id = ?"
+        params = (*fields.values(), job_id)
+        if expected is not None:
+            query += " AND status = ?"
+            params += (expected,)
+        with self._lock:
+            updated = self._db.execute(query, params).rowcount > 0
+            self._db.commit()
+        return updated
+
+    def claim(self, job_id: str, worker: str) -> bool:
+        """把排队中的任务标记为由 worker 执行；任务已被其他进程认领或已取消时返回 False"""
+        return self.update(job_id, expected=QUEUED, status=RUNNING, started_at=time.time(), error=None, worker=worker)
+
+    def queued(self, limit: int) -> List[Dict]:
+        """最早提交的排队中任务的 id 和通道"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, lane FROM jobs WHERE status = ? ORDER BY created_at LIMIT ?", (QUEUED, limit)
+            ).fetchall()
+        return [{"id": job_id, "lane": lane} for job_id, lane in rows]
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def payload(self, job_id: str) -> Dict:
+        with self._lock:
+            row = self._db.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0])
+
+    def recent(self, limit: int = 50, status: Optional[str] = None) -> List[Dict]:
+        query = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+        params: tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, (*params, limit)).fetchall()
+        # 列表中不返回结果内容，避免响应过大
+        return [{**self._to_dict(row), "result": None} for row in rows]
+
+    def unfinished(self) -> List[Dict]:
+        """上次退出时仍在排队或执行中的任务，按提交顺序返回"""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    async def acreate(self, job_id: str, kind: str, lane: str, payload: Dict) -> None:
+        await asyncio.to_thread(self.create, job_id, kind, lane, payload)
+
+    async def aupdate(self, job_id: str, expected: Optional[str] = None, **fields: Any) -> bool:
+        return await asyncio.to_thread(self.update, job_id, expected, **fields)
+
+    async def aclaim(self, job_id: str, worker: str) -> bool:
+        return await asyncio.to_thread(self.claim, job_id, worker)
+
+    async def aqueued(self, limit: int) -> List[Dict]:
+        return await asyncio.to_thread(self.queued, limit)
+
+    async def aget(self, job_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.get, job_id)
+
+    async def apayload(self, job_id: str) -> Dict:
+        return await asyncio.to_thread(self.payload, job_id)
+
+    async def arecent(self, limit: int = 50, status: Optional[str] = None) -> List[Dict]:
+        return await asyncio.to_thread(self.recent, limit, status)
+
+    async def aunfinished(self) -> List[Dict]:
+        return await asyncio.to_thread(self.unfinished)
+
+    async def acounts(self) -> Dict[str, int]:
+        return await asyncio.to_thread(self.counts)
+
+    @staticmethod
+    def _to_dict(row) -> Dict:
+        job = dict(zip(_COLUMNS, row))
+        for key in ("progress", "result"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+
+async def _run_chat(payload: Dict, progress: Callable[[int, int], None]) -> Dict:
+    from app.routing import generate_with_routing
+
+    progress(0, 1)
+    result = await generate_with_routing(
+        [tuple(target) for target in payload["targets"]],
+        payload["messages"],
+        hedge_delay=payload.get("hedge_delay"),
+        attempt_timeout=payload.get("attempt_timeout"),
+        bypass_cache=payload.get("bypass_cache", False)
+    )
+    progress(1, 1)
+    return result
+
+
+async def _run_evaluate(payload: Dict, progress: Callable[[int, int], None]) -> Dict:
+    from app.evaluation import evaluate
+
+    params = dict(payload)
+    params["targets"] = [tuple(target) for target in params["targets"]]
+    return await evaluate(**params, progress=progress)
+
+
+# 任务类型 -> 执行函数，函数接收 payload 和进度回调，返回可 JSON 序列化的结果
+RUNNERS: Dict[str, Callable[[Dict, Callable[[int, int], None]], Awaitable[Any]]] = {
+    CHAT: _run_chat,
+    EVALUATE: _run_evaluate,
+}
+
+
+class JobQueue:
+    def __init__(
+        self,
+        store: JobStore,
+        workers: int = 4,
+        bulk_workers: Optional[int] = None,
+        shared: bool = False,
+        poll_interval: float = 1.0
+    ):
+        self.store = store
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self.worker_id = str(os.getpid())
+        self._draining = False
+        self.workers = max(1, workers)
+        self.bulk_workers = max(1, bulk_workers if bulk_workers is not None else self.workers - 1)
+        self._lanes: Dict[str, Deque[str]] = {lane: deque() for lane in LANES}
+        self._lane_of: Dict[str, str] = {}
+        self._bulk_running = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancel_requested: set = set()
+        # 每个任务一个 Event，状态变化时触发，供流式进度使用
+        self._changed: Dict[str, asyncio.Event] = {}
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        workers = int(os.getenv("JOBS_WORKERS", 4))
+        bulk_workers = os.getenv("JOBS_BULK_WORKERS")
+        return cls(
+            JobStore(os.getenv("JOBS_SQLITE_PATH", "jobs.db")),
+            workers=workers,
+            bulk_workers=int(bulk_workers) if bulk_workers else None,
+            shared=get_shared_state().shared,
+            poll_interval=float(os.getenv("JOBS_POLL_INTERVAL", 1))
+        )
+
+    async def start(self) -> None:
+        self._condition = asyncio.Condition()
+        self._draining = False
+        # 重启前未完成的任务重新排队；已完成的模型调用通常能命中响应缓存。
+        # 多进程部署时其他进程仍在执行的任务不受影响，只回收执行进程已退出的任务
+        for job in await self.store.aunfinished():
+            if job["status"] == RUNNING:
+                if self.shared and _process_alive(job["worker"]):
+                    continue
+                await self.store.aupdate(job["id"], expected=RUNNING, status=QUEUED, started_at=None, worker=None)
+            self._enqueue(job["id"], job["lane"])
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 0) -> None:
+        """停止领取新任务，等待执行中的任务最多 drain_timeout 秒，仍未完成的任务重新排队"""
+        async with self._condition:
+            self._draining = True
+            self._condition.notify_all()
+        if self._workers and drain_timeout > 0:
+            await asyncio.wait(self._workers, timeout=drain_timeout)
+        interrupted = list(self._running)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job_id in interrupted:
+            await self.store.aupdate(job_id, expected=RUNNING, status=QUEUED, started_at=None, worker=None)
+        self.store.close()
+
+    async def submit(self, kind: str, payload: Dict, lane: Optional[str] = None) -> Dict:
+        if kind not in RUNNERS:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        lane = lane or DEFAULT_LANES.get(kind, INTERACTIVE)
+        if lane not in LANES:
+            raise ValueError(f"不支持的优先级通道: {lane}，可选 {', '.join(LANES)}")
+        job_id = uuid.uuid4().hex
+        await self.store.acreate(job_id, kind, lane, payload)
+        async with self._condition:
+            self._enqueue(job_id, lane)
+            self._condition.notify_all()
+        return await self.store.aget(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await self.store.aget(job_id)
+
+    async def recent(self, limit: int = 50, status: Optional[str] = None) -> List[Dict]:
+        return await self.store.arecent(limit, status)
+
+    async def cancel(self, job_id: str) -> Optional[Dict]:
+        job = await self.store.aget(job_id)
+        if job is None or job["status"] in TERMINAL:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancel_requested.add(job_id)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            async with self._condition:
+                lane = self._lane_of.pop(job_id, None)
+                if lane and job_id in self._lanes[lane]:
+                    self._lanes[lane].remove(job_id)
+            # 任务可能正由其他进程执行，只在状态未变化时标记取消，执行进程会检查到并停止
+            await self._update(job_id, expected=job["status"], status=CANCELLED, finished_at=time.time())
+        return await self.store.aget(job_id)
+
+    async def watch(self, job_id: str, heartbeat: float = 15.0) -> AsyncIterator[Dict]:
+        """每当任务状态或进度变化时产出最新状态，任务结束后停止；没有变化时每 heartbeat 秒重发一次"""
+        # 多进程部署时任务可能由其他进程执行，本进程收不到变化通知，按间隔查询任务库
+        interval = min(self.poll_interval, heartbeat) if self.shared else heartbeat
+        last, sent_at = None, 0.0
+        while True:
+            # 先登记 Event 再读取状态，避免错过两者之间发生的更新
+            event = self._changed.setdefault(job_id, asyncio.Event())
+            job = await self.store.aget(job_id)
+            if job is None:
+                return
+            if job != last or time.monotonic() - sent_at >= heartbeat:
+                yield job
+                last, sent_at = job, time.monotonic()
+            if job["status"] in TERMINAL:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "bulk_workers": self.bulk_workers,
+            "worker_id": self.worker_id,
+            "shared": self.shared,
+            "draining": self._draining,
+            "queued": {lane: len(queue) for lane, queue in self._lanes.items()},
+            "running": len(self._running),
+            "bulk_running": self._bulk_running,
+            "jobs": await self.store.acounts()
+        }
+
+    def _enqueue(self, job_id: str, lane: str) -> None:
+        self._lanes[lane].append(job_id)
+        self._lane_of[job_id] = lane
+
+    async def _update(self, job_id: str, expected: Optional[str] = None, **fields: Any) -> None:
+        await self.store.aupdate(job_id, expected, **fields)
+        self._notify(job_id)
+
+    def _notify(self, job_id: str) -> None:
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _poll(self) -> None:
+        """领取其他进程提交、尚未被认领的任务"""
+        for job in await self.store.aqueued(self.workers * 2):
+            if job["id"] not in self._lane_of:
+                self._enqueue(job["id"], job["lane"])
+
+    async def _next(self) -> Optional[str]:
+        async with self._condition:
+            while True:
+                if self._draining:
+                    return None
+                if self._lanes[INTERACTIVE]:
+                    job_id = self._lanes[INTERACTIVE].popleft()
+                elif self._lanes[BULK] and self._bulk_running < self.bulk_workers:
+                    job_id = self._lanes[BULK].popleft()
+                    self._bulk_running += 1
+                elif self.shared:
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        await self._poll()
+                    continue
+                else:
+                    await self._condition.wait()
+                    continue
+                return job_id
+
+    async def _release(self, lane: str) -> None:
+        async with self._condition:
+            if lane == BULK:
+                self._bulk_running -= 1
+            self._condition.notify_all()
+
+    async def _watch_cancel(self, job_id: str, task: asyncio.Task) -> None:
+        # 其他进程收到的取消请求只写入任务库，执行进程按间隔检查
+        while not task.done():
+            await asyncio.sleep(self.poll_interval)
+            job = await self.store.aget(job_id)
+            if job is not None and job["status"] == CANCELLED:
+                self._cancel_requested.add(job_id)
+                task.cancel()
+                return
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._next()
+            if job_id is None:
+                return
+            lane = self._lane_of.pop(job_id, INTERACTIVE)
+            task = asyncio.ensure_future(self._execute(job_id))
+            self._running[job_id] = task
+            watcher = asyncio.ensure_future(self._watch_cancel(job_id, task)) if self.shared else None
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # worker 本身被取消（服务关闭）时同时取消任务，任务保持 running 以便重启后恢复
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+                if job_id not in self._cancel_requested:
+                    raise
+            finally:
+                if watcher is not None:
+                    watcher.cancel()
+                self._running.pop(job_id, None)
+                self._cancel_requested.discard(job_id)
+                await self._release(lane)
+
+    async def _execute(self, job_id: str) -> None:
+        # 出队后、开始执行前已被取消，或已被其他进程认领
+        if not await self.store.aclaim(job_id, self.worker_id):
+            return
+        self._notify(job_id)
+        job = await self.store.aget(job_id)
+        payload = await self.store.apayload(job_id)
+        # 进度回调是同步的，写入在后台依次进行；结束状态在最后一次进度写入之后写入
+        pending: Optional[asyncio.Future] = None
+
+        async def write_progress(previous: Optional[asyncio.Future], value: Dict) -> None:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await self._update(job_id, progress=value)
+
+        def progress(done: int, total: int) -> None:
+            nonlocal pending
+            pending = asyncio.ensure_future(write_progress(pending, {"done": done, "total": total}))
+
+        async def finish(expected: Optional[str] = None, **fields: Any) -> None:
+            if pending is not None:
+                await asyncio.gather(pending, return_exceptions=True)
+            await self._update(job_id, expected, finished_at=time.time(), **fields)
+
+        try:
+            result = await RUNNERS[job["kind"]](payload, progress)
+        except asyncio.CancelledError:
+            if job_id in self._cancel_requested:
+                await finish(status=CANCELLED)
+            raise
+        except Exception as e:
+            await finish(expected=RUNNING, status=FAILED, error=str(e) or type(e).__name__)
+        else:
+            # 执行期间被其他进程取消的任务保持 cancelled
+            await finish(expected=RUNNING, status=SUCCEEDED, result=result)
+
+
+def _process_alive(worker: Optional[str]) -> bool:
+    """worker 为执行任务的进程号（同一台机器上）"""
+    if not worker or not worker.isdigit():
+        return False
+    try:
+        os.kill(int(worker), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    # 延迟创建，确保在 load_dotenv() 之后读取配置
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue.from_env()
+    return _job_queue
@@ -0,0 +1,268 @@
+"""延迟与吞吐指标：Prometheus 文本格式的 /metrics，以及按阶段计时的 Server-Timing 响应头。
+
+阶段（stage）包括 factory（获取模型实例）、queue（限流排队）、upstream（上游调用）、
+serialize（响应序列化）。同一请求内的阶段耗时通过 ContextVar 汇总到 Server-Timing 中。
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> (各桶计数, 总和, 总数)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP请求总耗时", ("method", "path", "status")))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "正在处理的HTTP请求数", ("path",)))
+CHAT_REQUESTS = REGISTRY.register(Counter(
+    "chat_requests_total", "聊天请求数（按提供商/模型/状态）", ("provider", "model", "status")))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "stage_duration_seconds", "各处理阶段耗时", ("stage", "provider")))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "upstream_requests_total", "上游调用次数（按提供商/模型/状态）", ("provider", "model", "status")))
+UPSTREAM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "upstream_requests_in_flight", "正在进行的上游调用数", ("provider",)))
+TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "提供商返回的 token 用量", ("provider", "model", "type")))
+
+# 当前请求的阶段耗时汇总，由 MetricsMiddleware 在每个请求开始时设置
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+# 当前上下文中提供商返回的 token 用量汇总，由 collect_usage 设置
+_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("token_usage", default=None)
+
+
+def record_stage(stage: str, seconds: float, provider: str = "") -> None:
+    STAGE_DURATION.observe(seconds, stage=stage, provider=provider)
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed_stage(stage: str, provider: str = "") -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, provider)
+
+
+def record_token_usage(provider: str, model: Optional[str], prompt_tokens: Optional[int],
+                       completion_tokens: Optional[int], cached_tokens: Optional[int] = None) -> None:
+    usage = _usage.get()
+    for token_type, count in (("prompt", prompt_tokens), ("completion", completion_tokens), ("cached", cached_tokens)):
+        if count:
+            TOKENS.inc(count, provider=provider, model=model or "", type=token_type)
+            if usage is not None:
+                usage[f"{token_type}_tokens"] += count
+
+
+@contextmanager
+def collect_usage() -> Iterator[Dict[str, int]]:
+    """汇总该上下文内（包括其中创建的任务）所有上游调用返回的 token 用量
+
+    缓存命中或与其他请求合并的调用不产生新的用量。嵌套使用时内层的用量同时计入外层。
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    outer = _usage.get()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+        if outer is not None:
+            for key, count in usage.items():
+                outer[key] += count
+
+
+def record_openai_usage(provider: str, model: Optional[str], usage) -> None:
+    """记录 OpenAI 兼容接口返回的 usage（DeepSeek 同样适用）"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    record_token_usage(
+        provider, model,
+        getattr(usage, "prompt_tokens", None),
+        getattr(usage, "completion_tokens", None),
+        getattr(details, "cached_tokens", None) or getattr(usage, "prompt_cache_hit_tokens", None)
+    )
+
+
+def format_server_timing(timings: Dict[str, float], total: float) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：记录请求耗时与并发数，并在响应头中加入 Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = _route_path(scope)
+        timings: Dict[str, float] = {}
+        token = _stage_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = format_server_timing(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc(path=path)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(path=path)
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start, method=scope["method"], path=path, status=str(status)
+            )
+            _stage_timings.reset(token)
+
+
+def _route_path(scope) -> str:
+    # 使用路由模板（如 /models/{provider}）作为标签，避免标签基数无限增长
+    from starlette.routing import Match
+
+    app = scope.get("app")
+    for route in getattr(app, "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
@@ -1,8 +1,24 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator
 
 class BaseAIModel(ABC):
     @abstractmethod
     async def generate_response(self, messages: List[Dict[str, str]]) -> str:
         """生成AI响应的抽象方法"""
-        pass 
\ No newline at end of file
+        pass
+
+    async def stream_response(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """流式生成AI响应，逐块产出文本；默认退化为一次性返回完整结果"""
+        yield await self.generate_response(messages)
+
+    async def generate_yes_no(self, messages: List[Dict[str, str]], count: int) -> Dict[str, Any]:
+        """回答 count 道 Yes/No 题，返回 {"text", "answers", "p_yes"}
+
+        支持的提供商用 JSON 格式/严格的输出长度约束回答，并由 logprobs 给出每题 P(Yes)；
+        默认退化为普通生成，answers 与 p_yes 为 None，由调用方从文本中解析答案
+        """
+        return {"text": await self.generate_response(messages), "answers": None, "p_yes": None}
+
+    async def aclose(self) -> None:
+        """释放底层连接池等资源，默认无需处理"""
+        pass
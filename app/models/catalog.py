@@ -0,0 +1,387 @@
+"""模型元数据、实时的耗时/错误率估计，以及按成本或延迟自动选择模型的 auto 提供商。
+
+每个模型登记上下文窗口、每百万 token 的输入/输出价格（美元）以及是否支持流式和 JSON 输出，
+这里是模型元数据的唯一来源：各提供商支持的模型列表、token 预算使用的上下文窗口都由此得出。
+每次上游调用结束后记录耗时（流式调用为整个流的耗时）和成败，保留最近 MODEL_STATS_WINDOW 次的滚动窗口。
+
+多 worker 部署时（见 app.shared_state）每个进程把各模型自己的最近调用写入共享状态，并读回所有进程的
+调用按时间合并为滚动窗口，所有进程据此选择模型。同步在记录调用时进行，每个进程至多每
+MODEL_STATS_REFRESH 秒一次（在线程中执行），选择模型时只读进程内的副本，不访问共享状态。
+
+provider 为 auto 时，model_name 为选择策略：
+    cheapest  在满足延迟 SLO 和错误率上限的模型中选择估算成本最低的（默认）
+    fastest   选择最近 p50 耗时最低的模型
+候选模型必须能容纳提示词（并为输出预留 token），需要流式或 JSON 输出时还要支持相应能力；
+样本不足 AUTO_MIN_SAMPLES 的模型视为满足 SLO。没有模型满足 SLO 时退而选择 p95 耗时最低的模型。
+选中的模型之后依次排列其余候选，作为调用失败时的备选（最多 AUTO_FALLBACKS 个）。
+
+通过环境变量配置:
+    AUTO_CANDIDATES=deepseek:deepseek-chat,openai:gpt-4o-mini  候选模型，默认为已配置 API Key 的提供商的模型
+    AUTO_LATENCY_SLO=10            p95 耗时上限（秒），不设置则不限制
+    AUTO_MAX_ERROR_RATE=0.2        错误率上限
+    AUTO_MIN_SAMPLES=5             按 SLO 筛选所需的最少样本数
+    AUTO_EXPECTED_OUTPUT_TOKENS=256  估算成本时假设的输出 token 数
+    AUTO_FALLBACKS=2               选中模型之后追加的备选模型数
+    AUTO_EXPLORE_RATE=0.05         随机改选其他候选模型的概率，使新模型和已恢复的模型也能积累耗时数据
+    MODEL_STATS_WINDOW=100         每个模型保留的最近调用数
+    MODEL_STATS_REFRESH=1          多 worker 时与共享状态同步滚动窗口的最短间隔（秒）
+"""
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import asyncio
+import json
+import math
+import os
+import random
+import time
+
+from app.shared_state import get_shared_state
+from app.tokens import OUTPUT_RESERVE, estimate_messages_tokens, resolve_model_name
+
+AUTO = "auto"
+CHEAPEST = "cheapest"
+FASTEST = "fastest"
+POLICIES = (CHEAPEST, FASTEST)
+
+Target = Tuple[str, Optional[str]]
+
+# 模型调用样本在共享状态中的命名空间前缀，每个模型一个命名空间，每个进程一个条目
+STATS_NAMESPACE = "model_stats"
+# 进程的样本条目超过该时间（秒）未更新时删除（如进程已退出）
+STATS_TTL = 3600
+
+# 未设置 AUTO_CANDIDATES 时，只有配置了 API Key 的提供商参与自动选择
+PROVIDER_KEYS = {
+    "openai": "OPENAI_API_KEY",
+    "gemini": "GOOGLE_API_KEY",
+    "deepseek": "DEEPSEEK_API_KEY",
+}
+
+
+@dataclass
+class ModelInfo:
+    provider: str
+    name: str
+    # 每百万 token 的价格（美元）
+    input_price: float
+    output_price: float
+    streaming: bool = True
+    json_output: bool = False
+    # 是否默认参与 auto 选择（旧版或重复的别名模型不参与）
+    auto: bool = True
+    # 上下文窗口（token），未知时为 None（不做限制）
+    context_window: Optional[int] = None
+
+    def cost(self, prompt_tokens: int, output_tokens: int) -> float:
+        return (prompt_tokens * self.input_price + output_tokens * self.output_price) / 1_000_000
+
+    def fits(self, prompt_tokens: int) -> bool:
+        return self.context_window is None or prompt_tokens + OUTPUT_RESERVE <= self.context_window
+
+
+_catalog: Dict[Target, ModelInfo] = {}
+
+
+def register(info: ModelInfo) -> ModelInfo:
+    _catalog[(info.provider, info.name)] = info
+    return info
+
+
+def get_model_info(provider: str, model_name: Optional[str]) -> Optional[ModelInfo]:
+    return _catalog.get((provider, resolve_model_name(provider, model_name) or model_name))
+
+
+def provider_models() -> Dict[str, List[str]]:
+    """各提供商已登记的模型名，按登记顺序排列"""
+    models: Dict[str, List[str]] = {}
+    for provider, name in _catalog:
+        models.setdefault(provider, []).append(name)
+    return models
+
+
+for _info in (
+    ModelInfo("openai", "gpt-4o-mini", 0.15, 0.60, json_output=True, context_window=128000),
+    ModelInfo("openai", "gpt-4o", 2.50, 10.00, json_output=True, context_window=128000),
+    ModelInfo("openai", "o1", 15.00, 60.00, streaming=False, json_output=True, context_window=200000),
+    ModelInfo("openai", "o3-mini", 1.10, 4.40, json_output=True, context_window=200000),
+    ModelInfo("openai", "o1-mini", 1.10, 4.40, context_window=128000),
+    ModelInfo("openai", "gpt-3.5-turbo", 0.50, 1.50, json_output=True, context_window=16385),
+    ModelInfo("openai", "gpt-3.5-turbo-instruct", 1.50, 2.00, auto=False, context_window=4096),
+    ModelInfo("openai", "gpt-3.5-turbo-16k-0613", 3.00, 4.00, auto=False, context_window=16385),
+    ModelInfo("openai", "gpt-4", 30.00, 60.00, context_window=8192),
+    ModelInfo("gemini", "gemini-pro", 0.50, 1.50, context_window=30720),
+    ModelInfo("deepseek", "deepseek-chat", 0.27, 1.10, json_output=True, context_window=64000),
+    ModelInfo("deepseek", "deepseek-coder", 0.27, 1.10, json_output=True, auto=False, context_window=64000),
+    ModelInfo("deepseek", "deepseek-reasoner", 0.55, 2.19, context_window=64000),
+    # 桩提供商不默认参与自动选择，可通过 AUTO_CANDIDATES=stub:stub 用于压测
+    ModelInfo("stub", "stub", 0.0, 0.0, json_output=True, auto=False),
+):
+    register(_info)
+
+
+class RollingStats:
+    """最近 window 次上游调用的耗时和成败"""
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        # (耗时, 是否成功)
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        # 本进程自己的最近调用 (时间, 耗时, 是否成功)，多 worker 时写入共享状态
+        self.own: Deque[Tuple[float, float, bool]] = deque(maxlen=window)
+        # 本进程的累计调用数和失败数
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.samples.append((latency, ok))
+        self.own.append((time.time(), latency, ok))
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+
+    def load(self, samples: List[Tuple[float, float, bool]]) -> None:
+        """以所有进程的最近调用（按时间排列）替换窗口"""
+        self.samples = deque(((latency, ok) for _, latency, ok in samples[-self.window:]), maxlen=self.window)
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+    def estimate(self) -> Dict[str, Any]:
+        # 耗时只统计成功的调用，失败的调用计入错误率
+        latencies = [latency for latency, ok in self.samples if ok]
+        failures = sum(1 for _, ok in self.samples if not ok)
+        p50, p95 = self._percentile(latencies, 50), self._percentile(latencies, 95)
+        return {
+            "samples": len(self.samples),
+            "error_rate": round(failures / len(self.samples), 4) if self.samples else None,
+            "p50": round(p50, 4) if p50 is not None else None,
+            "p95": round(p95, 4) if p95 is not None else None,
+            "calls": self.calls,
+            "errors": self.errors
+        }
+
+
+_stats: Dict[Target, RollingStats] = {}
+_synced_at = 0.0
+
+
+def _rolling_stats(key: Target) -> RollingStats:
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = RollingStats(int(os.getenv("MODEL_STATS_WINDOW", 100)))
+    return stats
+
+
+def _stats_namespace(key: Target) -> str:
+    return f"{STATS_NAMESPACE}:{key[0]}:{key[1] or ''}"
+
+
+def _sync_stats(own: Dict[Target, List[Tuple[float, float, bool]]],
+                keys: List[Target]) -> Dict[Target, List[Tuple[float, float, bool]]]:
+    """写入本进程各模型的最近调用，返回 keys 中各模型所有进程按时间合并的调用；可能等待 SQLite 写锁，在线程中执行"""
+    state = get_shared_state()
+    pid = str(os.getpid())
+    for key, samples in own.items():
+        state.set(_stats_namespace(key), pid, json.dumps(samples), ttl=STATS_TTL)
+    merged = {}
+    for key in keys:
+        samples = [tuple(sample) for value in state.values(_stats_namespace(key)) for sample in json.loads(value)]
+        merged[key] = sorted(samples)
+    return merged
+
+
+async def record_call(provider: str, model_name: Optional[str], latency: float, ok: bool) -> None:
+    global _synced_at
+    key = (provider, resolve_model_name(provider, model_name) or model_name)
+    _rolling_stats(key).record(latency, ok)
+    if not get_shared_state().shared or time.time() - _synced_at < float(os.getenv("MODEL_STATS_REFRESH", 1)):
+        return
+    # 同一时刻只有一个调用方同步，其余调用只记录到本进程
+    _synced_at = time.time()
+    own = {k: list(stats.own) for k, stats in _stats.items() if stats.own}
+    keys = list(dict.fromkeys([*_catalog, *_stats]))
+    merged = await asyncio.to_thread(_sync_stats, own, keys)
+    for k, samples in merged.items():
+        if samples:
+            _rolling_stats(k).load(samples)
+
+
+def model_estimate(provider: str, model_name: Optional[str]) -> Dict[str, Any]:
+    stats = _stats.get((provider, resolve_model_name(provider, model_name) or model_name))
+    return stats.estimate() if stats else RollingStats().estimate()
+
+
+def _parse_targets(value: str) -> List[Target]:
+    targets = []
+    for item in value.split(","):
+        provider, _, model_name = item.strip().partition(":")
+        if provider:
+            targets.append((provider, model_name or None))
+    return targets
+
+
+@dataclass
+class AutoConfig:
+    candidates: Optional[List[Target]] = None
+    latency_slo: Optional[float] = None
+    max_error_rate: float = 0.2
+    min_samples: int = 5
+    expected_output_tokens: int = 256
+    fallbacks: int = 2
+    explore_rate: float = 0.05
+
+    @classmethod
+    def from_env(cls) -> "AutoConfig":
+        defaults = cls()
+        candidates = os.getenv("AUTO_CANDIDATES")
+        slo = os.getenv("AUTO_LATENCY_SLO")
+        return cls(
+            candidates=_parse_targets(candidates) if candidates else None,
+            latency_slo=float(slo) if slo else None,
+            max_error_rate=float(os.getenv("AUTO_MAX_ERROR_RATE", defaults.max_error_rate)),
+            min_samples=int(os.getenv("AUTO_MIN_SAMPLES", defaults.min_samples)),
+            expected_output_tokens=int(os.getenv("AUTO_EXPECTED_OUTPUT_TOKENS", defaults.expected_output_tokens)),
+            fallbacks=int(os.getenv("AUTO_FALLBACKS", defaults.fallbacks)),
+            explore_rate=float(os.getenv("AUTO_EXPLORE_RATE", defaults.explore_rate))
+        )
+
+    def candidate_models(self) -> List[ModelInfo]:
+        if self.candidates is not None:
+            models = []
+            for provider, model_name in self.candidates:
+                info = get_model_info(provider, model_name)
+                if info is None:
+                    raise ValueError(f"AUTO_CANDIDATES 中的模型没有元数据: {provider}:{model_name or ''}")
+                models.append(info)
+            return models
+        return [
+            info for info in _catalog.values()
+            if info.auto and os.getenv(PROVIDER_KEYS.get(info.provider, ""))
+        ]
+
+
+def _meets_slo(estimate: Dict[str, Any], config: AutoConfig) -> bool:
+    if estimate["samples"] < config.min_samples:
+        return True
+    if estimate["error_rate"] is not None and estimate["error_rate"] > config.max_error_rate:
+        return False
+    if config.latency_slo is not None and estimate["p95"] is not None and estimate["p95"] > config.latency_slo:
+        return False
+    return True
+
+
+def rank_models(
+    policy: str,
+    prompt_tokens: int,
+    streaming: bool = False,
+    json_output: bool = False,
+    config: Optional[AutoConfig] = None
+) -> List[Dict[str, Any]]:
+    """按策略排序能容纳提示词的候选模型，返回带元数据、估算成本和耗时估计的列表"""
+    if policy not in POLICIES:
+        raise ValueError(f"不支持的自动选择策略: {policy}，可选 {', '.join(POLICIES)}")
+    config = config or AutoConfig.from_env()
+    candidates = config.candidate_models()
+    if not candidates:
+        raise ValueError("没有可自动选择的模型，请配置提供商的 API Key 或设置 AUTO_CANDIDATES")
+
+    ranked = []
+    for info in candidates:
+        if not info.fits(prompt_tokens) or (streaming and not info.streaming) or (json_output and not info.json_output):
+            continue
+        estimate = model_estimate(info.provider, info.name)
+        ranked.append({
+            "provider": info.provider,
+            "model": info.name,
+            "cost": info.cost(prompt_tokens, config.expected_output_tokens),
+            "estimate": estimate,
+            "meets_slo": _meets_slo(estimate, config)
+        })
+    if not ranked:
+        raise ValueError(f"没有能容纳约 {prompt_tokens} tokens 提示词且满足输出要求的候选模型")
+
+    def latency(item: Dict) -> float:
+        # 样本不足的模型排在有数据的模型之后
+        p50 = item["estimate"]["p50"]
+        return p50 if p50 is not None and item["estimate"]["samples"] >= config.min_samples else math.inf
+
+    if policy == CHEAPEST:
+        ranked.sort(key=lambda item: (not item["meets_slo"], item["cost"], latency(item)))
+    else:
+        ranked.sort(key=lambda item: (not item["meets_slo"], latency(item), item["cost"]))
+    if not ranked[0]["meets_slo"]:
+        # 没有模型满足 SLO 时选择尾延迟最低的
+        ranked.sort(key=lambda item: item["estimate"]["p95"] if item["estimate"]["p95"] is not None else math.inf)
+
+    # 偶尔改选其他候选（优先样本不足的），新模型能积累数据，耗时或错误率已恢复的模型也能重新入选
+    others = ranked[1:]
+    if others and random.random() < config.explore_rate:
+        unexplored = [item for item in others if item["estimate"]["samples"] < config.min_samples]
+        choice = random.choice(unexplored or others)
+        ranked.remove(choice)
+        ranked.insert(0, choice)
+    return ranked
+
+
+def select_targets(
+    policy: Optional[str],
+    messages: List[Dict[str, str]],
+    streaming: bool = False,
+    json_output: bool = False,
+    config: Optional[AutoConfig] = None
+) -> List[Target]:
+    """auto 提供商：返回选中的模型及其后的备选模型"""
+    config = config or AutoConfig.from_env()
+    prompt_tokens = estimate_messages_tokens(messages, "openai")
+    ranked = rank_models(policy or CHEAPEST, prompt_tokens, streaming, json_output, config)
+    return [(item["provider"], item["model"]) for item in ranked[:1 + max(0, config.fallbacks)]]
+
+
+def resolve_targets(
+    targets: List[Target],
+    messages: List[Dict[str, str]],
+    streaming: bool = False,
+    json_output: bool = False
+) -> List[Target]:
+    """把目标列表中的 auto 展开为具体模型（及备选），去掉重复的目标"""
+    if not any(provider == AUTO for provider, _ in targets):
+        return targets
+    resolved: List[Target] = []
+    for provider, model_name in targets:
+        expanded = select_targets(model_name, messages, streaming, json_output) if provider == AUTO else [(provider, model_name)]
+        resolved.extend(target for target in expanded if target not in resolved)
+    return resolved
+
+
+def resolve_target(
+    provider: str,
+    model_name: Optional[str],
+    messages: List[Dict[str, str]],
+    streaming: bool = False,
+    json_output: bool = False
+) -> Target:
+    if provider != AUTO:
+        return provider, model_name
+    return select_targets(model_name, messages, streaming, json_output)[0]
+
+
+def catalog() -> Dict[str, Any]:
+    config = AutoConfig.from_env()
+    return {
+        "models": [
+            {**asdict(info), "stats": model_estimate(info.provider, info.name)}
+            for info in _catalog.values()
+        ],
+        "auto": {
+            "policies": list(POLICIES),
+            "candidates": [f"{info.provider}:{info.name}" for info in config.candidate_models()],
+            "latency_slo": config.latency_slo,
+            "max_error_rate": config.max_error_rate,
+            "min_samples": config.min_samples
+        }
+    }
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from typing import Optional
+import os
+
+@dataclass
+class ClientConfig:
+    """单个提供商的HTTP连接池、超时与限流配置"""
+    timeout: float = 60.0
+    connect_timeout: float = 5.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    base_url: Optional[str] = None
+    # 每分钟请求数/token数上限，None 表示不限制
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    # 自适应并发上限的初始值与最大值
+    initial_concurrency: int = 64
+    max_concurrency: int = 64
+    # 遇到 429/5xx 等可重试错误时的最大重试次数
+    max_retries: int = 3
+
+def _env(provider: str, key: str, default, cast=float):
+    value = os.getenv(f"{provider.upper()}_{key}")
+    return cast(value) if value not in (None, "") else default
+
+def get_client_config(provider: str) -> ClientConfig:
+    """从环境变量读取提供商配置，例如 DEEPSEEK_TIMEOUT、DEEPSEEK_MAX_CONNECTIONS、DEEPSEEK_RPM"""
+    defaults = ClientConfig()
+    return ClientConfig(
+        timeout=_env(provider, "TIMEOUT", defaults.timeout),
+        connect_timeout=_env(provider, "CONNECT_TIMEOUT", defaults.connect_timeout),
+        max_connections=_env(provider, "MAX_CONNECTIONS", defaults.max_connections, int),
+        max_keepalive_connections=_env(provider, "MAX_KEEPALIVE", defaults.max_keepalive_connections, int),
+        keepalive_expiry=_env(provider, "KEEPALIVE_EXPIRY", defaults.keepalive_expiry),
+        base_url=_env(provider, "BASE_URL", defaults.base_url, str),
+        requests_per_minute=_env(provider, "RPM", defaults.requests_per_minute),
+        tokens_per_minute=_env(provider, "TPM", defaults.tokens_per_minute),
+        initial_concurrency=_env(provider, "INITIAL_CONCURRENCY", defaults.initial_concurrency, int),
+        max_concurrency=_env(provider, "MAX_CONCURRENCY", defaults.max_concurrency, int),
+        max_retries=_env(provider, "MAX_RETRIES", defaults.max_retries, int),
+    )
+
+def build_openai_http_client(config: ClientConfig):
+    """为 OpenAI 兼容客户端构造带连接池限制的 httpx 客户端"""
+    import httpx
+    from openai import DefaultAsyncHttpxClient
+
+    return DefaultAsyncHttpxClient(
+        timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+    )
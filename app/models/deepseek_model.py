@@ -1,22 +1,53 @@
-from typing import List, Dict
-from openai import OpenAI
+from typing import Any, List, Dict, AsyncIterator
+from openai import AsyncOpenAI
 from .base import BaseAIModel
+from .client_config import get_client_config, build_openai_http_client
+from .yes_no import openai_yes_no
+from app.metrics import record_openai_usage
 import os
 
 class DeepSeekModel(BaseAIModel):
     def __init__(self, model_name: str = "deepseek-chat"):
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
         self.model_name = model_name
-        self.client = OpenAI(
+        # 约束输出（JSON 模式 / logprobs）是否可用，请求被拒绝后置为 False；deepseek-reasoner 不支持
+        self.constrained_output = model_name != "deepseek-reasoner"
+        config = get_client_config("deepseek")
+        # 使用异步客户端，避免上游请求阻塞事件循环；连接池在实例生命周期内复用
+        self.client = AsyncOpenAI(
             api_key=self.api_key,
-            base_url="https://api.deepseek.com"
+            base_url=config.base_url or "https://api.deepseek.com",
+            http_client=build_openai_http_client(config),
+            # 重试由 app.ratelimit 统一处理（含退避与 Retry-After），避免SDK内部重复重试
+            max_retries=0
         )
 
     async def generate_response(self, messages: List[Dict[str, str]]) -> str:
-        response = self.client.chat.completions.create(
+        response = await self.client.chat.completions.create(
             model=self.model_name,
             messages=messages,
             stream=False
         )
         
-        return response.choices[0].message.content
\ No newline at end of file
+        record_openai_usage("deepseek", self.model_name, response.usage)
+        return response.choices[0].message.content
+
+    async def stream_response(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            stream=True,
+            # 最后一个块携带整次请求的 token 用量
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                record_openai_usage("deepseek", self.model_name, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def generate_yes_no(self, messages: List[Dict[str, str]], count: int) -> Dict[str, Any]:
+        return await openai_yes_no(self, "deepseek", messages, count)
+
+    async def aclose(self) -> None:
+        await self.client.close()
@@ -1,34 +1,98 @@
-from typing import Dict, Type, List
+from typing import Dict, Type, List, Optional, Tuple, Union
+import importlib
 from .base import BaseAIModel
-from .openai_model import OpenAIModel
-from .gemini_model import GeminiModel
-from .deepseek_model import DeepSeekModel
+from .catalog import AUTO, POLICIES, ModelInfo, get_model_info, provider_models, register
 
 class AIModelFactory:
-    _models: Dict[str, Type[BaseAIModel]] = {
-        "openai": OpenAIModel,
-        "gemini": GeminiModel,
-        "deepseek": DeepSeekModel
+    # 提供商按 "模块路径:类名" 注册，首次使用时才导入对应的SDK
+    _models: Dict[str, Union[str, Type[BaseAIModel]]] = {
+        "openai": "app.models.openai_model:OpenAIModel",
+        "gemini": "app.models.gemini_model:GeminiModel",
+        "deepseek": "app.models.deepseek_model:DeepSeekModel",
+        # 不访问网络的桩提供商，用于基准测试和压测（见 STUB_* 环境变量）
+        "stub": "app.models.stub_model:StubModel"
     }
 
+    # 各提供商支持的模型来自 app.models.catalog 的元数据
     _provider_models = {
-        "openai": ["gpt-4o-mini", "gpt-4o", "o1", "o3-mini", "o1-mini",
-                  "gpt-3.5-turbo", "gpt-3.5-turbo-instruct", 
-                  "gpt-3.5-turbo-16k-0613", "gpt-4"],
-        "gemini": ["gemini-pro"],
-        "deepseek": ["deepseek-chat", "deepseek-coder", "deepseek-reasoner"]
+        **provider_models(),
+        # 按提示词和实时耗时选择具体模型的虚拟提供商，模型名为选择策略（见 app.models.catalog）
+        AUTO: list(POLICIES)
     }
 
+    # 进程级模型实例注册表，按 (provider, model_name) 复用客户端及其连接池
+    _instances: Dict[Tuple[str, Optional[str]], BaseAIModel] = {}
+
+    @classmethod
+    def register_provider(cls, provider: str, model_class: Union[str, Type[BaseAIModel]],
+                          models: List[Union[str, ModelInfo]] = None) -> None:
+        """注册提供商，model_class 可以是类或 "模块路径:类名" 字符串；
+        models 中的 ModelInfo 同时登记模型元数据，使其可以参与 auto 选择"""
+        cls._models[provider] = model_class
+        cls._provider_models[provider] = []
+        for model in models or []:
+            if isinstance(model, ModelInfo):
+                register(model)
+                model = model.name
+            cls._provider_models[provider].append(model)
+
+    @classmethod
+    def _load_model_class(cls, provider: str) -> Type[BaseAIModel]:
+        model_class = cls._models[provider]
+        if isinstance(model_class, str):
+            module_path, _, class_name = model_class.partition(":")
+            model_class = getattr(importlib.import_module(module_path), class_name)
+            cls._models[provider] = model_class
+        return model_class
+
     @classmethod
     def create_model(cls, provider: str, model_name: str = None) -> BaseAIModel:
+        if provider == AUTO:
+            raise ValueError("auto 提供商需要先按提示词选择具体模型，该接口暂不支持")
         if provider not in cls._models:
             raise ValueError(f"不支持的AI提供商: {provider}")
         
         if model_name and model_name not in cls._provider_models.get(provider, []):
             raise ValueError(f"不支持的模型名称: {model_name}")
         
-        model_class = cls._models[provider]
-        return model_class(model_name) if model_name else model_class()
+        # 录制/回放模式（MODEL_RECORD_MODE）下包装模型；回放时不创建真实客户端
+        from .recording import RECORD, REPLAY, RecordingModel, get_recording
+        recording = get_recording()
+        if recording.mode == REPLAY:
+            return RecordingModel(provider, model_name, None, recording)
+
+        model_class = cls._load_model_class(provider)
+        model = model_class(model_name) if model_name else model_class()
+        if recording.mode == RECORD:
+            return RecordingModel(provider, model_name, model, recording)
+        return model
+
+    @classmethod
+    def get_model(cls, provider: str, model_name: str = None) -> BaseAIModel:
+        """获取长期存活的模型实例，首次使用时创建"""
+        key = (provider, model_name)
+        model = cls._instances.get(key)
+        if model is None:
+            model = cls.create_model(provider, model_name)
+            cls._instances[key] = model
+        return model
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """关闭所有已缓存的模型实例，在应用关闭时调用"""
+        instances = list(cls._instances.values())
+        cls._instances.clear()
+        for model in instances:
+            await model.aclose()
+
+    @classmethod
+    def get_providers(cls) -> List[str]:
+        return list(cls._models.keys()) + [AUTO]
+
+    @classmethod
+    def get_model_info(cls, provider: str, model_name: str = None) -> Optional[ModelInfo]:
+        """模型的上下文窗口、价格和能力，未登记的模型返回 None"""
+        return get_model_info(provider, model_name)
 
     @classmethod
     def get_provider_models(cls, provider: str = None) -> Dict[str, List[str]]:
@@ -36,4 +100,4 @@ class AIModelFactory:
             if provider not in cls._provider_models:
                 raise ValueError(f"不支持的AI提供商: {provider}")
             return {provider: cls._provider_models[provider]}
-        return cls._provider_models
\ No newline at end of file
+        return cls._provider_models
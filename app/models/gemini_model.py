@@ -1,15 +1,180 @@
-from typing import List, Dict
+from collections import OrderedDict
+from typing import Any, List, Dict, AsyncIterator, Optional, Tuple
 import google.generativeai as genai
+from google.api_core.exceptions import InvalidArgument
 from .base import BaseAIModel
+from .client_config import _env, get_client_config
+from .yes_no import instruction, output_budget, result
+from app.metrics import record_token_usage
+from app.singleflight import SingleFlight
+from app.tokens import estimate_messages_tokens
+import asyncio
+import datetime
+import hashlib
+import json
 import os
+import time
+
+# 最多同时保留的上下文缓存数
+MAX_CONTEXT_CACHES = 32
 
 class GeminiModel(BaseAIModel):
     def __init__(self, model_name: str = "gemini-pro"):
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.config = get_client_config("gemini")
+        client_options = {"api_endpoint": self.config.base_url} if self.config.base_url else None
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"), client_options=client_options)
+        self.model_name = model_name
         self.model = genai.GenerativeModel(model_name)
+        # 上下文缓存：除最后一条消息外的前缀不少于该 token 数时缓存到服务端，0 表示关闭
+        self.context_cache_min_tokens = _env("gemini", "CONTEXT_CACHE_MIN_TOKENS", 0, int)
+        self.context_cache_ttl = _env("gemini", "CONTEXT_CACHE_TTL", 3600.0)
+        # 创建失败（如模型不支持上下文缓存）后该时长（秒）内不再尝试，避免每个请求都多一次失败的调用
+        self.context_cache_retry = _env("gemini", "CONTEXT_CACHE_RETRY", 600.0)
+        self._context_caches: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+        self._context_cache_retry_at = 0.0
+        # 相同前缀的并发请求只创建一个服务端缓存（按量计费）
+        self._context_cache_creation = SingleFlight()
+        # JSON 输出是否可用（gemini-1.0 等旧模型不支持 response_mime_type），请求被拒绝后置为 False
+        self.constrained_output = True
+
+    @staticmethod
+    def _to_turns(messages: List[Dict[str, str]]) -> Tuple[List[str], List[Dict]]:
+        """返回 (system 消息, 按 user/model 交替排列的轮次)，相邻的同角色消息合并"""
+        system = [m["content"] for m in messages if m.get("role") == "system"]
+        turns: List[Dict] = []
+        for message in messages:
+            role = message.get("role", "user")
+            if role == "system":
+                continue
+            role = "model" if role == "assistant" else "user"
+            if turns and turns[-1]["role"] == role:
+                turns[-1]["parts"][0] += "\n\n" + message["content"]
+            else:
+                turns.append({"role": role, "parts": [message["content"]]})
+        return system, turns
+
+    @classmethod
+    def _to_history(cls, messages: List[Dict[str, str]]) -> Tuple[List[Dict], str]:
+        """将 OpenAI 格式的消息转换为 Gemini 的 (历史, 最后一条用户消息)
+
+        Gemini 只有 user/model 两种角色且要求交替出现：assistant 映射为 model，
+        system 消息并入随后的第一条用户消息，相邻的同角色消息合并。
+        """
+        system, turns = cls._to_turns(messages)
+        if system:
+            if turns and turns[0]["role"] == "user":
+                turns[0]["parts"][0] = "\n\n".join(system + [turns[0]["parts"][0]])
+            else:
+                turns.insert(0, {"role": "user", "parts": ["\n\n".join(system)]})
+        if not turns or turns[-1]["role"] != "user":
+            raise ValueError("最后一条消息必须是用户消息")
+        last = turns.pop()
+        return turns, last["parts"][0]
+
+    async def _cached_model(self, prefix: List[Dict[str, str]]) -> Optional[genai.GenerativeModel]:
+        """为不变的消息前缀创建或复用 Gemini 上下文缓存，前缀过短或创建失败时返回 None"""
+        if not self.context_cache_min_tokens or not prefix or time.time() < self._context_cache_retry_at:
+            return None
+        if estimate_messages_tokens(prefix, "gemini", self.model_name) < self.context_cache_min_tokens:
+            return None
+        key = hashlib.sha256(json.dumps(prefix, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        entry = self._context_caches.get(key)
+        # 提前一分钟视为过期，避免使用即将失效的缓存
+        if entry is None or entry[1] - 60 < time.time():
+            entry, _ = await self._context_cache_creation.do(key, lambda: self._create_context_cache(key, prefix))
+            if entry is None:
+                return None
+        if key in self._context_caches:
+            self._context_caches.move_to_end(key)
+        return genai.GenerativeModel.from_cached_content(entry[0])
+
+    async def _create_context_cache(self, key: str, prefix: List[Dict[str, str]]) -> Optional[Tuple[object, float]]:
+        from google.generativeai import caching
+
+        system, turns = self._to_turns(prefix)
+        try:
+            cached = await asyncio.to_thread(
+                caching.CachedContent.create,
+                model=self.model_name,
+                system_instruction="\n\n".join(system) if system else None,
+                contents=turns or None,
+                ttl=datetime.timedelta(seconds=self.context_cache_ttl)
+            )
+        except Exception:
+            # 模型不支持或前缀低于服务端的最小缓存长度时退回普通请求，一段时间内不再尝试
+            self._context_cache_retry_at = time.time() + self.context_cache_retry
+            return None
+        entry = (cached, time.time() + self.context_cache_ttl)
+        self._context_caches[key] = entry
+        while len(self._context_caches) > MAX_CONTEXT_CACHES:
+            self._context_caches.popitem(last=False)
+        return entry
+
+    async def _send(self, messages: List[Dict[str, str]], stream: bool = False,
+                    generation_config: Optional[Dict[str, Any]] = None):
+        # 前缀命中上下文缓存时只发送最后一条消息，否则之前的轮次作为历史发送；
+        # 最后一条不是用户消息时无法单独发送，不创建缓存
+        cached_model = None
+        if messages and messages[-1].get("role", "user") == "user":
+            cached_model = await self._cached_model(messages[:-1])
+        if cached_model is not None:
+            return await cached_model.generate_content_async(
+                messages[-1]["content"],
+                stream=stream,
+                generation_config=generation_config,
+                request_options={"timeout": self.config.timeout}
+            )
+        history, message = self._to_history(messages)
+        chat = self.model.start_chat(history=history)
+        # 使用SDK原生的异步接口，避免阻塞事件循环
+        return await chat.send_message_async(
+            message,
+            stream=stream,
+            generation_config=generation_config,
+            request_options={"timeout": self.config.timeout}
+        )
 
     async def generate_response(self, messages: List[Dict[str, str]]) -> str:
         # 将消息格式转换为Gemini支持的格式
-        chat = self.model.start_chat()
-        response = chat.send_message(messages[-1]["content"])  # 这里简化处理，只取最后一条消息
-        return response.text 
\ No newline at end of file
+        response = await self._send(messages)
+        self._record_usage(response)
+        return response.text
+
+    async def stream_response(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        response = await self._send(messages, stream=True)
+        async for chunk in response:
+            # 结束块可能不含任何文本片段
+            if chunk.parts:
+                yield chunk.text
+        self._record_usage(response)
+
+    async def generate_yes_no(self, messages: List[Dict[str, str]], count: int) -> Dict[str, Any]:
+        # Gemini 不返回 logprobs：只用 JSON 输出和严格的输出长度约束回答，p_yes 为 None
+        if not self.constrained_output:
+            return await super().generate_yes_no(messages, count)
+        config: Dict[str, Any] = {"max_output_tokens": output_budget(count)}
+        if count > 1:
+            config["response_mime_type"] = "application/json"
+        # 格式要求并入最后一条消息，前面的消息仍可命中上下文缓存
+        last = messages[-1]
+        constrained = messages[:-1] + [{**last, "content": last["content"] + "\n\n" + instruction(count)}]
+        try:
+            response = await self._send(constrained, generation_config=config)
+        except InvalidArgument:
+            # 也可能是与参数无关的请求错误，只有普通请求成功时才认定为不支持
+            fallback = await super().generate_yes_no(messages, count)
+            self.constrained_output = False
+            return fallback
+        self._record_usage(response)
+        # 输出被截断时可能不含任何文本片段
+        return result(response.text if response.parts else "", count)
+
+    def _record_usage(self, response) -> None:
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record_token_usage(
+                "gemini", self.model_name,
+                usage.prompt_token_count,
+                usage.candidates_token_count,
+                getattr(usage, "cached_content_token_count", None)
+            )
@@ -1,24 +1,57 @@
-from typing import List, Dict
-from openai import OpenAI
+from typing import Any, List, Dict, AsyncIterator
+from openai import AsyncOpenAI
 from .base import BaseAIModel
+from .catalog import provider_models
+from .client_config import get_client_config, build_openai_http_client
+from .yes_no import openai_yes_no
+from app.metrics import record_openai_usage
 import os
 
 class OpenAIModel(BaseAIModel):
-    VALID_MODELS = {
-        "gpt-4o-mini", "gpt-4o", "o1", "o3-mini", "o1-mini",
-        "gpt-3.5-turbo", "gpt-3.5-turbo-instruct", "gpt-3.5-turbo-16k-0613",
-        "gpt-4"
-    }
+    VALID_MODELS = set(provider_models()["openai"])
+    # 推理模型不支持 logprobs，且输出上限包含推理 token，无法用严格的 max_tokens 约束
+    REASONING_MODELS = {"o1", "o3-mini", "o1-mini"}
 
     def __init__(self, model_name: str = "gpt-4"):
         if model_name not in self.VALID_MODELS:
             raise ValueError(f"Invalid model name. Must be one of: {', '.join(sorted(self.VALID_MODELS))}")
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        config = get_client_config("openai")
+        # 使用异步客户端，避免上游请求阻塞事件循环；连接池在实例生命周期内复用
+        self.client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=config.base_url,
+            http_client=build_openai_http_client(config),
+            # 重试由 app.ratelimit 统一处理（含退避与 Retry-After），避免SDK内部重复重试
+            max_retries=0
+        )
         self.model_name = model_name
+        # 约束输出（JSON 模式 / logprobs）是否可用，请求被拒绝后置为 False
+        self.constrained_output = model_name not in self.REASONING_MODELS
 
     async def generate_response(self, messages: List[Dict[str, str]]) -> str:
-        completion = self.client.chat.completions.create(
+        completion = await self.client.chat.completions.create(
             model=self.model_name,
             messages=messages
         )
-        return completion.choices[0].message.content
\ No newline at end of file
+        record_openai_usage("openai", self.model_name, completion.usage)
+        return completion.choices[0].message.content
+
+    async def stream_response(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            stream=True,
+            # 最后一个块携带整次请求的 token 用量
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                record_openai_usage("openai", self.model_name, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def generate_yes_no(self, messages: List[Dict[str, str]], count: int) -> Dict[str, Any]:
+        return await openai_yes_no(self, "openai", messages, count)
+
+    async def aclose(self) -> None:
+        await self.client.close()
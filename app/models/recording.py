@@ -0,0 +1,238 @@
+"""模型调用的录制与回放：包装任意 BaseAIModel，离线、可复现地重跑评估流程。
+
+录制模式下照常调用真实提供商，同时把每次调用的响应（流式调用为带时间偏移的分块）、耗时、
+token 用量和错误追加写入 JSON Lines 文件；请求只保存消息的哈希，文件保持紧凑。回放模式下不创建
+真实的模型客户端（无需 API Key），按相同的请求哈希依次返回录制的结果，输出与录制时逐字节一致；
+同一请求被录制多次时按录制顺序返回，用完后重复最后一次。
+
+通过环境变量配置:
+    MODEL_RECORD_MODE=off              off / record / replay
+    MODEL_RECORD_PATH=recordings.jsonl  录制文件路径，录制时追加写入
+    MODEL_REPLAY_LATENCY_SCALE=0       回放时按录制耗时等待的比例，0 立即返回，1 模拟原始延迟
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import json
+import os
+import threading
+import time
+
+from app.cache import make_cache_key
+from app.metrics import collect_usage, record_token_usage
+from app.ratelimit import error_status, is_retryable
+from .base import BaseAIModel
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (OFF, RECORD, REPLAY)
+
+
+class ReplayMissError(LookupError):
+    """回放模式下没有与请求匹配的录制"""
+
+
+class RecordedUpstreamError(Exception):
+    """回放录制时上游返回的错误，status_code 与原始错误一致，可被限流/重试逻辑识别"""
+
+    def __init__(self, status_code: Optional[int], message: str):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+class Recording:
+    """录制文件：录制时追加写入，回放时按请求哈希建立索引"""
+
+    def __init__(self, path: str, mode: str, latency_scale: float = 0.0):
+        if mode not in MODES:
+            raise ValueError(f"不支持的录制模式: {mode}，可选 {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._file = None
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if mode == REPLAY:
+            self._load()
+        elif mode == RECORD:
+            self._file = open(path, "a", encoding="utf-8")
+
+    @classmethod
+    def from_env(cls) -> "Recording":
+        return cls(
+            path=os.getenv("MODEL_RECORD_PATH", "recordings.jsonl"),
+            mode=os.getenv("MODEL_RECORD_MODE", OFF).lower(),
+            latency_scale=float(os.getenv("MODEL_REPLAY_LATENCY_SCALE", 0))
+        )
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    def append(self, entry: Dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            # 每次调用写完一整行并刷新，进程中断时已录制的内容不会丢失
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def next(self, key: str) -> Dict:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise ReplayMissError(f"录制文件 {self.path} 中没有与该请求匹配的记录（key={key[:12]}）")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            self.replayed += 1
+            return entries[min(index, len(entries) - 1)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+            "requests": len(self._entries)
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingModel(BaseAIModel):
+    """录制或回放 inner 的调用；回放模式下 inner 为 None"""
+
+    def __init__(self, provider: str, model_name: Optional[str], inner: Optional[BaseAIModel], recording: Recording):
+        self.provider = provider
+        self.model_name = model_name
+        self.inner = inner
+        self.recording = recording
+
+    def _key(self, method: str, messages: List[Dict[str, str]], **params) -> str:
+        return make_cache_key(self.provider, self.model_name, messages, {"method": method, **params})
+
+    def _entry(self, key: str, method: str, start: float, usage: Dict[str, int], **fields) -> Dict:
+        return {
+            "key": key,
+            "provider": self.provider,
+            "model": self.model_name,
+            "method": method,
+            "latency": round(time.perf_counter() - start, 4),
+            "usage": usage,
+            "recorded_at": time.time(),
+            **fields
+        }
+
+    @staticmethod
+    def _error(error: Exception) -> Dict:
+        return {"status_code": error_status(error), "retryable": is_retryable(error), "message": str(error) or type(error).__name__}
+
+    async def _wait(self, seconds: float) -> None:
+        if self.recording.latency_scale and seconds > 0:
+            await asyncio.sleep(seconds * self.recording.latency_scale)
+
+    def _replay_outcome(self, entry: Dict) -> None:
+        """回放录制时的 token 用量，录制的调用失败时抛出相同状态码的错误"""
+        usage = entry.get("usage") or {}
+        record_token_usage(
+            self.provider, self.model_name,
+            usage.get("prompt_tokens"), usage.get("completion_tokens"), usage.get("cached_tokens")
+        )
+        error = entry.get("error")
+        if error is None:
+            return
+        if error["status_code"] is None and error["retryable"]:
+            # 连接失败、超时等没有状态码的错误，回放为超时以保持相同的重试行为
+            raise asyncio.TimeoutError(error["message"])
+        raise RecordedUpstreamError(error["status_code"], error["message"])
+
+    async def _call(self, method: str, messages: List[Dict[str, str]], call: Callable[[], Awaitable[Any]], **params) -> Any:
+        key = self._key(method, messages, **params)
+        if self.recording.mode == REPLAY:
+            entry = self.recording.next(key)
+            await self._wait(entry["latency"])
+            self._replay_outcome(entry)
+            return entry["response"]
+
+        start = time.perf_counter()
+        with collect_usage() as usage:
+            try:
+                response = await call()
+            except Exception as e:
+                self.recording.append(self._entry(key, method, start, usage, error=self._error(e)))
+                raise
+        self.recording.append(self._entry(key, method, start, usage, response=response))
+        return response
+
+    async def generate_response(self, messages: List[Dict[str, str]]) -> str:
+        return await self._call("generate", messages, lambda: self.inner.generate_response(messages))
+
+    async def generate_yes_no(self, messages: List[Dict[str, str]], count: int) -> Dict[str, Any]:
+        return await self._call("yes_no", messages, lambda: self.inner.generate_yes_no(messages, count), count=count)
+
+    async def stream_response(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        key = self._key("stream", messages)
+        if self.recording.mode == REPLAY:
+            entry = self.recording.next(key)
+            # 按录制时每块的时间偏移依次输出，保留首块延迟和分块节奏
+            elapsed = 0.0
+            for offset, chunk in entry["chunks"]:
+                await self._wait(offset - elapsed)
+                elapsed = offset
+                yield chunk
+            self._replay_outcome(entry)
+            return
+
+        start = time.perf_counter()
+        chunks = []
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        iterator = self.inner.stream_response(messages).__aiter__()
+        while True:
+            # 只在等待下一块时收集用量，不影响调用方在两块之间的上下文
+            with collect_usage() as part:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    chunk = None
+                except Exception as e:
+                    self._merge(usage, part)
+                    self.recording.append(self._entry(key, "stream", start, usage, chunks=chunks, error=self._error(e)))
+                    raise
+            self._merge(usage, part)
+            if chunk is None:
+                break
+            chunks.append([round(time.perf_counter() - start, 4), chunk])
+            yield chunk
+        self.recording.append(self._entry(key, "stream", start, usage, chunks=chunks))
+
+    @staticmethod
+    def _merge(total: Dict[str, int], part: Dict[str, int]) -> None:
+        for name, count in part.items():
+            total[name] += count
+
+    async def aclose(self) -> None:
+        if self.inner is not None:
+            await self.inner.aclose()
+
+
+_recording: Optional[Recording] = None
+
+
+def get_recording() -> Recording:
+    global _recording
+    if _recording is None:
+        _recording = Recording.from_env()
+    return _recording
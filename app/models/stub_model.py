@@ -0,0 +1,115 @@
+from typing import Any, List, Dict, AsyncIterator
+from dataclasses import dataclass
+from .base import BaseAIModel
+from .client_config import _env
+from app.metrics import record_token_usage
+import asyncio
+import json
+import math
+import random
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+
+class StubUpstreamError(Exception):
+    """模拟上游返回的错误，status_code 与 SDK 异常一致，可被限流/重试逻辑识别"""
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        super().__init__(f"stub upstream error {status_code}")
+
+
+@dataclass
+class StubConfig:
+    """桩提供商的行为配置，从 STUB_* 环境变量读取"""
+    latency: float = 0.1
+    latency_stddev: float = 0.0
+    latency_dist: str = "fixed"
+    error_rate: float = 0.0
+    error_status: int = 500
+    chunks: int = 20
+    chunk_interval: float = 0.01
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "StubConfig":
+        defaults = cls()
+        config = cls(
+            latency=_env("stub", "LATENCY", defaults.latency),
+            latency_stddev=_env("stub", "LATENCY_STDDEV", defaults.latency_stddev),
+            latency_dist=_env("stub", "LATENCY_DIST", defaults.latency_dist, str),
+            error_rate=_env("stub", "ERROR_RATE", defaults.error_rate),
+            error_status=_env("stub", "ERROR_STATUS", defaults.error_status, int),
+            chunks=_env("stub", "CHUNKS", defaults.chunks, int),
+            chunk_interval=_env("stub", "CHUNK_INTERVAL", defaults.chunk_interval),
+            seed=_env("stub", "SEED", defaults.seed, int),
+        )
+        if config.latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支持的延迟分布: {config.latency_dist}，可选 {', '.join(LATENCY_DISTRIBUTIONS)}")
+        return config
+
+
+class StubModel(BaseAIModel):
+    """不访问网络的桩提供商，用于基准测试和压测：延迟分布、错误率和流式分块节奏均可配置"""
+
+    def __init__(self, model_name: str = "stub"):
+        self.model_name = model_name
+        self.config = StubConfig.from_env()
+        # 固定随机种子，同样的调用序列得到同样的延迟与错误序列
+        self.random = random.Random(self.config.seed)
+
+    def _latency(self) -> float:
+        c = self.config
+        if c.latency_dist == "uniform":
+            value = self.random.uniform(c.latency - c.latency_stddev * math.sqrt(3), c.latency + c.latency_stddev * math.sqrt(3))
+        elif c.latency_dist == "normal":
+            value = self.random.gauss(c.latency, c.latency_stddev)
+        elif c.latency_dist == "lognormal" and c.latency > 0:
+            # 按给定均值和标准差换算对数正态分布参数，模拟长尾延迟
+            sigma2 = math.log(1 + (c.latency_stddev / c.latency) ** 2)
+            value = self.random.lognormvariate(math.log(c.latency) - sigma2 / 2, math.sqrt(sigma2))
+        elif c.latency_dist == "exponential" and c.latency > 0:
+            value = self.random.expovariate(1 / c.latency)
+        else:
+            value = c.latency
+        return max(0.0, value)
+
+    def _maybe_fail(self) -> None:
+        if self.config.error_rate and self.random.random() < self.config.error_rate:
+            raise StubUpstreamError(self.config.error_status)
+
+    def _words(self, messages: List[Dict[str, str]]) -> List[str]:
+        prompt = messages[-1]["content"] if messages else ""
+        return [f"stub[{len(prompt)}]"] + [f"w{i}" for i in range(1, self.config.chunks)]
+
+    def _record_usage(self, messages: List[Dict[str, str]], words: List[str]) -> None:
+        prompt_chars = sum(len(m.get("content", "")) for m in messages)
+        record_token_usage("stub", self.model_name, prompt_chars // 4 + 1, len(words))
+
+    async def generate_response(self, messages: List[Dict[str, str]]) -> str:
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        words = self._words(messages)
+        self._record_usage(messages, words)
+        return " ".join(words)
+
+    async def stream_response(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        # 首块延迟服从配置的分布，之后每隔 chunk_interval 输出一块
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        words = self._words(messages)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.config.chunk_interval)
+            yield word if i == 0 else " " + word
+        self._record_usage(messages, words)
+
+    async def generate_yes_no(self, messages: List[Dict[str, str]], count: int) -> Dict[str, Any]:
+        # 模拟支持 logprobs 的提供商：每题随机给出 P(Yes)，输出为紧凑的 JSON
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        probs = [round(self.random.random(), 4) for _ in range(count)]
+        answers = ["Yes" if p >= 0.5 else "No" for p in probs]
+        self._record_usage(messages, answers)
+        text = json.dumps({"answers": answers}) if count > 1 else answers[0]
+        return {"text": text, "answers": answers, "p_yes": probs}
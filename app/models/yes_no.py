@@ -0,0 +1,120 @@
+"""Yes/No 清单的约束输出：要求 JSON 格式或单个词的回答、严格限制输出长度，
+并在提供商返回 logprobs 时计算每题的 P(Yes)。
+"""
+from typing import Any, Dict, List, Optional
+import json
+import math
+
+from app.metrics import record_openai_usage
+from .base import BaseAIModel
+
+YES_WORDS = ("yes", "是")
+NO_WORDS = ("no", "否")
+TOP_LOGPROBS = 5
+
+
+def _normalize(token: str) -> str:
+    return token.strip().strip("\"'.,:;[]{}*").lower()
+
+
+def as_answer(value: Any) -> Optional[str]:
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    word = _normalize(str(value))
+    if word in YES_WORDS:
+        return "Yes"
+    if word in NO_WORDS:
+        return "No"
+    return None
+
+
+def instruction(count: int) -> str:
+    if count == 1:
+        return "Answer with exactly one word: Yes or No."
+    return (
+        'Respond only with a JSON object of the form {"answers": ["Yes", "No", ...]} '
+        f"containing exactly {count} answers in question order."
+    )
+
+
+def with_instruction(messages: List[Dict[str, str]], count: int) -> List[Dict[str, str]]:
+    # 追加在最后，不影响前面消息的前缀缓存
+    return messages + [{"role": "user", "content": instruction(count)}]
+
+
+def output_budget(count: int) -> int:
+    """输出 token 上限：单题只需一个词，多题为 JSON 数组，每个答案约 3-4 个 token"""
+    return 1 if count == 1 else 6 * count + 16
+
+
+def parse_json_answers(text: str, count: int) -> Optional[List[Optional[str]]]:
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    answers = data.get("answers") if isinstance(data, dict) else data
+    if not isinstance(answers, list) or len(answers) != count:
+        return None
+    return [as_answer(answer) for answer in answers]
+
+
+def p_yes(candidates) -> Optional[float]:
+    """由某个位置的候选 token 及其 logprob 计算 P(Yes)，在 Yes/No 两类之间归一化"""
+    yes = no = 0.0
+    for candidate in candidates:
+        word = _normalize(candidate.token)
+        if word in YES_WORDS:
+            yes += math.exp(candidate.logprob)
+        elif word in NO_WORDS:
+            no += math.exp(candidate.logprob)
+    return yes / (yes + no) if yes + no else None
+
+
+def p_yes_from_logprobs(content, count: int) -> Optional[List[Optional[float]]]:
+    """在输出的 token 序列中找到每个 Yes/No 答案的位置并计算 P(Yes)，个数不符时返回 None"""
+    probs = []
+    for token in content or []:
+        if _normalize(token.token) in YES_WORDS + NO_WORDS:
+            probs.append(p_yes(token.top_logprobs or [token]))
+    return probs if len(probs) == count else None
+
+
+def result(text: str, count: int, probs: Optional[List[Optional[float]]] = None) -> Dict:
+    """统一的返回格式；answers 为 None 时由调用方按普通文本解析"""
+    answers = [as_answer(text)] if count == 1 else parse_json_answers(text, count)
+    if answers is None and probs is not None:
+        answers = [None if p is None else "Yes" if p >= 0.5 else "No" for p in probs]
+    return {"text": text, "answers": answers, "p_yes": probs}
+
+
+async def openai_yes_no(model, provider: str, messages: List[Dict[str, str]], count: int) -> Dict:
+    """OpenAI 兼容接口（OpenAI/DeepSeek）的约束回答：单题限制为一个 token，多题使用 JSON 模式，
+    并请求 logprobs 计算 P(Yes)。模型不支持这些参数时退回普通文本回答，并在实例上记住，之后直接走普通请求
+    """
+    if not model.constrained_output:
+        return await BaseAIModel.generate_yes_no(model, messages, count)
+    # 只有 OpenAI 兼容的模型会调用这里，SDK 此时已经导入；Gemini 等其他提供商不会因本模块加载 openai
+    from openai import BadRequestError
+
+    params: Dict[str, Any] = {
+        "max_tokens": output_budget(count),
+        "logprobs": True,
+        "top_logprobs": TOP_LOGPROBS
+    }
+    if count > 1:
+        params["response_format"] = {"type": "json_object"}
+    try:
+        completion = await model.client.chat.completions.create(
+            model=model.model_name,
+            messages=with_instruction(messages, count),
+            **params
+        )
+    except BadRequestError:
+        # 400 也可能是上下文过长等与参数无关的错误，只有普通请求成功时才认定为不支持
+        response = await BaseAIModel.generate_yes_no(model, messages, count)
+        model.constrained_output = False
+        return response
+    record_openai_usage(provider, model.model_name, completion.usage)
+    choice = completion.choices[0]
+    content = choice.logprobs.content if choice.logprobs else None
+    return result(choice.message.content or "", count, p_yes_from_logprobs(content, count))
@@ -0,0 +1,279 @@
+"""大请求/响应体的处理：请求体大小限制、gzip/zstd 压缩的请求与响应，以及更快的 JSON 序列化。
+
+请求带 Content-Encoding: gzip/zstd 时先解压再交给路由，解压后的大小同样受限（防止压缩炸弹）；
+超出上限返回 413，不支持的编码返回 415。响应按 Accept-Encoding 选择 zstd 或 gzip，
+只压缩一次性返回的响应体，SSE 等流式响应原样转发，不增加首字节延迟。
+
+通过环境变量配置:
+    MAX_REQUEST_BYTES=33554432   请求体上限（字节，压缩和解压后都检查）
+    COMPRESSION_MIN_BYTES=1024   响应体不小于该值时才压缩，0 表示关闭响应压缩
+    COMPRESSION_GZIP_LEVEL=6     gzip 压缩级别
+    COMPRESSION_ZSTD_LEVEL=3     zstd 压缩级别
+    COMPRESSION_THREAD_BYTES=262144  压缩/解压的数据不小于该值时在线程中执行，避免阻塞事件循环
+
+安装 orjson 后 JSON 响应和流式事件使用 orjson 序列化；安装 zstandard 后支持 zstd 编码
+（pip install "report-generator[speedups]"），启动时在日志中列出实际启用的编码和序列化方式。
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import asyncio
+import io
+import json
+import logging
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 使用 uvicorn 已配置输出的 logger，启动信息与服务日志一起显示
+logger = logging.getLogger("uvicorn.error")
+
+# 解压前按该压缩比估算解压后的大小，决定是否在线程中解压
+ESTIMATED_RATIO = 8
+
+# 可以压缩的响应类型；text/event-stream 需要逐条及时送达，不压缩
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/plain", "text/html", "text/csv")
+
+
+def json_dumps(data: Any) -> str:
+    """序列化为 JSON 字符串（非 ASCII 字符不转义），orjson 不支持的类型退回标准库"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False)
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 orjson 序列化的 JSON 响应，未安装 orjson 时与 JSONResponse 相同"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            try:
+                return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                pass
+        return super().render(content)
+
+
+def supported_encodings() -> List[str]:
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def log_codecs() -> None:
+    """启动时记录启用的压缩编码和 JSON 序列化方式，可选依赖缺失时给出提示"""
+    logger.info("请求/响应压缩编码: %s; JSON 序列化: %s",
+                ", ".join(supported_encodings()), "orjson" if orjson is not None else "json (标准库)")
+    missing = [name for name, module in (("orjson", orjson), ("zstandard", zstandard)) if module is None]
+    if missing:
+        logger.warning("未安装 %s，可通过 pip install \"report-generator[speedups]\" 安装", ", ".join(missing))
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+def decompress(data: bytes, encoding: str, limit: int) -> bytes:
+    """解压请求体，结果超过 limit 字节时抛出 PayloadTooLarge"""
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        result = decompressor.decompress(data, limit + 1)
+        if len(result) > limit or decompressor.unconsumed_tail:
+            raise PayloadTooLarge()
+        return result
+    reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    result = reader.read(limit + 1)
+    if len(result) > limit:
+        raise PayloadTooLarge()
+    return result
+
+
+def compress(data: bytes, encoding: str, config: "PayloadConfig") -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=config.zstd_level).compress(data)
+    compressor = zlib.compressobj(config.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择响应编码，优先 zstd（压缩和解压都更快）"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    for encoding in supported_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+@dataclass
+class PayloadConfig:
+    max_request_bytes: int = 32 * 1024 * 1024
+    min_compress_bytes: int = 1024
+    gzip_level: int = 6
+    zstd_level: int = 3
+    thread_bytes: int = 256 * 1024
+
+    @classmethod
+    def from_env(cls) -> "PayloadConfig":
+        defaults = cls()
+        return cls(
+            max_request_bytes=int(os.getenv("MAX_REQUEST_BYTES", defaults.max_request_bytes)),
+            min_compress_bytes=int(os.getenv("COMPRESSION_MIN_BYTES", defaults.min_compress_bytes)),
+            gzip_level=int(os.getenv("COMPRESSION_GZIP_LEVEL", defaults.gzip_level)),
+            zstd_level=int(os.getenv("COMPRESSION_ZSTD_LEVEL", defaults.zstd_level)),
+            thread_bytes=int(os.getenv("COMPRESSION_THREAD_BYTES", defaults.thread_bytes))
+        )
+
+
+class PayloadMiddleware:
+    """纯 ASGI 中间件：限制并解压请求体，压缩一次性返回的响应体"""
+
+    def __init__(self, app, config: Optional[PayloadConfig] = None):
+        self.app = app
+        self.config = config or PayloadConfig.from_env()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "identity").strip().lower()
+        if encoding not in ("identity", *supported_encodings()):
+            await self._error(scope, receive, send, 415, f"不支持的请求编码: {encoding}，可选 {', '.join(supported_encodings())}")
+            return
+
+        limit = self.config.max_request_bytes
+        length = headers.get("content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            await self._error(scope, receive, send, 413, self._too_large(limit))
+            return
+
+        # 未声明长度（分块传输）或需要解压的请求体先读入内存，读取过程中检查大小
+        if encoding != "identity" or (length is None and scope["method"] not in ("GET", "HEAD", "DELETE", "OPTIONS")):
+            body = []
+            size = 0
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > limit:
+                    await self._error(scope, receive, send, 413, self._too_large(limit))
+                    return
+                body.append(chunk)
+                more_body = message.get("more_body", False)
+            data = b"".join(body)
+            if encoding != "identity":
+                try:
+                    # 大的请求体在线程中解压，几 MB 的数据需要数百毫秒
+                    if len(data) * ESTIMATED_RATIO >= self.config.thread_bytes:
+                        data = await asyncio.to_thread(decompress, data, encoding, limit)
+                    else:
+                        data = decompress(data, encoding, limit)
+                except PayloadTooLarge:
+                    await self._error(scope, receive, send, 413, self._too_large(limit, decompressed=True))
+                    return
+                except Exception:
+                    await self._error(scope, receive, send, 400, f"无法按 {encoding} 解压请求体")
+                    return
+            scope = self._replace_body_headers(scope, len(data))
+            receive = self._replay(data, receive)
+
+        response_encoding = choose_encoding(headers.get("accept-encoding", "")) if self.config.min_compress_bytes else None
+        if response_encoding is None:
+            await self.app(scope, receive, send)
+        else:
+            await self.app(scope, receive, self._compressing_send(send, response_encoding))
+
+    @staticmethod
+    def _too_large(limit: int, decompressed: bool = False) -> str:
+        what = "解压后的请求体" if decompressed else "请求体"
+        return f"{what}超过上限 {limit} 字节（MAX_REQUEST_BYTES），可压缩后发送或用 /source/summary 预聚合数据源"
+
+    @staticmethod
+    async def _error(scope, receive, send, status_code: int, detail: str) -> None:
+        await FastJSONResponse({"detail": detail}, status_code=status_code)(scope, receive, send)
+
+    @staticmethod
+    def _replace_body_headers(scope: Dict, length: int) -> Dict:
+        raw = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length", b"transfer-encoding")
+        ]
+        raw.append((b"content-length", str(length).encode()))
+        return {**scope, "headers": raw}
+
+    @staticmethod
+    def _replay(data: bytes, receive):
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": data, "more_body": False}
+            # 请求体已读完，之后只等待客户端断开（流式响应用于检测断开）
+            return await receive()
+
+        return replay
+
+    def _compressing_send(self, send, encoding: str):
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # 先暂存响应头，看到第一块响应体后再决定是否压缩
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            passthrough = True
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+            if (
+                message.get("more_body", False)
+                or len(body) < self.config.min_compress_bytes
+                or "content-encoding" in headers
+                or content_type not in COMPRESSIBLE_TYPES
+            ):
+                await send(start)
+                await send(message)
+                return
+            if len(body) >= self.config.thread_bytes:
+                compressed = await asyncio.to_thread(compress, body, encoding, self.config)
+            else:
+                compressed = compress(body, encoding, self.config)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send({**start, "headers": headers.raw})
+            await send({**message, "body": compressed})
+
+        return send_wrapper
@@ -0,0 +1,263 @@
+"""CheckEval 提示词模板：带版本号、启动时编译一次，由后端渲染。
+
+每个模板由四部分组成：只依赖 aspect/definition 的静态部分（按这两个参数缓存渲染结果）、
+引用其他标量参数的正文、逐项渲染的列表参数和固定结尾。渲染时各部分拼成列表后一次 join，
+不再逐行 += 拼接字符串。客户端只需发送模板名和参数（见 /prompts 接口和 /chat 的 prompt 字段）。
+MessageTemplate 由多个带角色的部分组成，渲染为消息列表（如 /evaluate 的系统指令、数据和问题）。
+
+旧版本保留在注册表中，未指定版本时使用最新版本；修改模板时请新增版本而不是改动已有版本，
+保证按版本号引用的结果可复现。
+"""
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+STATIC_FIELDS = ("aspect", "definition")
+# 每个模板缓存的静态部分数（不同的 aspect/definition 组合）
+STATIC_CACHE_SIZE = 256
+
+
+class CompiledText:
+    """预先解析的格式字符串，渲染时按片段 join，只支持简单的 {字段名}"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if spec or conversion:
+                raise ValueError(f"模板不支持格式说明或转换: {{{field}!{conversion}:{spec}}}")
+            self.parts.append((literal, field))
+        self.fields = {field for _, field in self.parts if field is not None}
+
+    def render_into(self, pieces: List[str], values: Dict[str, Any]) -> None:
+        for literal, field in self.parts:
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(str(values[field]))
+
+    def render(self, values: Dict[str, Any]) -> str:
+        pieces: List[str] = []
+        self.render_into(pieces, values)
+        return "".join(pieces)
+
+
+class PromptTemplate:
+    def __init__(
+        self,
+        name: str,
+        version: int,
+        static: str,
+        body: str = "",
+        items: Optional[str] = None,
+        item_format: str = "- {item}\n",
+        footer: str = "",
+        description: str = "",
+        index_header: str = "",
+        index_format: Optional[str] = None
+    ):
+        self.name = name
+        self.version = version
+        self.items = items
+        self.footer = footer
+        self.description = description
+        self._static = CompiledText(static)
+        self._body = CompiledText(body)
+        self._item = CompiledText(item_format)
+        # 列表之后按序号再逐项渲染一次（如逐题的答案格式），只能引用 {index}
+        self.index_header = index_header
+        self._index = CompiledText(index_format) if index_format is not None else None
+        extra = self._static.fields - set(STATIC_FIELDS)
+        if extra:
+            raise ValueError(f"静态部分只能引用 {', '.join(STATIC_FIELDS)}: {', '.join(sorted(extra))}")
+        if self._item.fields - {"item", "index"}:
+            raise ValueError("列表项只能引用 {item} 和 {index}")
+        if self._index is not None and (self._index.fields - {"index"} or not items):
+            raise ValueError("index_format 只能引用 {index}，且需要列表参数")
+        self.params = sorted(self._static.fields | self._body.fields | ({items} if items else set()))
+        self.render_static = lru_cache(maxsize=STATIC_CACHE_SIZE)(self._render_static)
+
+    def _render_static(self, aspect: str, definition: str) -> str:
+        return self._static.render({"aspect": aspect, "definition": definition})
+
+    @staticmethod
+    def _item_list(value: Union[str, List[str]]) -> List[str]:
+        # 文本框内容去除首尾空白后按行拆分，忽略空行
+        lines = value.strip().split("\n") if isinstance(value, str) else value
+        return [line for line in lines if str(line).strip()]
+
+    def render(self, params: Dict[str, Any]) -> str:
+        missing = [name for name in self.params if name not in params]
+        if missing:
+            raise ValueError(f"模板 {self.name} v{self.version} 缺少参数: {', '.join(missing)}")
+        # 所有片段收集到同一个列表中最后 join 一次，数据源等大参数只复制一次
+        pieces = [self.render_static(str(params.get("aspect", "")), str(params.get("definition", "")))]
+        self._body.render_into(pieces, params)
+        if self.items:
+            items = self._item_list(params[self.items])
+            for index, item in enumerate(items, 1):
+                self._item.render_into(pieces, {"item": item, "index": index})
+            if self._index is not None:
+                pieces.append(self.index_header)
+                for index in range(1, len(items) + 1):
+                    self._index.render_into(pieces, {"index": index})
+        pieces.append(self.footer)
+        return "".join(pieces)
+
+    def render_messages(self, params: Dict[str, Any]) -> List[Dict[str, str]]:
+        return [{"role": "user", "content": self.render(params)}]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "description": self.description,
+            "params": self.params,
+            "items": self.items
+        }
+
+
+class MessageTemplate:
+    """多条消息的模板：每部分是一个带角色的 PromptTemplate，参数为各部分参数的并集
+
+    parts 为 [(角色, PromptTemplate 的关键字参数)]，各部分与整个模板使用相同的名称和版本。
+    """
+
+    def __init__(self, name: str, version: int, parts: List[Tuple[str, Dict[str, Any]]], description: str = ""):
+        self.name = name
+        self.version = version
+        self.description = description
+        self.parts = [(role, PromptTemplate(name, version, **{"static": "", **part})) for role, part in parts]
+        self.params = sorted({param for _, template in self.parts for param in template.params})
+        self.items = next((template.items for _, template in self.parts if template.items), None)
+
+    def render_messages(self, params: Dict[str, Any]) -> List[Dict[str, str]]:
+        missing = [name for name in self.params if name not in params]
+        if missing:
+            raise ValueError(f"模板 {self.name} v{self.version} 缺少参数: {', '.join(missing)}")
+        return [{"role": role, "content": template.render(params)} for role, template in self.parts]
+
+    def render(self, params: Dict[str, Any]) -> str:
+        # 需要单条文本时（/chat 的 prompt 字段、/prompts 渲染预览）各消息以空行连接
+        return "\n\n".join(message["content"] for message in self.render_messages(params))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "description": self.description,
+            "params": self.params,
+            "items": self.items,
+            "roles": [role for role, _ in self.parts]
+        }
+
+
+Template = Union[PromptTemplate, MessageTemplate]
+
+_templates: Dict[str, Dict[int, Template]] = {}
+
+
+def register(template: Template) -> Template:
+    versions = _templates.setdefault(template.name, {})
+    if template.version in versions:
+        raise ValueError(f"模板 {template.name} v{template.version} 已存在，修改模板请新增版本")
+    versions[template.version] = template
+    return template
+
+
+def get_template(name: str, version: Optional[int] = None) -> Template:
+    versions = _templates.get(name)
+    if not versions:
+        raise ValueError(f"不存在的提示词模板: {name}")
+    if version is None:
+        return versions[max(versions)]
+    if version not in versions:
+        raise ValueError(f"模板 {name} 不存在版本 {version}，可选: {', '.join(map(str, sorted(versions)))}")
+    return versions[version]
+
+
+def list_templates() -> List[Dict[str, Any]]:
+    return [
+        {**versions[max(versions)].describe(), "versions": sorted(versions)}
+        for _, versions in sorted(_templates.items())
+    ]
+
+
+def render_prompt(name: str, params: Dict[str, Any], version: Optional[int] = None) -> str:
+    return get_template(name, version).render(params)
+
+
+CHECKEVAL_QUESTIONS = "checkeval.questions"
+CHECKEVAL_EVALUATE = "checkeval.evaluate"
+
+register(PromptTemplate(
+    CHECKEVAL_QUESTIONS, 1,
+    description="根据评估方面的关键组件生成 Yes/No 子问题",
+    static="""In this task, you need to create a question to evaluate the {aspect} of the summary of the original document. The definition of {aspect} and the questions corresponding to the key component of {aspect} are provided below. Use them to generate sub-questions for each key question.
+
+Each sub-question must satisfy the following conditions:
+1. Each question must be answerable with 'Yes' or 'No'.
+2. Each question must contain concepts from the key component.
+3. Each question should minimize the subjectivity of the rater's judgment.
+4. Each question should minimize the semantic redundancy between sub-questions.
+5. Formulate questions so that a 'Yes' answer is a positive answer.
+
+# Definition
+{aspect} - {definition}
+
+# Key component and corresponding question
+""",
+    items="components",
+    footer="\nSub-questions:"
+))
+
+register(PromptTemplate(
+    CHECKEVAL_EVALUATE, 1,
+    description="按清单问题对数据报告逐题回答 Yes/No",
+    static="""In this task, you will be provided with a 7 days energy data and a data report. Your task is to answer 'Yes' or 'No' to the questions related to the {aspect}. Do not generate any explanations without answer to the questions.
+Please make sure you read and understand these instructions carefully. Please keep this document open while reviewing, and refer to it as needed.
+
+Evaluation Criteria: 
+{aspect} - {definition}
+
+Evaluation Steps:
+1. Analyze the summary to evaluate {aspect}.
+2. Respond to each of the following questions with either 'Yes' or 'No' to evaluate the {aspect}. 
+3. Please answer 'Yes' or 'No'. No need to any explain.
+
+""",
+    body="""7 Days Energy Data: {source}
+
+Data Report: {report}
+Questions:
+""",
+    items="questions",
+    footer="\nYour Answers:"
+))
+
+# 不变的指令、数据源和报告在前，逐次变化的问题放在最后一条消息中，同一次评估的所有调用共享相同的前缀
+register(MessageTemplate(
+    CHECKEVAL_EVALUATE, 2,
+    description="按清单问题对数据报告逐题回答 Yes/No（系统指令、数据和问题分为三条消息，便于前缀缓存）",
+    parts=[
+        ("system", {"static": """In this task, you will be provided with a 7 days energy data and a data report. Your task is to answer 'Yes' or 'No' to the questions related to the {aspect}. Do not generate any explanations.
+
+Evaluation Criteria:
+{aspect} - {definition}
+
+Evaluation Steps:
+1. Analyze the report to evaluate {aspect}.
+2. Respond to each of the following questions with either 'Yes' or 'No'.
+3. Answer in the given format, one line per question, without any explanation."""}),
+        ("user", {"body": """7 Days Energy Data: {source}
+
+Data Report: {report}"""}),
+        ("user", {
+            "body": "Questions:\n",
+            "items": "questions",
+            "item_format": "{index}. {item}\n",
+            "index_header": "\nAnswer in exactly this format:\n",
+            "index_format": "{index}. Yes/No\n",
+            "footer": "\nYour Answers:"
+        })
+    ]
+))
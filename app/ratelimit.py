@@ -0,0 +1,301 @@
+"""按提供商的限流、自适应并发控制与重试。
+
+每个提供商一个 ProviderLimiter：
+    - 请求数和 token 数两个令牌桶（每分钟速率，见 <PROVIDER>_RPM / <PROVIDER>_TPM）
+    - AIMD 自适应并发上限：成功时缓慢增加，遇到 429/5xx 时减半
+    - 可重试错误按带抖动的指数退避重试，并遵循 Retry-After
+
+多 worker 部署时令牌桶保存在共享状态中（见 app.shared_state），RPM/TPM 是所有进程合计的上限；
+自适应并发上限仍按进程计算，<PROVIDER>_MAX_CONCURRENCY 为每个 worker 的上限。
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import random
+import time
+
+from app.metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_REQUESTS, record_stage
+from app.models.catalog import record_call
+from app.models.client_config import ClientConfig, get_client_config
+from app.shared_state import SharedState, get_shared_state
+from app.tokens import estimate_messages_tokens
+
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        # 超过桶容量的请求只需等到桶满即可放行，避免永远等待
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+
+class SharedTokenBucket:
+    """保存在共享状态中的令牌桶，多个 worker 进程共用同一组令牌，接口与 TokenBucket 相同"""
+
+    def __init__(self, name: str, rate_per_minute: float, state: SharedState, capacity: Optional[float] = None):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.state = state
+        # 进程内的等待方依次扣减，保持先来先得
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1) -> None:
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                # SQLite 可能需要等待其他进程释放写锁，放到线程中执行，不阻塞事件循环
+                wait = await asyncio.to_thread(self.state.take, self.name, amount, self.rate, self.capacity)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+    def available(self) -> float:
+        return self.state.available(self.name, self.rate, self.capacity)
+
+
+def token_bucket(name: str, rate_per_minute: float):
+    state = get_shared_state()
+    if state.shared:
+        return SharedTokenBucket(name, rate_per_minute, state)
+    return TokenBucket(rate_per_minute)
+
+
+class AdaptiveConcurrency:
+    """AIMD 并发上限：成功时每轮约 +1，被限流或上游故障时减半"""
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_overload(self) -> None:
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """从 openai/google SDK 的异常中取出 HTTP 状态码"""
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_overload(error: Exception) -> bool:
+    status = error_status(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def is_retryable(error: Exception) -> bool:
+    if is_overload(error):
+        return True
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ServiceUnavailable", "DeadlineExceeded")
+
+
+class ProviderLimiter:
+    def __init__(self, provider: str, config: ClientConfig):
+        self.provider = provider
+        self.max_retries = config.max_retries
+        rpm, tpm = config.requests_per_minute, config.tokens_per_minute
+        self.requests = token_bucket(f"{provider}:requests", rpm) if rpm else None
+        self.tokens = token_bucket(f"{provider}:tokens", tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(config.initial_concurrency, config.max_concurrency)
+
+        self.total_requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.queue_seconds = 0.0
+        self.upstream_seconds = 0.0
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, model_name: Optional[str] = None, observe: bool = False) -> AsyncIterator[None]:
+        """占用一个并发槽位并消耗令牌，记录排队耗时和上游耗时
+
+        observe 为 True 时把本次调用的耗时和成败计入模型的滚动估计（供 auto 提供商选择模型），
+        流式调用记录整个流的耗时；客户端断开（流被关闭）与取消一样不计入
+        """
+        queued_at = time.perf_counter()
+        if self.requests:
+            await self.requests.acquire(1)
+        if self.tokens and tokens:
+            await self.tokens.acquire(tokens)
+        await self.concurrency.acquire()
+        started = time.perf_counter()
+        self.queue_seconds += started - queued_at
+        self.total_requests += 1
+        record_stage("queue", started - queued_at, self.provider)
+        UPSTREAM_IN_FLIGHT.inc(provider=self.provider)
+        status = "success"
+        try:
+            yield
+        except BaseException as e:
+            status = "cancelled" if isinstance(e, (asyncio.CancelledError, GeneratorExit)) else "error"
+            if isinstance(e, Exception):
+                self.errors += 1
+                if is_overload(e):
+                    self.throttled += 1
+                    self.concurrency.on_overload()
+            raise
+        else:
+            self.concurrency.on_success()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.upstream_seconds += elapsed
+            record_stage("upstream", elapsed, self.provider)
+            UPSTREAM_IN_FLIGHT.dec(provider=self.provider)
+            UPSTREAM_REQUESTS.inc(provider=self.provider, model=model_name or "", status=status)
+            await self.concurrency.release()
+            if observe and status != "cancelled":
+                await record_call(self.provider, model_name, elapsed, status == "success")
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], tokens: int = 0, model_name: Optional[str] = None) -> Any:
+        """在限流下调用 fn，可重试错误按指数退避重试"""
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(tokens, model_name, observe=True):
+                    return await fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await self.backoff(attempt, e)
+                attempt += 1
+
+    async def backoff(self, attempt: int, error: Exception) -> None:
+        """第 attempt 次重试前等待：全抖动指数退避，服务端给出 Retry-After 时至少等待该时长"""
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        delay = max(delay, retry_after(error) or 0)
+        self.retries += 1
+        await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        completed = max(self.total_requests, 1)
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "queued": self.concurrency.waiting,
+            "requests_available": round(self.requests.available(), 2) if self.requests else None,
+            "tokens_available": round(self.tokens.available(), 2) if self.tokens else None,
+            "total_requests": self.total_requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "avg_queue_seconds": round(self.queue_seconds / completed, 4),
+            "avg_upstream_seconds": round(self.upstream_seconds / completed, 4)
+        }
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        limiter = ProviderLimiter(provider, get_client_config(provider))
+        _limiters[provider] = limiter
+    return limiter
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    return {provider: limiter.stats() for provider, limiter in _limiters.items()}
+
+
+async def call_with_limits(
+    provider: str,
+    model_name: Optional[str],
+    messages: List[Dict[str, str]],
+    fn: Callable[[], Awaitable[Any]]
+) -> Any:
+    limiter = get_limiter(provider)
+    # 只有配置了 TPM 时才需要估算 token 数
+    tokens = estimate_messages_tokens(messages, provider, model_name) if limiter.tokens else 0
+    return await limiter.call(fn, tokens, model_name)
+
+
+async def stream_with_limits(
+    provider: str,
+    model_name: Optional[str],
+    messages: List[Dict[str, str]],
+    stream_fn: Callable[[], AsyncIterator[str]]
+) -> AsyncIterator[str]:
+    """流式调用在整个流期间占用一个并发槽位
+
+    输出第一块之前失败（如 429、连接错误）时与 call_with_limits 一样按退避重试，
+    已经开始输出后失败则直接抛出，不重复输出已发送的内容。
+    """
+    limiter = get_limiter(provider)
+    tokens = estimate_messages_tokens(messages, provider, model_name) if limiter.tokens else 0
+    attempt = 0
+    while True:
+        started = False
+        try:
+            async with limiter.slot(tokens, model_name, observe=True):
+                async for chunk in stream_fn():
+                    started = True
+                    yield chunk
+            return
+        except Exception as e:
+            if started or attempt >= limiter.max_retries or not is_retryable(e):
+                raise
+            await limiter.backoff(attempt, e)
+            attempt += 1
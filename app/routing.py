@@ -0,0 +1,138 @@
+"""提供商路由：按顺序回退（fallback）和对冲请求（hedging）。
+
+targets 为有序的 (provider, model_name) 列表：
+    - 当前目标出错或超过 attempt_timeout 时，依次尝试下一个目标
+    - 设置 hedge_delay 时，当前目标在该时间内没有返回就同时向下一个目标发起请求，
+      采用最先成功的结果并取消其余请求
+    - provider 为 auto 的目标按提示词展开为选中的模型及其备选（见 app.models.catalog）
+"""
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+import time
+
+from app.cache import generate_with_cache
+from app.metrics import timed_stage
+from app.models.catalog import resolve_targets
+from app.models.factory import AIModelFactory
+
+Target = Tuple[str, Optional[str]]
+
+
+class AllTargetsFailed(Exception):
+    def __init__(self, attempts: List[Dict]):
+        self.attempts = attempts
+        details = "; ".join(f"{a['provider']} {a['model']}: {a['error']}" for a in attempts)
+        super().__init__(f"所有提供商均调用失败: {details}")
+
+
+def parse_targets(value: Optional[str]) -> List[Target]:
+    """解析 "deepseek:deepseek-chat,openai:gpt-4o-mini" 形式的目标列表"""
+    targets = []
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        provider, _, model_name = item.strip().partition(":")
+        targets.append((provider, model_name or None))
+    return targets
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def default_fallbacks() -> List[Target]:
+    return parse_targets(os.getenv("CHAT_FALLBACKS"))
+
+
+def default_hedge_delay() -> Optional[float]:
+    return _env_float("CHAT_HEDGE_DELAY")
+
+
+def default_attempt_timeout() -> Optional[float]:
+    return _env_float("CHAT_ATTEMPT_TIMEOUT")
+
+
+async def _attempt(provider: str, model_name: Optional[str], messages: List[Dict[str, str]],
+                   bypass_cache: bool, timeout: Optional[float]) -> Tuple[str, str]:
+    ai_model = AIModelFactory.get_model(provider, model_name)
+    return await asyncio.wait_for(
+        generate_with_cache(ai_model, provider, model_name, messages, bypass=bypass_cache),
+        timeout
+    )
+
+
+async def generate_with_routing(
+    targets: List[Target],
+    messages: List[Dict[str, str]],
+    hedge_delay: Optional[float] = None,
+    attempt_timeout: Optional[float] = None,
+    bypass_cache: bool = False
+) -> Dict:
+    """按路由策略生成响应，返回 provider、model、message、cache_status 和每次尝试的记录"""
+    if not targets:
+        raise ValueError("至少需要一个目标提供商")
+    targets = resolve_targets(targets, messages)
+    # 目标配置错误（不支持的提供商或模型）应立即报错，而不是当作上游故障回退
+    for provider, model_name in targets:
+        with timed_stage("factory", provider):
+            AIModelFactory.get_model(provider, model_name)
+
+    attempts: List[Dict] = []
+    running: Dict[asyncio.Task, Dict] = {}
+    next_index = 0
+
+    def launch():
+        nonlocal next_index
+        provider, model_name = targets[next_index]
+        next_index += 1
+        record = {"provider": provider, "model": model_name, "status": "running", "started": time.perf_counter()}
+        attempts.append(record)
+        task = asyncio.ensure_future(_attempt(provider, model_name, messages, bypass_cache, attempt_timeout))
+        running[task] = record
+
+    def finish(record: Dict, status: str, error: Optional[str] = None):
+        record["status"] = status
+        record["latency"] = time.perf_counter() - record.pop("started")
+        if error:
+            record["error"] = error
+
+    launch()
+    try:
+        while running:
+            # 还有可对冲的目标时，最多等待 hedge_delay
+            wait_timeout = hedge_delay if hedge_delay is not None and next_index < len(targets) else None
+            done, _ = await asyncio.wait(running, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+
+            for task in done:
+                record = running.pop(task)
+                try:
+                    response, cache_status = task.result()
+                except asyncio.TimeoutError:
+                    finish(record, "error", f"超过 {attempt_timeout}s 未返回")
+                except Exception as e:
+                    finish(record, "error", str(e) or type(e).__name__)
+                else:
+                    finish(record, "success")
+                    return {
+                        "provider": record["provider"],
+                        "model": record["model"],
+                        "message": response,
+                        "cache_status": cache_status,
+                        "attempts": attempts
+                    }
+
+            # 没有仍在进行的请求时立即回退到下一个目标
+            if not running and next_index < len(targets):
+                launch()
+    finally:
+        # 取消落败或仍在进行的请求
+        for task, record in running.items():
+            task.cancel()
+            finish(record, "cancelled")
+
+    raise AllTargetsFailed(attempts)
@@ -0,0 +1,70 @@
+"""服务的启动方式：单进程开发模式与多 worker 进程的生产模式，停机时优雅排空。
+
+    python main.py                    单进程（默认）
+    python main.py --workers 4        4 个 worker 进程共享同一端口，充分利用多核
+
+多 worker 模式下各进程通过共享状态（见 app.shared_state，默认本机 SQLite）共享响应缓存、
+限流令牌桶、会话和任务。收到 SIGTERM/SIGINT 后停止接受新连接，等待进行中的请求（包括流式响应）
+和后台任务最多 DRAIN_TIMEOUT 秒，仍未完成的后台任务重新排队。
+
+通过环境变量配置（命令行参数优先）:
+    HOST=0.0.0.0       监听地址
+    PORT=8000          监听端口
+    WORKERS=1          worker 进程数，0 表示按 CPU 核数
+    DRAIN_TIMEOUT=30   停机时等待进行中的请求和任务的最长时间（秒）
+"""
+from dataclasses import dataclass
+from typing import List, Optional
+import argparse
+import os
+
+
+@dataclass
+class ServerConfig:
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: int = 1
+    drain_timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "ServerConfig":
+        defaults = cls()
+        return cls(
+            host=os.getenv("HOST", defaults.host),
+            port=int(os.getenv("PORT", defaults.port)),
+            workers=int(os.getenv("WORKERS", defaults.workers)),
+            drain_timeout=drain_timeout()
+        )
+
+
+def drain_timeout() -> float:
+    return float(os.getenv("DRAIN_TIMEOUT", 30))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> ServerConfig:
+    config = ServerConfig.from_env()
+    parser = argparse.ArgumentParser(description="启动 AI 模型统一调用接口服务")
+    parser.add_argument("--host", default=config.host)
+    parser.add_argument("--port", type=int, default=config.port)
+    parser.add_argument("--workers", type=int, default=config.workers, help="worker 进程数，0 表示按 CPU 核数")
+    parser.add_argument("--drain-timeout", type=float, default=config.drain_timeout,
+                        help="停机时等待进行中的请求和任务的最长时间（秒）")
+    args = parser.parse_args(argv)
+    return ServerConfig(args.host, args.port, args.workers or os.cpu_count() or 1, args.drain_timeout)
+
+
+def run(config: ServerConfig, app=None) -> None:
+    import uvicorn
+
+    # worker 进程继承环境变量，据此选择共享状态后端和排空时间
+    os.environ["WORKERS"] = str(config.workers)
+    os.environ["DRAIN_TIMEOUT"] = str(config.drain_timeout)
+    # 多进程模式下 uvicorn 需要以导入路径在每个 worker 中创建应用
+    target = "main:app" if config.workers > 1 or app is None else app
+    uvicorn.run(
+        target,
+        host=config.host,
+        port=config.port,
+        workers=config.workers if config.workers > 1 else None,
+        timeout_graceful_shutdown=config.drain_timeout
+    )
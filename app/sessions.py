@@ -0,0 +1,296 @@
+"""多轮对话会话：服务端按会话 id 保存消息历史，客户端每轮只需发送新消息。
+
+会话保存在有界的内存 LRU 中，超出容量时被淘汰的会话可写入 SQLite（设置 SESSIONS_SQLITE_PATH），
+再次访问时从磁盘恢复。每次请求只携带 token 预算内最近的若干轮对话；更早的轮次被移出历史，
+开启 SESSIONS_SUMMARIZE 时先由模型压缩为摘要，以系统消息的形式放在上下文开头。
+
+通过环境变量配置:
+    SESSIONS_MAX=1000               内存中最多保存的会话数（多 worker 时也是共享状态中的会话数上限）
+    SESSIONS_TTL=604800             会话在共享状态中的保留时间（秒），超过该时间未使用的会话被删除
+    SESSIONS_SQLITE_PATH=sessions.db  被淘汰会话的磁盘路径，不设置则直接丢弃
+    SESSIONS_HISTORY_TOKENS=4000    每次请求携带的历史消息 token 上限
+    SESSIONS_SUMMARIZE=0            是否把移出历史的旧轮次压缩为摘要
+
+多 worker 部署时（见 app.shared_state）每轮对话结束后会话写入共享状态，读取时以共享状态为准，
+同一会话的请求落在不同进程上也能看到完整的历史。会话锁只在进程内有效，同一会话的并发请求
+应由客户端依次发送。
+
+共享状态和磁盘层（SESSIONS_SQLITE_PATH）的读写会访问 SQLite（淘汰会话时写入并提交，可能等待
+其他进程释放写锁），异步代码应使用 aget/aget_or_create/asave/adelete，在线程中执行这些操作。
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.shared_state import SharedState, get_shared_state
+from app.tokens import estimate_messages_tokens, estimate_tokens, prompt_budget
+
+logger = logging.getLogger("uvicorn.error")
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+# 会话在共享状态中的命名空间
+SESSIONS_NAMESPACE = "sessions"
+
+
+@dataclass
+class Session:
+    id: str
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    summary: Optional[str] = None
+    updated_at: float = field(default_factory=time.time)
+    # 同一会话的多个请求依次执行，保证每轮都能看到上一轮的回答
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+
+    def to_dict(self) -> Dict:
+        return {"id": self.id, "messages": self.messages, "summary": self.summary, "updated_at": self.updated_at}
+
+
+class SessionStore:
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        sqlite_path: Optional[str] = None,
+        history_tokens: int = 4000,
+        summarize: bool = False,
+        shared: Optional[SharedState] = None,
+        ttl: float = 604800
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.history_tokens = history_tokens
+        self.summarize = summarize
+        self._memory: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT, updated_at REAL)")
+            self._db.commit()
+        self._shared = shared if shared is not None and shared.shared else None
+        self.spilled = 0
+        self.restored = 0
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        return cls(
+            max_sessions=int(os.getenv("SESSIONS_MAX", 1000)),
+            sqlite_path=os.getenv("SESSIONS_SQLITE_PATH") or None,
+            history_tokens=int(os.getenv("SESSIONS_HISTORY_TOKENS", 4000)),
+            summarize=os.getenv("SESSIONS_SUMMARIZE", "0").lower() in ("1", "true", "yes"),
+            shared=get_shared_state(),
+            ttl=float(os.getenv("SESSIONS_TTL", 604800))
+        )
+
+    def get(self, session_id: str) -> Optional[Session]:
+        if self._shared is not None:
+            return self._get_shared(session_id)
+        with self._lock:
+            session = self._memory.get(session_id)
+            if session is not None:
+                self._memory.move_to_end(session_id)
+                return session
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            data = json.loads(row[0])
+            session = Session(data["id"], data["messages"], data.get("summary"), data.get("updated_at", time.time()))
+            self.restored += 1
+            self._put_memory(session)
+            return session
+
+    def _get_shared(self, session_id: str) -> Optional[Session]:
+        # touch：按最久未使用淘汰时保留活跃的会话
+        raw = self._shared.get(SESSIONS_NAMESPACE, session_id, touch=True)
+        with self._lock:
+            session = self._memory.get(session_id)
+            if raw is None:
+                # 尚未完成第一轮的会话只存在于创建它的进程中
+                return session
+            data = json.loads(raw)
+            if session is None:
+                session = Session(data["id"])
+                self.restored += 1
+            # 其他进程可能已经追加了新的轮次，保留本进程的会话对象（及其锁），内容以共享状态为准
+            session.messages = data["messages"]
+            session.summary = data.get("summary")
+            session.updated_at = data.get("updated_at", session.updated_at)
+            self._put_memory(session)
+            return session
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        if session_id:
+            session = self.get(session_id)
+            if session is not None:
+                return session
+        session = Session(session_id or uuid.uuid4().hex)
+        with self._lock:
+            self._put_memory(session)
+        return session
+
+    def save(self, session: Session) -> None:
+        """标记会话刚被使用；若它在处理期间已被淘汰，则重新放回内存"""
+        with self._lock:
+            self._put_memory(session)
+        if self._shared is not None:
+            # 与内存层一致有界：超过 ttl 未使用或超出 max_sessions 时淘汰最久未使用的会话
+            self._shared.set(
+                SESSIONS_NAMESPACE, session.id, json.dumps(session.to_dict(), ensure_ascii=False),
+                ttl=self.ttl, max_entries=self.max_sessions
+            )
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            found = self._memory.pop(session_id, None) is not None
+            if self._shared is not None:
+                found = self._shared.delete(SESSIONS_NAMESPACE, session_id) or found
+            if self._db is not None:
+                found = self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0 or found
+                self._db.commit()
+            return found
+
+    async def _offload(self, fn, *args):
+        # 共享状态或磁盘层可能访问 SQLite，在线程中执行；只有内存层时直接完成
+        if self._shared is None and self._db is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def aget(self, session_id: str) -> Optional[Session]:
+        return await self._offload(self.get, session_id)
+
+    async def aget_or_create(self, session_id: Optional[str] = None) -> Session:
+        return await self._offload(self.get_or_create, session_id)
+
+    async def asave(self, session: Session) -> None:
+        await self._offload(self.save, session)
+
+    async def adelete(self, session_id: str) -> bool:
+        return await self._offload(self.delete, session_id)
+
+    def stats(self) -> Dict:
+        return {
+            "memory_sessions": len(self._memory),
+            "max_sessions": self.max_sessions,
+            "history_tokens": self.history_tokens,
+            "summarize": self.summarize,
+            "disk_enabled": self._db is not None,
+            "shared": self._shared is not None,
+            "spilled": self.spilled,
+            "restored": self.restored
+        }
+
+    def close(self) -> None:
+        # 关闭前把内存中的会话全部写入磁盘，重启后仍可继续对话
+        with self._lock:
+            if self._db is None:
+                return
+            for session in self._memory.values():
+                self._spill(session)
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def _put_memory(self, session: Session) -> None:
+        self._memory[session.id] = session
+        self._memory.move_to_end(session.id)
+        while len(self._memory) > self.max_sessions:
+            _, evicted = self._memory.popitem(last=False)
+            if self._db is not None:
+                self._spill(evicted)
+                self._db.commit()
+
+    def _spill(self, session: Session) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+            (session.id, json.dumps(session.to_dict(), ensure_ascii=False), session.updated_at)
+        )
+        self.spilled += 1
+
+
+def _history_budget(store: SessionStore, provider: str, model_name: Optional[str], message: str) -> int:
+    budget = store.history_tokens
+    available = prompt_budget(provider, model_name)
+    if available is not None:
+        budget = min(budget, available - estimate_tokens(message, provider, model_name) - 4)
+    return max(budget, 0)
+
+
+def split_history(messages: List[Dict[str, str]], budget: int, provider: str,
+                  model_name: Optional[str]) -> int:
+    """返回需要移出的旧消息数，使剩余的最近消息不超过 budget；按完整的一问一答成对移出"""
+    total = estimate_messages_tokens(messages, provider, model_name)
+    cut = 0
+    while cut < len(messages) and total > budget:
+        total -= estimate_messages_tokens(messages[cut:cut + 2], provider, model_name)
+        cut += 2
+    return min(cut, len(messages))
+
+
+async def _summarize(provider: str, model_name: Optional[str], summary: Optional[str],
+                     dropped: List[Dict[str, str]]) -> str:
+    from app.cache import generate_with_cache
+    from app.models.catalog import resolve_target
+    from app.models.factory import AIModelFactory
+
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+    previous = f"Existing summary:\n{summary}\n\n" if summary else ""
+    prompt = (
+        "Summarize the following conversation so it can replace the original turns as context. "
+        "Keep facts, decisions, names and numbers; be concise.\n\n"
+        f"{previous}Conversation:\n{transcript}\n\nSummary:"
+    )
+    messages = [{"role": "user", "content": prompt}]
+    # auto 提供商先按摘要提示词选择具体模型
+    provider, model_name = resolve_target(provider, model_name, messages)
+    ai_model = AIModelFactory.get_model(provider, model_name)
+    response, _ = await generate_with_cache(ai_model, provider, model_name, messages)
+    return (response or "").strip()
+
+
+async def build_messages(store: SessionStore, session: Session, message: str,
+                         provider: str, model_name: Optional[str]) -> List[Dict[str, str]]:
+    """按 token 预算裁剪会话历史（必要时压缩为摘要），返回本次请求的完整消息列表"""
+    budget = _history_budget(store, provider, model_name, message)
+    if session.summary:
+        budget -= estimate_tokens(SUMMARY_PREFIX + session.summary, provider, model_name) + 4
+    cut = split_history(session.messages, max(budget, 0), provider, model_name)
+    if cut:
+        dropped, session.messages = session.messages[:cut], session.messages[cut:]
+        if store.summarize:
+            try:
+                session.summary = await _summarize(provider, model_name, session.summary, dropped)
+            except Exception:
+                # 摘要失败时只丢弃旧轮次，不影响本次对话
+                logger.warning("会话 %s 的摘要失败，只丢弃旧轮次", session.id, exc_info=True)
+
+    messages = []
+    if session.summary:
+        messages.append({"role": "system", "content": SUMMARY_PREFIX + session.summary})
+    messages.extend(session.messages)
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+def record_turn(session: Session, message: str, response: str) -> None:
+    session.messages.append({"role": "user", "content": message})
+    session.messages.append({"role": "assistant", "content": response})
+    session.updated_at = time.time()
+
+
+_session_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        _session_store = SessionStore.from_env()
+    return _session_store
@@ -0,0 +1,286 @@
+"""跨进程共享的状态：多 worker 部署时，响应缓存、限流令牌桶和会话在各进程之间共享。
+
+SharedState 提供两类操作：
+    - 按命名空间区分、带过期时间的键值存储，可限制条目数（超出时淘汰最久未访问的条目）
+    - 原子的令牌桶扣减，令牌不足时返回需要等待的秒数
+
+内置两种实现:
+    MemoryState  进程内字典，单进程部署的默认实现
+    SQLiteState  本机 SQLite 文件（WAL 模式），同一台机器上的多个 worker 进程共享，无需外部服务
+
+任务状态本身保存在 SQLite（见 app.jobs），多个 worker 进程通过原子地认领任务共享同一个任务库。
+
+通过环境变量配置:
+    SHARED_STATE_BACKEND=auto          auto / memory / sqlite；auto 在 WORKERS>1 时使用 sqlite
+    SHARED_STATE_PATH=shared_state.db  sqlite 后端的文件路径
+    SHARED_STATE_BUSY_TIMEOUT=5        sqlite 等待其他进程释放写锁的最长时间（秒）
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+
+AUTO = "auto"
+MEMORY = "memory"
+SQLITE = "sqlite"
+BACKENDS = (AUTO, MEMORY, SQLITE)
+
+
+class SharedState(ABC):
+    """共享状态的接口；值为字符串，由调用方负责序列化"""
+
+    # 是否在多个进程之间共享
+    shared = False
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, touch: bool = False) -> Optional[str]:
+        """返回未过期的值；touch 为 True 时更新访问时间（用于按最久未访问淘汰）"""
+        pass
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None,
+            max_entries: Optional[int] = None) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def clear(self, namespace: str) -> None:
+        pass
+
+    @abstractmethod
+    def count(self, namespace: str) -> int:
+        pass
+
+    @abstractmethod
+    def values(self, namespace: str) -> List[str]:
+        """命名空间中全部未过期的值，按最近写入或访问的时间从早到晚排列"""
+        pass
+
+    @abstractmethod
+    def take(self, bucket: str, amount: float, rate: float, capacity: float) -> float:
+        """从令牌桶扣减 amount 个令牌（rate 为每秒补充的令牌数），成功返回 0，否则返回需要等待的秒数"""
+        pass
+
+    @abstractmethod
+    def available(self, bucket: str, rate: float, capacity: float) -> float:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _refill(row: Optional[Tuple[float, float]], rate: float, capacity: float, now: float) -> float:
+    if row is None:
+        return capacity
+    tokens, updated_at = row
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+class MemoryState(SharedState):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 命名空间 -> key -> (值, 过期时间)
+        self._data: Dict[str, "OrderedDict[str, Tuple[str, Optional[float]]]"] = {}
+        # 令牌桶 -> (令牌数, 更新时间)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def get(self, namespace: str, key: str, touch: bool = False) -> Optional[str]:
+        with self._lock:
+            entries = self._data.get(namespace)
+            entry = entries.get(key) if entries else None
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del entries[key]
+                return None
+            if touch:
+                entries.move_to_end(key)
+            return value
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None,
+            max_entries: Optional[int] = None) -> None:
+        with self._lock:
+            entries = self._data.setdefault(namespace, OrderedDict())
+            entries[key] = (value, time.time() + ttl if ttl else None)
+            entries.move_to_end(key)
+            while max_entries is not None and len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._data.get(namespace, {}).pop(key, None) is not None
+
+    def clear(self, namespace: str) -> None:
+        with self._lock:
+            self._data.pop(namespace, None)
+
+    def count(self, namespace: str) -> int:
+        return len(self._data.get(namespace, {}))
+
+    def values(self, namespace: str) -> List[str]:
+        now = time.time()
+        with self._lock:
+            entries = self._data.get(namespace, {})
+            return [value for value, expires_at in entries.values() if expires_at is None or expires_at > now]
+
+    def take(self, bucket: str, amount: float, rate: float, capacity: float) -> float:
+        with self._lock:
+            now = time.time()
+            tokens = _refill(self._buckets.get(bucket), rate, capacity, now)
+            wait = 0.0 if tokens >= amount else (amount - tokens) / rate
+            self._buckets[bucket] = (tokens - amount if wait == 0 else tokens, now)
+            return wait
+
+    def available(self, bucket: str, rate: float, capacity: float) -> float:
+        with self._lock:
+            return _refill(self._buckets.get(bucket), rate, capacity, time.time())
+
+
+class SQLiteState(SharedState):
+    """同一台机器上多个进程共享的 SQLite 实现；每个进程一个连接，写操作由 SQLite 的文件锁串行化"""
+
+    shared = True
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self._lock = threading.Lock()
+        # isolation_level=None：自动提交，需要原子读改写时显式 BEGIN IMMEDIATE
+        self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        # WAL 模式下读不阻塞写，多个 worker 并发访问时不会互相等待读锁
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "namespace TEXT, key TEXT, value TEXT, expires_at REAL, accessed_at REAL, PRIMARY KEY (namespace, key))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS kv_accessed ON kv (namespace, accessed_at)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+
+    def get(self, namespace: str, key: str, touch: bool = False) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._db.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+                return None
+            if touch:
+                self._db.execute("UPDATE kv SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+            return value
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None,
+            max_entries: Optional[int] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, value, now + ttl if ttl else None, now)
+                )
+                if max_entries is not None:
+                    # 超出容量时淘汰最久未访问的条目
+                    self._db.execute(
+                        "DELETE FROM kv WHERE namespace = ? AND key IN ("
+                        "SELECT key FROM kv WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                        (namespace, namespace, max_entries)
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._db.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).rowcount > 0
+
+    def clear(self, namespace: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM kv WHERE namespace = ?", (namespace,))
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM kv WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def values(self, namespace: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?) ORDER BY accessed_at",
+                (namespace, time.time())
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def take(self, bucket: str, amount: float, rate: float, capacity: float) -> float:
+        with self._lock:
+            # BEGIN IMMEDIATE 立即取得写锁，读取和扣减之间不会有其他进程修改令牌数
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._db.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (bucket,)).fetchone()
+                tokens = _refill(row, rate, capacity, now)
+                wait = 0.0 if tokens >= amount else (amount - tokens) / rate
+                self._db.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                    (bucket, tokens - amount if wait == 0 else tokens, now)
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return wait
+
+    def available(self, bucket: str, rate: float, capacity: float) -> float:
+        with self._lock:
+            row = self._db.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (bucket,)).fetchone()
+        return _refill(row, rate, capacity, time.time())
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def worker_count() -> int:
+    """部署的 worker 进程数，由启动命令的 --workers 或 WORKERS 环境变量设置"""
+    return max(1, int(os.getenv("WORKERS", 1)))
+
+
+def create_shared_state() -> SharedState:
+    backend = os.getenv("SHARED_STATE_BACKEND", AUTO).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的共享状态后端: {backend}，可选 {', '.join(BACKENDS)}")
+    if backend == AUTO:
+        backend = SQLITE if worker_count() > 1 else MEMORY
+    if backend == MEMORY:
+        return MemoryState()
+    return SQLiteState(
+        os.getenv("SHARED_STATE_PATH", "shared_state.db"),
+        busy_timeout=float(os.getenv("SHARED_STATE_BUSY_TIMEOUT", 5))
+    )
+
+
+_shared_state: Optional[SharedState] = None
+
+
+def get_shared_state() -> SharedState:
+    global _shared_state
+    if _shared_state is None:
+        _shared_state = create_shared_state()
+    return _shared_state
+
+
+def close_shared_state() -> None:
+    global _shared_state
+    if _shared_state is not None:
+        _shared_state.close()
+        _shared_state = None
@@ -0,0 +1,100 @@
+"""提示词 token 数估算与按 token 预算切分文本。
+
+安装了 tiktoken 时使用真实分词器（OpenAI 模型精确，DeepSeek 近似），
+否则退化为按字符估算：中日韩字符约 1 token/字，其余约 4 字符/token。
+"""
+from functools import lru_cache
+from typing import Dict, List, Optional
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 未指定模型名时各提供商使用的默认模型，与模型类构造函数的默认值一致
+DEFAULT_MODELS: Dict[str, str] = {
+    "openai": "gpt-4",
+    "gemini": "gemini-pro",
+    "deepseek": "deepseek-chat",
+}
+
+# 为模型输出预留的 token 数
+OUTPUT_RESERVE = 1024
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def resolve_model_name(provider: str, model_name: Optional[str]) -> Optional[str]:
+    return model_name or DEFAULT_MODELS.get(provider)
+
+
+def context_window(provider: str, model_name: Optional[str]) -> Optional[int]:
+    """返回模型的上下文窗口（登记在 app.models.catalog），未知模型返回 None（不做限制）"""
+    # catalog 依赖本模块的 token 估算，在调用时导入
+    from app.models.catalog import get_model_info
+
+    info = get_model_info(provider, model_name)
+    return info.context_window if info else None
+
+
+def prompt_budget(provider: str, model_name: Optional[str], reserve: int = OUTPUT_RESERVE) -> Optional[int]:
+    window = context_window(provider, model_name)
+    return window - reserve if window else None
+
+
+@lru_cache(maxsize=None)
+def _encoding(provider: str, model_name: Optional[str]):
+    if tiktoken is None or provider not in ("openai", "deepseek"):
+        return None
+    try:
+        return tiktoken.encoding_for_model(resolve_model_name(provider, model_name))
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def estimate_tokens(text: str, provider: str = "openai", model_name: Optional[str] = None) -> int:
+    encoding = _encoding(provider, model_name)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]], provider: str, model_name: Optional[str] = None) -> int:
+    # 每条消息额外约 4 个 token 的格式开销
+    return sum(estimate_tokens(m.get("content", ""), provider, model_name) + 4 for m in messages)
+
+
+def split_by_tokens(
+    text: str,
+    budget: int,
+    provider: str = "openai",
+    model_name: Optional[str] = None,
+    keep_header: bool = True
+) -> List[str]:
+    """按行切分文本，使每块不超过 budget 个 token；keep_header 时每块都保留首行（如CSV表头）"""
+    lines = text.strip().splitlines()
+    if not lines:
+        return [text]
+    header = lines[0] if keep_header else None
+    body = lines[1:] if keep_header else lines
+    header_tokens = estimate_tokens(header + "\n", provider, model_name) if header else 0
+    if header_tokens >= budget:
+        raise ValueError("单行内容已超出模型上下文，无法切分")
+
+    chunks, current, used = [], [], header_tokens
+    for line in body:
+        tokens = estimate_tokens(line + "\n", provider, model_name)
+        if header_tokens + tokens > budget:
+            raise ValueError("单行内容已超出模型上下文，无法切分")
+        if current and used + tokens > budget:
+            chunks.append(current)
+            current, used = [], header_tokens
+        current.append(line)
+        used += tokens
+    if current or not chunks:
+        chunks.append(current)
+
+    prefix = [header] if header else []
+    return ["\n".join(prefix + chunk) for chunk in chunks]
@@ -0,0 +1,151 @@
+"""连接池基准测试：对比每次请求新建客户端与复用长期客户端的 /chat 延迟。
+
+在本地启动一个兼容 OpenAI 接口的桩服务器，DeepSeek 提供商通过
+DEEPSEEK_BASE_URL 指向它，因此无需网络和真实API密钥。
+
+before 模式还原旧行为：每个请求新建一个客户端（同一请求内多次获取模型时复用），请求结束后关闭。
+
+用法: python -m benchmarks.client_pool_bench [请求数] [并发数]
+"""
+from contextvars import ContextVar
+import asyncio
+import json
+import os
+import statistics
+import sys
+import multiprocessing
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        payload = json.dumps({
+            "id": "stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "ok"},
+            }],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def start_stub_server():
+    """在独立进程中运行桩服务器，避免与被测事件循环争抢GIL"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(port_queue,), daemon=True)
+    process.start()
+    return process, port_queue.get()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# before 模式下当前请求创建的模型实例
+_request_models: ContextVar[dict] = ContextVar("request_models")
+
+
+def per_request_get_model(cls, provider, model_name=None):
+    models = _request_models.get()
+    key = (provider, model_name)
+    if key not in models:
+        models[key] = cls.create_model(provider, model_name)
+    return models[key]
+
+
+def per_request_clients(app):
+    """ASGI 包装：为每个请求准备模型实例表，请求结束后关闭其中的客户端"""
+    async def wrapped(scope, receive, send):
+        models = {}
+        token = _request_models.set(models)
+        try:
+            await app(scope, receive, send)
+        finally:
+            _request_models.reset(token)
+            for model in models.values():
+                await model.aclose()
+    return wrapped
+
+
+async def run(app, total: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                resp = await client.post("/chat", json={
+                    "provider": "deepseek",
+                    "model_name": "deepseek-chat",
+                    "message": f"ping {i}",
+                })
+                resp.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    process, port = start_stub_server()
+    os.environ["DEEPSEEK_BASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("DEEPSEEK_API_KEY", "stub")
+
+    from app.models.factory import AIModelFactory
+    from main import app
+
+    pooled_get_model = AIModelFactory.get_model.__func__
+    modes = {
+        # 旧行为：每次请求新建客户端，请求结束后关闭
+        "before": (per_request_get_model, per_request_clients(app)),
+        # 新行为：进程级注册表复用客户端
+        "after": (pooled_get_model, app),
+    }
+
+    async def compare():
+        for mode, (impl, target) in modes.items():
+            AIModelFactory.get_model = classmethod(impl)
+            latencies = await run(target, total, concurrency)
+            await AIModelFactory.close_all()
+            print(f"{mode:>6}: p50={statistics.median(latencies):.2f}ms "
+                  f"p99={percentile(latencies, 99):.2f}ms "
+                  f"(请求数={total}, 并发={concurrency})")
+
+    asyncio.run(compare())
+    process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""并发基准测试：用一个假的慢速提供商验证 /chat 不会阻塞事件循环。
+
+用法: python -m benchmarks.concurrency_bench [并发数] [单次延迟秒数]
+"""
+import asyncio
+import sys
+import time
+from typing import List, Dict
+
+import httpx
+
+from app.models.base import BaseAIModel
+from app.models.factory import AIModelFactory
+from main import app
+
+
+class SlowFakeModel(BaseAIModel):
+    """模拟一个每次调用耗时固定的上游提供商"""
+    delay = 0.5
+
+    def __init__(self, model_name: str = "slow-fake"):
+        self.model_name = model_name
+
+    async def generate_response(self, messages: List[Dict[str, str]]) -> str:
+        await asyncio.sleep(self.delay)
+        return messages[-1]["content"]
+
+
+async def run(concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i: int):
+            resp = await client.post("/chat", json={"provider": "slow-fake", "message": f"ping {i}"})
+            resp.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    SlowFakeModel.delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+    AIModelFactory.register_provider("slow-fake", SlowFakeModel, ["slow-fake"])
+
+    elapsed = asyncio.run(run(concurrency))
+    print(f"并发请求数: {concurrency}")
+    print(f"单次上游延迟: {SlowFakeModel.delay:.3f}s")
+    print(f"总耗时: {elapsed:.3f}s ({elapsed / SlowFakeModel.delay:.2f}x 单次延迟)")
+
+
+if __name__ == "__main__":
+    main()
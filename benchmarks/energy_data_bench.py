@@ -0,0 +1,70 @@
+"""能源数据预聚合基准：生成大规模合成CSV，测量解析/聚合耗时和提示词体积。
+
+用法: python -m benchmarks.energy_data_bench [行数]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.energy_data import (
+    downsample_energy_data, format_summary, load_energy_csv, summarize_energy_data
+)
+
+REGIONS = ["NSW1", "QLD1", "SA1", "TAS1", "VIC1"]
+DATATYPES = ["Net Interchange", "Scheduled Capacity", "Scheduled Demand", "Scheduled Reserve", "Trading Interval"]
+
+
+def generate_csv(path: str, rows: int) -> None:
+    rng = np.random.default_rng(0)
+    series = len(REGIONS) * len(DATATYPES)
+    steps = rows // series
+    # 7 天内均匀分布的时间点
+    timestamps = pd.date_range("2024-09-26", periods=steps, freq=pd.Timedelta(days=7) / steps).floor("s")
+    df = pd.DataFrame({
+        "REGIONID": np.repeat(REGIONS, len(DATATYPES) * steps),
+        "DATATYPE": np.tile(np.repeat(DATATYPES, steps), len(REGIONS)),
+        "DATAVALUE": rng.normal(5000, 1500, series * steps).round().astype(int),
+        "CALENDAR_DATE": np.tile(timestamps.strftime("%Y/%m/%d %H:%M:%S"), series),
+    })
+    df.to_csv(path, index=False)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "energy.csv")
+        generate_csv(path, rows)
+        raw_chars = os.path.getsize(path)
+
+        timings = {}
+        start = time.perf_counter()
+        with open(path, encoding="utf-8") as f:
+            df = load_energy_csv(f)
+        timings["解析"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        summary = summarize_energy_data(df)
+        timings["统计/每日汇总/异常"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        downsampled = downsample_energy_data(df)
+        timings["降采样(6h)"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        text = format_summary(df, summary, downsampled)
+        timings["格式化"] = time.perf_counter() - start
+
+    print(f"行数: {len(df)}")
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds * 1000:.1f}ms")
+    # 粗略按 4 个字符约 1 个 token 估算
+    print(f"原始CSV: {raw_chars} 字符 (~{raw_chars // 4} tokens)")
+    print(f"摘要+降采样: {len(text)} 字符 (~{len(text) // 4} tokens), 压缩比 {raw_chars / len(text):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
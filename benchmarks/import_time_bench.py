@@ -0,0 +1,60 @@
+"""导入耗时基准：基于 python -X importtime 统计启动服务时的导入开销。
+
+默认导入 main 模块，列出累计耗时最长的模块，并检查提供商SDK
+（openai、google.generativeai）没有在启动时被导入。
+
+用法: python -m benchmarks.import_time_bench [模块名] [--top N] [--check]
+"""
+import argparse
+import subprocess
+import sys
+
+# 启动时不应该被导入的重量级SDK
+LAZY_MODULES = ("openai", "google.generativeai")
+
+
+def measure(module: str):
+    """在新进程中导入模块，返回 [(模块名, 自身耗时us, 累计耗时us)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计模块导入耗时")
+    parser.add_argument("module", nargs="?", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--check", action="store_true", help="提供商SDK在启动时被导入则返回非0")
+    args = parser.parse_args()
+
+    rows = measure(args.module)
+    total_us = sum(self_us for _, self_us, _ in rows)
+    print(f"导入 {args.module} 总耗时: {total_us / 1000:.1f}ms（共 {len(rows)} 个模块）")
+    print(f"{'累计(ms)':>10} {'自身(ms)':>10}  模块")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>10.1f} {self_us / 1000:>10.1f}  {name}")
+
+    imported = {name for name, _, _ in rows}
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        print(f"警告: 启动时导入了提供商SDK: {', '.join(eager)}")
+        if args.check:
+            sys.exit(1)
+    else:
+        print(f"未在启动时导入提供商SDK: {', '.join(LAZY_MODULES)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""压测工具：以目标 RPS 向 /chat、/chat/stream 或 /batch 发起请求，输出吞吐量、延迟分位数和错误率（JSON）。
+
+默认在进程内通过 ASGI 直接驱动 main.app，并使用内置的 stub 提供商，无需网络和API密钥；
+指定 --url 时改为压测已经启动的服务。ASGITransport 会读完整个响应体才返回，测不出首字节时间，
+因此 stream 场景在进程内另起一个监听本机端口的 uvicorn 服务，通过真实连接逐块读取。
+请求按固定间隔开环发出（不等待上一个请求完成），延迟从计划发出时间算起，
+避免服务变慢时压测端自动降速而掩盖排队延迟。
+
+结果可与保存的基线比较，任一指标劣化超过 --tolerance 时以非零状态退出：
+
+    python -m benchmarks.load_test --endpoint chat --rps 200 --duration 10
+    python -m benchmarks.load_test --endpoint stream --save-baseline
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import sys
+import time
+
+import httpx
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "load_test.json")
+ENDPOINTS = ("chat", "stream", "batch")
+
+# 与基线比较的指标：延迟越低越好，吞吐量越高越好
+LOWER_IS_BETTER = ("p50", "p95", "p99", "ttfb_p50", "ttfb_p99")
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # 最近秩法
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _payload(args, i: int) -> Dict:
+    # 每个请求的消息各不相同，且默认跳过缓存，避免缓存命中使结果失真
+    return {
+        "provider": args.provider,
+        "model_name": args.model,
+        "message": f"load test request {i}",
+        "bypass_cache": not args.cache
+    }
+
+
+async def _send_chat(client: httpx.AsyncClient, args, i: int) -> Dict:
+    response = await client.post("/chat", json=_payload(args, i))
+    return {"ok": response.status_code == 200, "status": response.status_code}
+
+
+async def _send_stream(client: httpx.AsyncClient, args, i: int, scheduled: float) -> Dict:
+    first_chunk, ok, status = None, False, None
+    async with client.stream("POST", "/chat/stream", json=_payload(args, i)) as response:
+        status = response.status_code
+        async for line in response.aiter_lines():
+            if first_chunk is None and line.startswith("data:"):
+                first_chunk = time.perf_counter() - scheduled
+            if line.startswith("event: done"):
+                ok = True
+            elif line.startswith("event: error"):
+                ok = False
+                break
+    return {"ok": ok and status == 200, "status": status, "ttfb": first_chunk}
+
+
+async def _send_batch(client: httpx.AsyncClient, args, i: int) -> Dict:
+    body = "\n".join(json.dumps(_payload(args, i * args.batch_size + j)) for j in range(args.batch_size))
+    response = await client.post("/batch", content=body, params={"concurrency": args.batch_size})
+    failed = sum(1 for line in response.text.splitlines() if json.loads(line).get("status") != "success")
+    return {"ok": response.status_code == 200 and failed == 0, "status": response.status_code, "jobs": args.batch_size}
+
+
+async def _one(client: httpx.AsyncClient, args, i: int, scheduled: float) -> Dict:
+    try:
+        if args.endpoint == "stream":
+            result = await _send_stream(client, args, i, scheduled)
+        elif args.endpoint == "batch":
+            result = await _send_batch(client, args, i)
+        else:
+            result = await _send_chat(client, args, i)
+    except Exception as e:
+        result = {"ok": False, "status": type(e).__name__}
+    result["latency"] = time.perf_counter() - scheduled
+    return result
+
+
+@asynccontextmanager
+async def local_server() -> AsyncIterator[str]:
+    """在当前事件循环中启动监听本机随机端口的 uvicorn 服务，返回其地址"""
+    import uvicorn
+    from main import app
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    task = asyncio.ensure_future(server.serve(sockets=[sock]))
+    try:
+        while not server.started:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.01)
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        await task
+        sock.close()
+
+
+def _http_client(args, url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(base_url=url, timeout=args.timeout,
+                             limits=httpx.Limits(max_connections=None, max_keepalive_connections=None))
+
+
+async def run_load(args) -> Dict:
+    if args.url:
+        return await _run(args, _http_client(args, args.url))
+    if args.endpoint == "stream":
+        # 流式响应需要真实连接才能在首块到达时计时
+        async with local_server() as url:
+            return await _run(args, _http_client(args, url))
+    from main import app
+    return await _run(args, httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load", timeout=args.timeout))
+
+
+async def _run(args, client: httpx.AsyncClient) -> Dict:
+    total = int(args.rps * args.duration)
+    interval = 1 / args.rps
+    async with client:
+        # 预热：首次调用会创建模型实例、导入SDK，不计入结果
+        for i in range(args.warmup):
+            await _one(client, args, -1 - i, time.perf_counter())
+
+        tasks = []
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(_one(client, args, i, scheduled)))
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    return summarize(args, results, elapsed)
+
+
+def summarize(args, results: List[Dict], elapsed: float) -> Dict:
+    latencies = [r["latency"] for r in results if r["ok"]]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    succeeded = len(latencies)
+    report = {
+        "endpoint": args.endpoint,
+        "provider": args.provider,
+        "target_rps": args.rps,
+        "duration": round(elapsed, 3),
+        "requests": len(results),
+        "succeeded": succeeded,
+        "error_rate": round(1 - succeeded / len(results), 4) if results else 0.0,
+        "errors": errors,
+        "throughput": round(succeeded / elapsed, 2) if elapsed else 0.0,
+    }
+    for q in (50, 95, 99):
+        value = percentile(latencies, q)
+        report[f"p{q}"] = round(value * 1000, 2) if value is not None else None
+    report["max"] = round(max(latencies) * 1000, 2) if latencies else None
+    if args.endpoint == "stream":
+        ttfb = [r["ttfb"] for r in results if r["ok"] and r.get("ttfb") is not None]
+        report["ttfb_p50"] = round(percentile(ttfb, 50) * 1000, 2) if ttfb else None
+        report["ttfb_p99"] = round(percentile(ttfb, 99) * 1000, 2) if ttfb else None
+    if args.endpoint == "batch":
+        report["jobs_per_second"] = round(succeeded * args.batch_size / elapsed, 2) if elapsed else 0.0
+    return report
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """返回相对基线劣化超过 tolerance 的指标说明，延迟单位为毫秒"""
+    regressions = []
+    for key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        old, new = baseline.get(key), report.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change > tolerance if key in LOWER_IS_BETTER else change < -tolerance
+        if worse:
+            regressions.append(f"{key}: {old} -> {new} ({change:+.1%})")
+    # 错误率以绝对值比较
+    if report["error_rate"] > baseline.get("error_rate", 0) + tolerance / 10:
+        regressions.append(f"error_rate: {baseline.get('error_rate', 0)} -> {report['error_rate']}")
+    return regressions
+
+
+def load_baselines(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以目标 RPS 压测 /chat、/chat/stream 或 /batch")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="chat")
+    parser.add_argument("--rps", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=5, help="压测持续时间（秒）")
+    parser.add_argument("--provider", default="stub")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--url", default=None, help="压测已启动的服务，如 http://localhost:8000；默认进程内压测")
+    parser.add_argument("--batch-size", type=int, default=10, help="/batch 每个请求包含的任务数")
+    parser.add_argument("--cache", action="store_true", help="允许命中响应缓存（默认跳过）")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency", type=float, default=None, help="进程内压测时 stub 的平均延迟（秒），即 STUB_LATENCY")
+    parser.add_argument("--latency-dist", default=None, help="stub 延迟分布，即 STUB_LATENCY_DIST")
+    parser.add_argument("--error-rate", type=float, default=None, help="stub 错误率，即 STUB_ERROR_RATE")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为该压测场景的基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许相对基线劣化的比例")
+    parser.add_argument("-o", "--output", default=None, help="结果JSON输出路径，默认打印到标准输出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 进程内压测时通过环境变量配置 stub 提供商，需在创建模型实例之前设置
+    for name, value in (("STUB_LATENCY", args.latency), ("STUB_LATENCY_DIST", args.latency_dist),
+                        ("STUB_ERROR_RATE", args.error_rate)):
+        if value is not None:
+            os.environ[name] = str(value)
+
+    report = asyncio.run(run_load(args))
+    scenario = f"{args.endpoint}:{args.provider}:{args.rps:g}rps"
+    baselines = load_baselines(args.baseline)
+
+    if args.save_baseline:
+        baselines[scenario] = report
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        regressions = []
+    elif scenario in baselines:
+        regressions = compare(report, baselines[scenario], args.tolerance)
+        report["baseline"] = {"scenario": scenario, "regressions": regressions}
+    else:
+        regressions = []
+        report["baseline"] = {"scenario": scenario, "regressions": None}
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
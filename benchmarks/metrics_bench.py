@@ -0,0 +1,130 @@
+"""指标验证：用不访问网络的假提供商检查 /metrics 计数、直方图分桶和 Server-Timing 响应头。
+
+依次发送一次缓存未命中的 /chat、一次相同请求（缓存命中）和一次上游失败的请求，
+断言请求数、按状态的上游调用数、token 用量和各阶段耗时直方图的分桶计数与预期一致。
+
+用法: python -m benchmarks.metrics_bench
+"""
+import asyncio
+import os
+import re
+from typing import Dict, List
+
+os.environ["CACHE_ENABLED"] = "1"
+# 失败的调用只计一次上游错误
+os.environ["FAKE_MAX_RETRIES"] = "0"
+
+import httpx
+
+from app.cache import get_response_cache
+from app.metrics import record_token_usage
+from app.models.base import BaseAIModel
+from app.models.factory import AIModelFactory
+from main import app
+
+LATENCY = 0.03
+USAGE = {"prompt": 100, "completion": 7, "cached": 40}
+_SAMPLE = re.compile(r"^([a-zA-Z_:][\w:]*)(\{.*\})? (\S+)$")
+
+
+class FakeUpstreamError(Exception):
+    def __init__(self):
+        self.status_code = 400
+        super().__init__("fake upstream error")
+
+
+class FakeModel(BaseAIModel):
+    """固定耗时和 token 用量的假提供商，消息为 fail 时模拟上游错误"""
+
+    def __init__(self, model_name: str = "fake"):
+        self.model_name = model_name
+
+    async def generate_response(self, messages: List[Dict[str, str]]) -> str:
+        await asyncio.sleep(LATENCY)
+        if messages[-1]["content"] == "fail":
+            raise FakeUpstreamError()
+        record_token_usage("fake", None, USAGE["prompt"], USAGE["completion"], USAGE["cached"])
+        return "ok"
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """Prometheus 文本格式 -> {"名称{标签}": 值}"""
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[name + (labels or "")] = float(value)
+    return samples
+
+
+def labels(**values: str) -> str:
+    return "{" + ",".join(f'{name}="{value}"' for name, value in values.items()) + "}"
+
+
+def stages(response: httpx.Response) -> List[str]:
+    return [entry.split(";")[0].strip() for entry in response.headers["server-timing"].split(",")]
+
+
+async def run_checks() -> None:
+    get_response_cache().clear()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        before = parse_metrics((await client.get("/metrics")).text)
+        chat = {"provider": "fake", "message": "hello", "fallbacks": []}
+        miss = await client.post("/chat", json=chat)
+        hit = await client.post("/chat", json=chat)
+        failed = await client.post("/chat", json={**chat, "message": "fail"})
+        after = parse_metrics((await client.get("/metrics")).text)
+
+    def delta(name: str, **label_values: str) -> float:
+        key = name + labels(**label_values)
+        return after.get(key, 0) - before.get(key, 0)
+
+    assert (miss.status_code, hit.status_code, failed.status_code) == (200, 200, 502)
+    assert (miss.headers["X-Cache"], hit.headers["X-Cache"]) == ("MISS", "HIT")
+
+    # Server-Timing：未命中时包含全部阶段，命中缓存时没有上游调用
+    for stage in ("factory", "queue", "upstream", "serialize", "total"):
+        assert stage in stages(miss), f"Server-Timing 缺少 {stage}: {miss.headers['server-timing']}"
+    assert "upstream" not in stages(hit) and "serialize" in stages(hit), hit.headers["server-timing"]
+    print(f"Server-Timing 未命中: {miss.headers['server-timing']}")
+    print(f"Server-Timing 命中:   {hit.headers['server-timing']}")
+
+    # 请求计数
+    assert delta("chat_requests_total", provider="fake", model="", status="200") == 2
+    assert delta("chat_requests_total", provider="fake", model="", status="502") == 1
+    assert delta("http_request_duration_seconds_count", method="POST", path="/chat", status="200") == 2
+    assert delta("http_request_duration_seconds_count", method="POST", path="/chat", status="502") == 1
+
+    # 上游调用按状态计数：缓存命中不产生上游调用，错误不重试
+    assert delta("upstream_requests_total", provider="fake", model="", status="success") == 1
+    assert delta("upstream_requests_total", provider="fake", model="", status="error") == 1
+    assert after.get("upstream_requests_in_flight" + labels(provider="fake")) == 0
+
+    # token 用量只来自成功的那次上游调用
+    for token_type, count in USAGE.items():
+        assert delta("llm_tokens_total", provider="fake", model="", type=token_type) == count, token_type
+
+    # 直方图分桶（累计计数）：两次上游调用都约为 LATENCY 秒
+    upstream = {"stage": "upstream", "provider": "fake"}
+    assert delta("stage_duration_seconds_count", **upstream) == 2
+    assert delta("stage_duration_seconds_bucket", **upstream, le="0.025") == 0
+    assert delta("stage_duration_seconds_bucket", **upstream, le="+Inf") == 2
+    assert delta("stage_duration_seconds_sum", **upstream) >= 2 * LATENCY
+    assert delta("stage_duration_seconds_count", stage="queue", provider="fake") == 2
+    assert delta("stage_duration_seconds_count", stage="serialize", provider="fake") == 2
+    http_ok = {"method": "POST", "path": "/chat", "status": "200"}
+    # 未命中的请求至少耗时 LATENCY，只有缓存命中的请求可能落在 0.025 以内的桶
+    assert delta("http_request_duration_seconds_bucket", **http_ok, le="0.025") <= 1
+    assert delta("http_request_duration_seconds_bucket", **http_ok, le="+Inf") == 2
+    print("请求计数、上游调用计数、token 用量和直方图分桶均与预期一致")
+
+
+def main():
+    AIModelFactory.register_provider("fake", FakeModel, ["fake"])
+    asyncio.run(run_checks())
+
+
+if __name__ == "__main__":
+    main()
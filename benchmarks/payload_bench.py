@@ -0,0 +1,178 @@
+"""大请求体基准：1-10 MB 数据源在不同编码下每个请求的服务端 CPU 时间和传输字节数。
+
+在进程内直接以 ASGI 调用 main.app（不经过 HTTP 客户端，CPU 时间只包含服务端的解压、解析、
+渲染、序列化和压缩），使用 stub 提供商，无需网络和API密钥：
+
+    render  POST /prompts/checkeval.evaluate/render，响应回显完整提示词（大请求 + 大响应）
+    chat    POST /chat，发送完整提示词，响应为简短回答（大请求 + 小响应）
+
+同时比较标准库 json 与 FastJSONResponse 序列化同一响应体的耗时。
+
+用法: python -m benchmarks.payload_bench [--sizes 1,2,5,10] [--endpoint render|chat] [--repeat 3]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("STUB_LATENCY", "0")
+# 基准测量最大 10 MB 的数据源，放宽默认的请求体上限
+os.environ.setdefault("MAX_REQUEST_BYTES", str(64 * 1024 * 1024))
+
+from app.payload import FastJSONResponse, supported_encodings, zstandard  # noqa: E402
+from main import app  # noqa: E402
+
+REGIONS = ["NSW1", "QLD1", "SA1", "TAS1", "VIC1"]
+DATATYPES = ["Net Interchange", "Scheduled Capacity", "Scheduled Demand", "Scheduled Reserve", "Trading Interval"]
+
+
+def generate_source(size: int) -> str:
+    """生成约 size 字节的合成能源CSV"""
+    rng = random.Random(0)
+    lines = ["REGIONID,DATATYPE,DATAVALUE,CALENDAR_DATE,PRETTYDATE"]
+    total = len(lines[0]) + 1
+    minute = 0
+    while total < size:
+        day = 26 + minute // 1440
+        line = (
+            f"{rng.choice(REGIONS)},{rng.choice(DATATYPES)},{int(rng.gauss(5000, 1500))},"
+            f"2024/09/{day:02d} {minute // 60 % 24:02d}:{minute % 60:02d}:00,{day}-Sep-24"
+        )
+        lines.append(line)
+        total += len(line) + 1
+        minute += 5
+    return "\n".join(lines)
+
+
+def encode(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+async def call(path: str, body: bytes, headers: dict):
+    """以 ASGI 直接调用应用，返回 (状态码, 响应头, 响应体, 服务端CPU秒, 墙钟秒)"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "client": ("127.0.0.1", 12345), "server": ("bench", 80),
+        "headers": [(k.encode(), v.encode()) for k, v in headers.items()] + [(b"content-length", str(len(body)).encode())]
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()
+
+    status, response_headers, chunks = None, {}, []
+
+    async def send(message):
+        nonlocal status, response_headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers = {k.decode(): v.decode() for k, v in message["headers"]}
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    await app(scope, receive, send)
+    return status, response_headers, b"".join(chunks), time.process_time() - cpu, time.perf_counter() - wall
+
+
+def request_body(endpoint: str, source: str) -> tuple:
+    params = {
+        "aspect": "Content Completeness",
+        "definition": "refers to the extent to which a report includes all relevant information.",
+        "source": source,
+        "report": "根据提供的数据，可以看出以下关键信息……",
+        "questions": ["Does the report include all relevant power data?", "Has all the power data been clearly presented?"]
+    }
+    if endpoint == "render":
+        return "/prompts/checkeval.evaluate/render", {"params": params}
+    return "/chat", {
+        "provider": "stub",
+        "bypass_cache": True,
+        "prompt": {"name": "checkeval.evaluate", "params": params}
+    }
+
+
+def time_serializers(content, repeat: int) -> dict:
+    def best(fn):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        return min(times) * 1000
+
+    return {
+        "json_stdlib_ms": round(best(lambda: json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()), 2),
+        "json_fast_ms": round(best(lambda: FastJSONResponse(content).body), 2)
+    }
+
+
+async def run(sizes, endpoint: str, repeat: int) -> list:
+    results = []
+    encodings = ["identity"] + supported_encodings()
+    for size_mb in sizes:
+        source = generate_source(int(size_mb * 1024 * 1024))
+        path, payload = request_body(endpoint, source)
+        raw = json.dumps(payload, ensure_ascii=False).encode()
+        for encoding in encodings:
+            samples = []
+            for _ in range(repeat):
+                start = time.process_time()
+                body = encode(raw, encoding)
+                client_cpu = time.process_time() - start
+                headers = {"content-type": "application/json"}
+                if encoding != "identity":
+                    headers["content-encoding"] = encoding
+                    headers["accept-encoding"] = encoding
+                status, response_headers, response, server_cpu, wall = await call(path, body, headers)
+                if status != 200:
+                    raise RuntimeError(f"{path} 返回 {status}: {response[:200]!r}")
+                samples.append((client_cpu, server_cpu, wall, len(body), len(response), response_headers))
+
+            result = {
+                "endpoint": endpoint,
+                "source_mb": size_mb,
+                "encoding": encoding,
+                "json_bytes": len(raw),
+                "request_bytes": samples[-1][3],
+                "response_bytes": samples[-1][4],
+                "response_encoding": samples[-1][5].get("content-encoding", "identity"),
+                "client_compress_ms": round(statistics.median(s[0] for s in samples) * 1000, 2),
+                "server_cpu_ms": round(statistics.median(s[1] for s in samples) * 1000, 2),
+                "server_wall_ms": round(statistics.median(s[2] for s in samples) * 1000, 2),
+            }
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+
+        if endpoint == "render":
+            # 响应体与 /prompts/render 的返回相同，比较两种 JSON 序列化
+            content = {"name": "checkeval.evaluate", "version": 1, "prompt": source, "chars": len(source)}
+            print(json.dumps({"source_mb": size_mb, **time_serializers(content, repeat)}), flush=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,2,5,10", help="数据源大小（MB），逗号分隔")
+    parser.add_argument("--endpoint", choices=("render", "chat"), default="render")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    sizes = [float(s) for s in args.sizes.split(",") if s.strip()]
+    asyncio.run(run(sizes, args.endpoint, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
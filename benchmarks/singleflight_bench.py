@@ -0,0 +1,90 @@
+"""请求合并验证：100 个相同的并发 /chat 请求只应触发一次上游调用。
+
+同时验证首个请求（leader）被取消后，其余等待方仍能拿到结果。
+
+用法: python -m benchmarks.singleflight_bench [并发数]
+"""
+import asyncio
+import sys
+import time
+from typing import List, Dict
+
+import httpx
+
+from app.cache import get_response_cache, inflight
+from app.models.base import BaseAIModel
+from app.models.factory import AIModelFactory
+from main import app
+
+
+class CountingModel(BaseAIModel):
+    """统计上游调用次数的桩提供商"""
+    calls = 0
+
+    def __init__(self, model_name: str = "counting"):
+        self.model_name = model_name
+
+    async def generate_response(self, messages: List[Dict[str, str]]) -> str:
+        CountingModel.calls += 1
+        await asyncio.sleep(0.2)
+        return messages[-1]["content"]
+
+
+async def check_identical_requests(concurrency: int):
+    CountingModel.calls = 0
+    get_response_cache().clear()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post("/chat", json={"provider": "counting", "message": "same prompt"})
+            for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.json()["message"] == "same prompt" for r in responses)
+    assert CountingModel.calls == 1, f"期望1次上游调用，实际{CountingModel.calls}次"
+    statuses = sorted({r.headers["X-Cache"] for r in responses})
+    print(f"{concurrency} 个相同并发请求 -> 上游调用 {CountingModel.calls} 次, "
+          f"耗时 {elapsed:.3f}s, X-Cache: {statuses}")
+
+
+async def check_leader_cancelled():
+    CountingModel.calls = 0
+    model = AIModelFactory.get_model("counting")
+
+    async def fetch():
+        return await model.generate_response([{"role": "user", "content": "leader"}])
+
+    leader = asyncio.create_task(inflight.do("leader-key", fetch))
+    await asyncio.sleep(0.01)
+    followers = [asyncio.create_task(inflight.do("leader-key", fetch)) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    results = await asyncio.gather(*followers)
+    assert leader.cancelled()
+    assert all(result == ("leader", True) for result in results)
+    assert CountingModel.calls == 1
+    print("leader 被取消后 follower 仍获得结果，上游调用 1 次")
+
+    # 所有等待方都离开时，上游请求应被取消
+    lone = asyncio.create_task(inflight.do("lone-key", fetch))
+    await asyncio.sleep(0.01)
+    lone.cancel()
+    await asyncio.sleep(0.01)
+    assert inflight.in_flight() == 0
+    print("所有等待方离开后上游请求被取消")
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    AIModelFactory.register_provider("counting", CountingModel, ["counting"])
+
+    asyncio.run(check_identical_requests(concurrency))
+    asyncio.run(check_leader_cancelled())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""多 worker 部署基准：吞吐量随 worker 进程数的扩展情况，以及停机时的优雅排空。
+
+依次以不同的 worker 数启动 `python main.py --workers N`（stub 提供商，无需网络和API密钥），
+用多个客户端进程闭环压测 /chat（每个请求先完成再发下一个），输出每种 worker 数的吞吐量和
+相对单 worker 的扩展效率（吞吐量 / (N × 单 worker 吞吐量)）。stub 延迟为 0 时每个请求的耗时
+主要是服务端的 CPU 时间（解析、token 估算、缓存 key、序列化），吞吐量受限于可用的核数；
+客户端进程同样占用 CPU，核数较少的机器上扩展效率会偏低。
+
+--drain 检查优雅停机：在请求进行中向服务发送 SIGTERM，进行中的请求应全部成功返回。
+
+用法: python -m benchmarks.workers_bench [--workers 1,2,4] [--clients 4] [--duration 10] [--drain]
+"""
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int, state_dir: str, **env) -> subprocess.Popen:
+    environ = {
+        **os.environ,
+        "STUB_LATENCY": "0",
+        "CACHE_ENABLED": "0",
+        "SHARED_STATE_PATH": os.path.join(state_dir, "shared_state.db"),
+        "JOBS_SQLITE_PATH": os.path.join(state_dir, "jobs.db"),
+        **env
+    }
+    process = subprocess.Popen(
+        [sys.executable, "main.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, env=environ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    # 等到所有 worker 都能响应（不同的 pid 数达到 worker 数）
+    pids = set()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            pids.add(httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).json()["pid"])
+            if len(pids) >= workers:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{workers} 个 worker 的服务未能在60秒内启动")
+
+
+def stop_server(process: subprocess.Popen, timeout: float = 60) -> float:
+    start = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout)
+    return time.perf_counter() - start
+
+
+async def _client(url: str, concurrency: int, duration: float, message: str) -> Dict:
+    completed, errors = 0, 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=30, limits=limits) as client:
+        async def loop(index: int) -> None:
+            nonlocal completed, errors
+            i = 0
+            while time.monotonic() < deadline:
+                payload = {"provider": "stub", "message": f"{index}-{i} {message}", "bypass_cache": True}
+                try:
+                    response = await client.post("/chat", json=payload)
+                    if response.status_code == 200:
+                        completed += 1
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                i += 1
+
+        await asyncio.gather(*(loop(index) for index in range(concurrency)))
+    return {"completed": completed, "errors": errors}
+
+
+def _client_process(args) -> Dict:
+    return asyncio.run(_client(*args))
+
+
+def measure(url: str, clients: int, concurrency: int, duration: float, message: str) -> Dict:
+    with multiprocessing.get_context("spawn").Pool(clients) as pool:
+        start = time.perf_counter()
+        results = pool.map(_client_process, [(url, concurrency, duration, message)] * clients)
+        elapsed = time.perf_counter() - start
+    completed = sum(r["completed"] for r in results)
+    return {"completed": completed, "errors": sum(r["errors"] for r in results), "throughput": round(completed / elapsed, 1)}
+
+
+def check_drain(workers: int, requests: int, latency: float) -> Dict:
+    """服务在请求进行中收到 SIGTERM 时，进行中的请求应全部完成"""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as state_dir:
+        process = start_server(workers, port, state_dir, STUB_LATENCY=str(latency))
+
+        async def run() -> List[int]:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=latency * 10) as client:
+                calls = [
+                    client.post("/chat", json={"provider": "stub", "message": f"drain {i}", "bypass_cache": True})
+                    for i in range(requests)
+                ]
+                tasks = [asyncio.ensure_future(call) for call in calls]
+                await asyncio.sleep(latency / 4)
+                process.send_signal(signal.SIGTERM)
+                responses = await asyncio.gather(*tasks, return_exceptions=True)
+            return [r.status_code if isinstance(r, httpx.Response) else type(r).__name__ for r in responses]
+
+        start = time.perf_counter()
+        statuses = asyncio.run(run())
+        process.wait(60)
+    return {
+        "workers": workers,
+        "in_flight": requests,
+        "succeeded": statuses.count(200),
+        "failed": [s for s in statuses if s != 200],
+        "shutdown_seconds": round(time.perf_counter() - start, 2),
+        "exit_code": process.returncode
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="worker 数，逗号分隔")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="客户端进程数")
+    parser.add_argument("--concurrency", type=int, default=16, help="每个客户端进程的并发请求数")
+    parser.add_argument("--duration", type=float, default=10, help="每种 worker 数的压测时间（秒）")
+    parser.add_argument("--message-bytes", type=int, default=4096, help="每个请求的消息大小")
+    parser.add_argument("--drain", action="store_true", help="同时检查停机时的优雅排空")
+    args = parser.parse_args(argv)
+
+    message = "x" * args.message_bytes
+    results = []
+    for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+        port = free_port()
+        with tempfile.TemporaryDirectory() as state_dir:
+            process = start_server(workers, port, state_dir)
+            try:
+                result = {"workers": workers, **measure(f"http://127.0.0.1:{port}", args.clients, args.concurrency, args.duration, message)}
+            finally:
+                result["shutdown_seconds"] = round(stop_server(process), 2)
+        single = results[0]["throughput"] if results else result["throughput"]
+        base_workers = results[0]["workers"] if results else workers
+        result["efficiency"] = round(result["throughput"] / (single * workers / base_workers), 2) if single else None
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    if args.drain:
+        print(json.dumps({"drain": check_drain(max(r["workers"] for r in results), 32, 2.0)}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
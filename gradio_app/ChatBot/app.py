@@ -1,63 +1,47 @@
 import gradio as gr
-import requests
+import os
+import sys
+import uuid
 
-API_BASE_URL = "http://localhost:8000"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api_client import concurrency_limit, get_backend
 
-def get_providers():
-    try:
-        response = requests.get(f"{API_BASE_URL}/providers")
-        if response.status_code == 200:
-            return response.json()["providers"]
-        return []
-    except:
-        return []
-
-def get_models(provider):
-    try:
-        response = requests.get(f"{API_BASE_URL}/models/{provider}")
-        if response.status_code == 200:
-            return response.json()[provider]
-        return []
-    except:
-        return []
+backend = get_backend()
 
-def chat(message, provider, model, history):
+async def chat(message, provider, model, history, session_id):
+    history = history or []
+    # 每个对话一个会话 id，服务端据此携带之前的轮次
+    session_id = session_id or uuid.uuid4().hex
+    history.append((message, f"[{provider} {model}]\n"))
+    raw_message = ""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/chat",
-            json={
-                "provider": provider,
-                "model_name": model,
-                "message": message
-            }
-        )
-        if response.status_code == 200:
-            raw_message = response.json()['message']
-            bot_message = f"[{provider} {model}]\n{raw_message}"
-        else:
-            bot_message = f"错误: {response.text}"
-            raw_message = ""
+        async for delta in backend.stream_chat(provider, model, message, session_id):
+            raw_message += delta
+            history[-1] = (message, f"[{provider} {model}]\n{raw_message}")
+            yield "", history, raw_message, session_id
     except Exception as e:
-        bot_message = f"请求失败: {str(e)}"
+        history[-1] = (message, f"请求失败: {str(e)}")
         raw_message = ""
     
-    history.append((message, bot_message))
-    return "", history, raw_message
+    yield "", history, raw_message, session_id
 
-def update_models(provider):
-    models = get_models(provider)
-    return gr.Dropdown(choices=models, value=models[0] if models else None)
+async def clear_session(session_id):
+    # 清除对话时同时删除服务端的会话历史
+    if session_id:
+        try:
+            await backend.request("DELETE", f"/sessions/{session_id}")
+        except Exception:
+            pass
+    return None, "", None
 
-def initialize_providers_and_models():
-    providers = get_providers()
-    if not providers:
-        return ["无可用提供商"], []
-    
-    initial_models = get_models(providers[0])
-    return providers, initial_models
+async def update_models(provider):
+    models = await backend.models(provider)
+    return gr.Dropdown(choices=models, value=models[0] if models else None)
 
-# 获取可用的AI提供商和初始模型
-providers, initial_models = initialize_providers_and_models()
+async def initialize_providers_and_models():
+    # 页面加载时再获取提供商和模型列表，后端较慢时界面也能立即启动
+    providers = await backend.providers() or ["无可用提供商"]
+    return gr.Dropdown(choices=providers, value=providers[0]), await update_models(providers[0])
 
 # 创建Gradio界面
 with gr.Blocks(title="AI 聊天助手") as demo:
@@ -75,16 +59,13 @@ with gr.Blocks(title="AI 聊天助手") as demo:
             raw_output = gr.Textbox(label="原始回答", visible=True)  # 改为可见
         
         with gr.Column(scale=1):
-            provider = gr.Dropdown(
-                choices=providers,
-                value=providers[0] if providers else None,
-                label="选择AI提供商"
-            )
-            model = gr.Dropdown(
-                choices=initial_models,
-                value=initial_models[0] if initial_models else None,
-                label="选择模型"
-            )
+            provider = gr.Dropdown(choices=[], label="选择AI提供商")
+            model = gr.Dropdown(choices=[], label="选择模型")
+
+    # 放在界面组件之后创建，不改变已有组件的编号（复制功能依赖 #component-43）
+    session_id = gr.State(None)
+
+    demo.load(initialize_providers_and_models, None, [provider, model])
 
     provider.change(
         update_models,
@@ -94,8 +75,8 @@ with gr.Blocks(title="AI 聊天助手") as demo:
 
     submit.click(
         chat,
-        inputs=[msg, provider, model, chatbot],
-        outputs=[msg, chatbot, raw_output]
+        inputs=[msg, provider, model, chatbot, session_id],
+        outputs=[msg, chatbot, raw_output, session_id]
     )
     
     def copy_last_response(history):
@@ -125,6 +106,7 @@ with gr.Blocks(title="AI 聊天助手") as demo:
         """
     )
 
-    clear.click(lambda: (None, ""), None, [chatbot, raw_output], queue=False)
+    clear.click(clear_session, [session_id], [chatbot, raw_output, session_id], queue=False)
 
-demo.launch(share=False)
\ No newline at end of file
+# 多个用户的请求并发处理，不在同一个工作线程上排队
+demo.queue(default_concurrency_limit=concurrency_limit()).launch(share=False)
@@ -1,84 +1,42 @@
 import gradio as gr
-import requests
+import os
+import sys
 
-API_BASE_URL = "http://localhost:8000"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api_client import concurrency_limit, get_backend
 
-def get_providers():
-    try:
-        response = requests.get(f"{API_BASE_URL}/providers")
-        if response.status_code == 200:
-            return response.json()["providers"]
-        return []
-    except:
-        return []
+backend = get_backend()
 
-def get_models(provider):
+async def evaluate(aspect, definition, components, provider, model, history):
+    history = history or []
+    # 提示词由后端按模板渲染，只发送参数
+    prompt = {
+        "name": "checkeval.questions",
+        "params": {"aspect": aspect, "definition": definition, "components": components}
+    }
+    component_count = len([line for line in components.split("\n") if line.strip()])
+    request_summary = f"{aspect}: 根据 {component_count} 个关键组件生成子问题"
+    history.append((request_summary, f"[{provider} {model}]\n"))
+    raw_message = ""
     try:
-        response = requests.get(f"{API_BASE_URL}/models/{provider}")
-        if response.status_code == 200:
-            return response.json()[provider]
-        return []
-    except:
-        return []
-
-def generate_prompt(aspect, definition, components):
-    prompt = f"""In this task, you need to create a question to evaluate the {aspect} of the summary of the original document. The definition of {aspect} and the questions corresponding to the key component of {aspect} are provided below. Use them to generate sub-questions for each key question.
-
-Each sub-question must satisfy the following conditions:
-1. Each question must be answerable with 'Yes' or 'No'.
-2. Each question must contain concepts from the key component.
-3. Each question should minimize the subjectivity of the rater's judgment.
-4. Each question should minimize the semantic redundancy between sub-questions.
-5. Formulate questions so that a 'Yes' answer is a positive answer.
-
-# Definition
-{aspect} - {definition}
-
-# Key component and corresponding question
-"""
-    # 将components按行分割，并处理每一行
-    component_lines = components.strip().split('\n')
-    for line in component_lines:
-        if line.strip():
-            prompt += f"- {line}\n"
-    
-    prompt += "\nSub-questions:"
-    print(f"prompt:{prompt}")
-    return prompt
-
-def evaluate(aspect, definition, components, provider, model, history):
-    try:
-        prompt = generate_prompt(aspect, definition, components)
-        response = requests.post(
-            f"{API_BASE_URL}/chat",
-            json={
-                "provider": provider,
-                "model_name": model,
-                "message": prompt
-            }
-        )
-        if response.status_code == 200:
-            raw_message = response.json()['message']
-            bot_message = f"[{provider} {model}]\n{raw_message}"
-        else:
-            bot_message = f"错误: {response.text}"
-            raw_message = ""
+        async for delta in backend.stream_chat(provider, model, prompt=prompt):
+            raw_message += delta
+            history[-1] = (request_summary, f"[{provider} {model}]\n{raw_message}")
+            yield history, raw_message
     except Exception as e:
-        bot_message = f"请求失败: {str(e)}"
+        history[-1] = (request_summary, f"请求失败: {str(e)}")
         raw_message = ""
     
-    history.append((prompt, bot_message))
-    return history, raw_message
+    yield history, raw_message
 
-def update_models(provider):
-    models = get_models(provider)
+async def update_models(provider):
+    models = await backend.models(provider)
     return gr.Dropdown(choices=models, value=models[0] if models else None)
 
-# 初始化提供商和模型
-providers = get_providers()
-if not providers:
-    providers = ["无可用提供商"]
-initial_models = get_models(providers[0]) if providers else []
+async def initialize_providers_and_models():
+    # 页面加载时再获取提供商和模型列表，后端较慢时界面也能立即启动
+    providers = await backend.providers() or ["无可用提供商"]
+    return gr.Dropdown(choices=providers, value=providers[0]), await update_models(providers[0])
 
 # 创建Gradio界面
 with gr.Blocks(title="评估问题生成器") as demo:
@@ -115,16 +73,10 @@ with gr.Blocks(title="评估问题生成器") as demo:
 Analysis Completeness: Assess whether the report provides a comprehensive analysis of all relevant aspects without ignoring important factors.
 Conclusion Completeness: Determine whether the conclusions in the report are comprehensive and consider all possible situations and influencing factors"""
             )
-            provider = gr.Dropdown(
-                choices=providers,
-                value=providers[0] if providers else None,
-                label="选择AI提供商"
-            )
-            model = gr.Dropdown(
-                choices=initial_models,
-                value=initial_models[0] if initial_models else None,
-                label="选择模型"
-            )
+            provider = gr.Dropdown(choices=[], label="选择AI提供商")
+            model = gr.Dropdown(choices=[], label="选择模型")
+
+    demo.load(initialize_providers_and_models, None, [provider, model])
 
     provider.change(
         update_models,
@@ -154,4 +106,5 @@ Conclusion Completeness: Determine whether the conclusions in the report are com
 
     clear.click(lambda: (None, ""), None, [chatbot, raw_output], queue=False)
 
-demo.launch(share=False)
\ No newline at end of file
+# 多个用户的请求并发处理，不在同一个工作线程上排队
+demo.queue(default_concurrency_limit=concurrency_limit()).launch(share=False)
@@ -1,84 +1,113 @@
 import gradio as gr
-import requests
+import os
+import sys
 
-API_BASE_URL = "http://localhost:8000"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api_client import concurrency_limit, get_backend
 
-def get_providers():
+backend = get_backend()
+
+async def summarize_source(source, source_mode):
+    """调用后端将原始CSV预聚合为统计摘要，raw 模式原样返回"""
+    if source_mode == "raw":
+        return source
+    result = await backend.request("POST", "/source/summary", json={"source": source, "mode": source_mode})
+    return result["summary"]
+
+async def evaluate(aspect, definition, source, report, questions, provider, model, source_mode, history):
+    history = history or []
     try:
-        response = requests.get(f"{API_BASE_URL}/providers")
-        if response.status_code == 200:
-            return response.json()["providers"]
-        return []
-    except:
-        return []
-
-def get_models(provider):
+        source = await summarize_source(source, source_mode)
+    except Exception as e:
+        history.append((f"[{source_mode}] 数据源预聚合", f"请求失败: {str(e)}"))
+        yield history, ""
+        return
+    # 提示词由后端按模板渲染，只发送参数；自由回答使用单条消息的 v1 模板
+    prompt = {
+        "name": "checkeval.evaluate",
+        "version": 1,
+        "params": {"aspect": aspect, "definition": definition, "source": source, "report": report, "questions": questions}
+    }
+    question_count = len([line for line in questions.split("\n") if line.strip()])
+    request_summary = f"[{source_mode}] {aspect}: {question_count} 个问题"
+    history.append((request_summary, f"[{provider} {model}]\n"))
+    raw_message = ""
     try:
-        response = requests.get(f"{API_BASE_URL}/models/{provider}")
-        if response.status_code == 200:
-            return response.json()[provider]
-        return []
-    except:
-        return []
-
-def generate_prompt(aspect, definition, source, report, questions):
-    prompt = f"""In this task, you will be provided with a 7 days energy data and a data report. Your task is to answer 'Yes' or 'No' to the questions related to the {aspect}. Do not generate any explanations without answer to the questions.
-Please make sure you read and understand these instructions carefully. Please keep this document open while reviewing, and refer to it as needed.
-
-Evaluation Criteria: 
-{aspect} - {definition}
-
-Evaluation Steps:
-1. Analyze the summary to evaluate {aspect}.
-2. Respond to each of the following questions with either 'Yes' or 'No' to evaluate the {aspect}. 
-3. Please answer 'Yes' or 'No'. No need to any explain.
-
-7 Days Energy Data: {source}
-
-Data Report: {report}
-Questions:
-"""
-    question_lines = questions.strip().split('\n')
-    for line in question_lines:
-        if line.strip():
-            prompt += f"- {line}\n"
+        async for delta in backend.stream_chat(provider, model, prompt=prompt):
+            raw_message += delta
+            history[-1] = (request_summary, f"[{provider} {model}]\n{raw_message}")
+            yield history, raw_message
+    except Exception as e:
+        history[-1] = (request_summary, f"请求失败: {str(e)}")
+        raw_message = ""
     
-    prompt += "\nYour Answers:"
-    return prompt
-
-def evaluate(aspect, definition, source, report, questions, provider, model, history):
+    yield history, raw_message
+
+def format_evaluation(result):
+    lines = []
+    for i, item in enumerate(result["results"], 1):
+        answer = item["answer"] or item.get("error") or "无法解析"
+        latency = f"{item['latency']:.2f}s" if item.get("latency") is not None else "-"
+        lines.append(f"{i}. [{answer}] ({latency}, {item['provider']} {item['model']}) {item['question']}")
+    score = f"{result['score']:.2%}" if result["score"] is not None else "-"
+    lines.append("")
+    lines.append(f"得分: {score}（Yes {result['yes']} / No {result['no']} / 未知 {result['unknown']}），总耗时 {result['latency']:.2f}s")
+    return "\n".join(lines)
+
+async def watch_job(job_id):
+    """流式获取任务状态，每次进度变化产出一次最新状态"""
+    async for _, job in backend.events("GET", f"/jobs/{job_id}", params={"stream": "true"}):
+        yield job
+
+async def evaluate_structured(aspect, definition, source, report, questions, provider, model, source_mode, mode, history):
+    history = history or []
+    question_list = [line for line in questions.strip().split('\n') if line.strip()]
+    request_summary = f"[{mode}] {aspect}: {len(question_list)} 个问题"
+    raw_message = ""
+    history.append((request_summary, "提交中..."))
     try:
-        prompt = generate_prompt(aspect, definition, source, report, questions)
-        response = requests.post(
-            f"{API_BASE_URL}/chat",
+        # 以后台任务提交，避免长时间评估被 HTTP 超时中断
+        job = await backend.request(
+            "POST", "/jobs", expected=202,
             json={
-                "provider": provider,
-                "model_name": model,
-                "message": prompt
+                "kind": "evaluate",
+                "payload": {
+                    "aspect": aspect,
+                    "definition": definition,
+                    "source": source,
+                    "report": report,
+                    "questions": question_list,
+                    "targets": [{"provider": provider, "model_name": model}],
+                    "mode": mode,
+                    "source_mode": source_mode
+                }
             }
         )
-        if response.status_code == 200:
-            raw_message = response.json()['message']
-            bot_message = f"[{provider} {model}]\n{raw_message}"
-        else:
-            bot_message = f"错误: {response.text}"
-            raw_message = ""
+        history[-1] = (request_summary, "排队中...")
+        yield history, raw_message
+        async for job in watch_job(job["id"]):
+            if job["status"] == "succeeded":
+                raw_message = format_evaluation(job["result"])
+                bot_message = f"[{provider} {model}]\n{raw_message}"
+            elif job["status"] in ("failed", "cancelled"):
+                bot_message = f"错误: {job['error'] or job['status']}"
+            else:
+                progress = job["progress"] or {}
+                bot_message = f"评估中... {progress.get('done', 0)}/{progress.get('total', '?')}"
+            history[-1] = (request_summary, bot_message)
+            yield history, raw_message
     except Exception as e:
-        bot_message = f"请求失败: {str(e)}"
-        raw_message = ""
-    
-    history.append((prompt, bot_message))
-    return history, raw_message
+        history[-1] = (request_summary, f"请求失败: {str(e)}")
+        yield history, ""
 
-def update_models(provider):
-    models = get_models(provider)
+async def update_models(provider):
+    models = await backend.models(provider)
     return gr.Dropdown(choices=models, value=models[0] if models else None)
 
-# 初始化提供商和模型
-providers = get_providers()
-if not providers:
-    providers = ["无可用提供商"]
-initial_models = get_models(providers[0]) if providers else []
+async def initialize_providers_and_models():
+    # 页面加载时再获取提供商和模型列表，后端较慢时界面也能立即启动
+    providers = await backend.providers() or ["无可用提供商"]
+    return gr.Dropdown(choices=providers, value=providers[0]), await update_models(providers[0])
 
 # 创建Gradio界面
 with gr.Blocks(title="报告评估器") as demo:
@@ -93,6 +122,7 @@ with gr.Blocks(title="报告评估器") as demo:
             
             with gr.Row():
                 submit = gr.Button("评估")
+                structured = gr.Button("逐题评分")
                 clear = gr.Button("清除")
         
         with gr.Column(scale=2):
@@ -138,17 +168,21 @@ Are there any important pieces of power data that are missing from the report?
 Has all the power data been clearly presented in the report?
 Is there any critical information about power data that has been omitted?"""
             )
-            provider = gr.Dropdown(
-                choices=providers,
-                value=providers[0] if providers else None,
-                label="选择AI提供商"
+            provider = gr.Dropdown(choices=[], label="选择AI提供商")
+            model = gr.Dropdown(choices=[], label="选择模型")
+            source_mode = gr.Radio(
+                choices=[("原始数据", "raw"), ("统计摘要", "summary"), ("统计摘要+降采样", "summary+downsampled")],
+                value="raw",
+                label="数据源形式"
             )
-            model = gr.Dropdown(
-                choices=initial_models,
-                value=initial_models[0] if initial_models else None,
-                label="选择模型"
+            mode = gr.Radio(
+                choices=[("单次批量 (batched)", "batched"), ("逐题并发 (parallel)", "parallel")],
+                value="batched",
+                label="逐题评分模式"
             )
 
+    demo.load(initialize_providers_and_models, None, [provider, model])
+
     provider.change(
         update_models,
         inputs=[provider],
@@ -157,7 +191,13 @@ Is there any critical information about power data that has been omitted?"""
 
     submit.click(
         evaluate,
-        inputs=[aspect, definition, source, report, questions, provider, model, chatbot],
+        inputs=[aspect, definition, source, report, questions, provider, model, source_mode, chatbot],
+        outputs=[chatbot, raw_output]
+    )
+
+    structured.click(
+        evaluate_structured,
+        inputs=[aspect, definition, source, report, questions, provider, model, source_mode, mode, chatbot],
         outputs=[chatbot, raw_output]
     )
     
@@ -177,4 +217,5 @@ Is there any critical information about power data that has been omitted?"""
 
     clear.click(lambda: (None, ""), None, [chatbot, raw_output], queue=False)
 
-demo.launch(share=False)
\ No newline at end of file
+# 多个用户的请求并发处理，不在同一个工作线程上排队
+demo.queue(default_concurrency_limit=concurrency_limit()).launch(share=False)
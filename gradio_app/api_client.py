@@ -0,0 +1,183 @@
+"""Gradio 前端共用的后端客户端：异步、复用连接池，带超时与重试。
+
+提供商和模型列表带刷新间隔地缓存在进程内，后端暂时不可用时返回上次成功的结果；
+列表在页面加载时获取，不在导入时同步请求，后端较慢时界面也能立即启动。
+
+通过环境变量配置:
+    API_BASE_URL=http://localhost:8000  后端地址
+    GRADIO_API_CONNECT_TIMEOUT=5        建立连接超时（秒）
+    GRADIO_API_TIMEOUT=300              读取超时（秒），流式接口为两块数据之间的最长间隔
+    GRADIO_API_RETRIES=2                失败后的最大重试次数
+    GRADIO_API_MAX_CONNECTIONS=100      连接池大小
+    GRADIO_CATALOG_TTL=60               提供商/模型列表的刷新间隔（秒）
+    GRADIO_CONCURRENCY=16               每个事件同时处理的请求数
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+# 这些状态码表示后端暂时不可用，可以安全重试
+RETRY_STATUS = {429, 502, 503, 504}
+# 幂等方法在读取超时或上述状态码时也重试；其他方法只在连接未建立时重试，避免重复提交
+IDEMPOTENT_METHODS = {"GET", "HEAD", "DELETE"}
+
+
+class BackendError(RuntimeError):
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        super().__init__(detail)
+
+
+class BackendClient:
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        connect_timeout: float = 5.0,
+        timeout: float = 300.0,
+        retries: int = 2,
+        max_connections: int = 100,
+        catalog_ttl: float = 60.0
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries = retries
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.catalog_ttl = catalog_ttl
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 路径 -> (过期时间, 结果)
+        self._catalog: Dict[str, Tuple[float, Any]] = {}
+
+    @classmethod
+    def from_env(cls) -> "BackendClient":
+        return cls(
+            base_url=os.getenv("API_BASE_URL", "http://localhost:8000"),
+            connect_timeout=float(os.getenv("GRADIO_API_CONNECT_TIMEOUT", 5)),
+            timeout=float(os.getenv("GRADIO_API_TIMEOUT", 300)),
+            retries=int(os.getenv("GRADIO_API_RETRIES", 2)),
+            max_connections=int(os.getenv("GRADIO_API_MAX_CONNECTIONS", 100)),
+            catalog_ttl=float(os.getenv("GRADIO_CATALOG_TTL", 60))
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 连接池绑定在创建它的事件循环上，循环变化时重新创建
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+            self._loop = loop
+        return self._client
+
+    async def _send(self, method: str, path: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """发送请求，按指数退避重试连接失败和后端暂时不可用的响应"""
+        retryable = method in IDEMPOTENT_METHODS
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                request = self.client.build_request(method, path, **kwargs)
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if last:
+                    raise
+            except httpx.TransportError:
+                if last or not retryable:
+                    raise
+            else:
+                if last or response.status_code not in RETRY_STATUS or not (retryable or response.status_code == 429):
+                    return response
+                await response.aclose()
+            await asyncio.sleep(min(0.5 * 2 ** attempt, 5.0))
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    def _error(response: httpx.Response) -> BackendError:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        return BackendError(response.status_code, detail if isinstance(detail, str) else json.dumps(detail, ensure_ascii=False))
+
+    async def request(self, method: str, path: str, expected: int = 200, **kwargs) -> Any:
+        """发送请求并返回 JSON 响应，状态码不符时抛出 BackendError"""
+        response = await self._send(method, path, **kwargs)
+        if response.status_code != expected:
+            raise self._error(response)
+        return response.json()
+
+    async def events(self, method: str, path: str, **kwargs) -> AsyncIterator[Tuple[Optional[str], Any]]:
+        """请求 SSE 接口，逐个产出 (事件名, 数据)，默认事件的事件名为 None"""
+        response = await self._send(method, path, stream=True, **kwargs)
+        try:
+            if response.status_code != 200:
+                await response.aread()
+                raise self._error(response)
+            event = None
+            async for line in response.aiter_lines():
+                if not line:
+                    event = None
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):])
+        finally:
+            await response.aclose()
+
+    async def _cached(self, path: str, key: str) -> Any:
+        expires, value = self._catalog.get(path, (0.0, None))
+        if time.monotonic() < expires:
+            return value
+        try:
+            value = (await self.request("GET", path))[key]
+        except Exception:
+            # 后端不可用时沿用上次的结果，并在下次调用时重试
+            return value or []
+        self._catalog[path] = (time.monotonic() + self.catalog_ttl, value)
+        return value
+
+    async def providers(self) -> List[str]:
+        return await self._cached("/providers", "providers")
+
+    async def models(self, provider: str) -> List[str]:
+        return await self._cached(f"/models/{provider}", provider)
+
+    async def stream_chat(self, provider: str, model: str, message: Optional[str] = None,
+                          session_id: Optional[str] = None, prompt: Optional[Dict] = None) -> AsyncIterator[str]:
+        """调用 /chat/stream 接口，按到达顺序逐块产出模型生成的文本
+
+        prompt 为 {"name": 模板名, "params": {...}} 时由后端渲染提示词，不发送完整的提示词文本
+        """
+        payload = {"provider": provider, "model_name": model}
+        if prompt is not None:
+            payload["prompt"] = prompt
+        else:
+            payload["message"] = message
+        if session_id:
+            payload["session_id"] = session_id
+        async for event, data in self.events("POST", "/chat/stream", json=payload):
+            if event == "error":
+                raise RuntimeError(data["detail"])
+            if event is None:
+                yield data["delta"]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_backend: Optional[BackendClient] = None
+
+
+def get_backend() -> BackendClient:
+    global _backend
+    if _backend is None:
+        _backend = BackendClient.from_env()
+    return _backend
+
+
+def concurrency_limit() -> int:
+    return int(os.getenv("GRADIO_CONCURRENCY", 16))
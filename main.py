@@ -1,16 +1,54 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError, model_validator
 from dotenv import load_dotenv
-from typing import List, Optional
+from typing import List, Optional, Union
+from contextlib import asynccontextmanager
+from app.models.catalog import AUTO, catalog, resolve_target
 from app.models.factory import AIModelFactory
+from app.models.recording import get_recording
+from app.cache import get_response_cache, inflight, make_cache_key
+from app.evaluation import BATCHED, evaluate
+from app.tokens import estimate_messages_tokens, prompt_budget
+from app.ratelimit import limiter_stats, stream_with_limits
+from app.routing import AllTargetsFailed, default_attempt_timeout, default_fallbacks, default_hedge_delay, generate_with_routing
+from app.batch import DEFAULT_CONCURRENCY, load_jobs, parse_index_ranges, parse_provider_concurrency, run_batch
+from app.metrics import CHAT_REQUESTS, REGISTRY, MetricsMiddleware, collect_usage, timed_stage
+from app.jobs import CHAT, EVALUATE, TERMINAL, get_job_queue
+from app.fanout import fan_out
+from app.sessions import Session, build_messages, get_session_store, record_turn
+from app.prompts import get_template, list_templates
+from app.payload import FastJSONResponse, PayloadMiddleware, json_dumps, log_codecs
+from app.shared_state import close_shared_state, get_shared_state, worker_count
+from app.server import drain_timeout, parse_args, run
+import asyncio
 import os
+import time
 
 # 加载环境变量
 load_dotenv()
 
-# 创建FastAPI应用
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_codecs()
+    # 启动任务队列的 worker，并恢复上次未完成的任务
+    await get_job_queue().start()
+    yield
+    # 停机时等待执行中的后台任务，超时未完成的任务重新排队
+    await get_job_queue().stop(drain_timeout())
+    # 关闭时释放所有模型实例持有的连接池
+    await AIModelFactory.close_all()
+    get_response_cache().close()
+    get_session_store().close()
+    get_recording().close()
+    close_shared_state()
+
+# 创建FastAPI应用，JSON 响应默认使用 orjson 序列化（未安装时退回标准库）
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# 请求体大小限制与 gzip/zstd 压缩；放在 CORS 之内，413 等错误响应同样带有 CORS 头
+app.add_middleware(PayloadMiddleware)
 
 # 配置CORS
 app.add_middleware(
@@ -19,39 +57,494 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 允许浏览器端读取各阶段耗时
+    expose_headers=["Server-Timing"],
 )
 
+# 请求耗时/并发指标与 Server-Timing 响应头
+app.add_middleware(MetricsMiddleware)
+
+class ModelTarget(BaseModel):
+    provider: str
+    model_name: Optional[str] = None
+
+class PromptReference(BaseModel):
+    # 由服务端按模板渲染提示词，客户端只发送参数
+    name: str
+    version: Optional[int] = None
+    params: dict = {}
+
 class ChatRequest(BaseModel):
     provider: str
     model_name: Optional[str] = None
-    message: str
+    message: Optional[str] = None
+    # 提示词模板，与 message 二选一
+    prompt: Optional[PromptReference] = None
+    bypass_cache: bool = False
+    # 主模型失败或超时后按顺序尝试的备选模型，未指定时使用 CHAT_FALLBACKS
+    fallbacks: Optional[List[ModelTarget]] = None
+    # 主模型在该时间（秒）内未返回时同时请求下一个模型，取先返回者
+    hedge_delay: Optional[float] = None
+    # 单次尝试的超时时间（秒），超时后回退到下一个模型
+    attempt_timeout: Optional[float] = None
+    # 会话 id：服务端保存历史，每轮只需发送新消息；不存在的 id 会自动创建
+    session_id: Optional[str] = None
+
+    @model_validator(mode="after")
+    def render_prompt(self):
+        if (self.message is None) == (self.prompt is None):
+            raise ValueError("message 和 prompt 必须且只能提供一个")
+        if self.prompt is not None:
+            self.message = get_template(self.prompt.name, self.prompt.version).render(self.prompt.params)
+        return self
+
+def _cache_headers(cache_status: str) -> dict:
+    # cache_status 形如 HIT-memory / HIT-disk / MISS / COALESCED / BYPASS
+    status, _, tier = cache_status.partition("-")
+    headers = {"X-Cache": status}
+    if tier:
+        headers["X-Cache-Tier"] = tier
+    return headers
+
+async def _check_prompt_size(request: ChatRequest, messages: List[dict]) -> None:
+    # 超出模型上下文的请求直接返回 413，而不是在上游失败或被静默截断
+    budget = prompt_budget(request.provider, request.model_name)
+    if budget is None:
+        return
+    tokens = await asyncio.to_thread(estimate_messages_tokens, messages, request.provider, request.model_name)
+    if tokens > budget:
+        raise HTTPException(
+            status_code=413,
+            detail=f"提示词约 {tokens} tokens，超出模型可用上下文 {budget} tokens，请精简内容或使用 /evaluate 分块评估"
+        )
+
+def _route_targets(request: ChatRequest) -> list:
+    primary = (request.provider, request.model_name)
+    if request.fallbacks is not None:
+        fallbacks = [(t.provider, t.model_name) for t in request.fallbacks]
+    else:
+        fallbacks = default_fallbacks()
+    return [primary] + [target for target in fallbacks if target != primary]
+
+async def _request_messages(request: ChatRequest, session: Optional[Session]) -> List[dict]:
+    if session is None:
+        return [{"role": "user", "content": request.message}]
+    # 多轮对话：按 token 预算携带最近的历史（以及更早轮次的摘要）
+    return await build_messages(get_session_store(), session, request.message, request.provider, request.model_name)
+
+async def _finish_turn(session: Optional[Session], request: ChatRequest, response: str) -> None:
+    if session is not None:
+        record_turn(session, request.message, response)
+        await get_session_store().asave(session)
 
 @app.post("/chat")
 async def chat_with_ai(request: ChatRequest):
+    if request.session_id:
+        session = await get_session_store().aget_or_create(request.session_id)
+        # 同一会话的请求依次执行
+        async with session.lock:
+            return await _chat(request, session)
+    return await _chat(request, None)
+
+async def _chat(request: ChatRequest, session: Optional[Session]):
+    # 准备消息
+    messages = await _request_messages(request, session)
     try:
-        # 创建对应的AI模型实例
-        ai_model = AIModelFactory.create_model(request.provider, request.model_name)
-        
-        # 准备消息
-        messages = [{"role": "user", "content": request.message}]
-        
-        # 生成响应
-        response = await ai_model.generate_response(messages)
-        
-        return {
+        await _check_prompt_size(request, messages)
+    except HTTPException as e:
+        CHAT_REQUESTS.inc(provider=request.provider, model=request.model_name or "", status=str(e.status_code))
+        raise
+
+    try:
+        # 按顺序回退/对冲地调用模型（相同的确定性请求直接返回缓存结果）
+        with collect_usage() as usage:
+            result = await generate_with_routing(
+                _route_targets(request),
+                messages,
+                hedge_delay=request.hedge_delay if request.hedge_delay is not None else default_hedge_delay(),
+                attempt_timeout=request.attempt_timeout if request.attempt_timeout is not None else default_attempt_timeout(),
+                bypass_cache=request.bypass_cache
+            )
+    except ValueError as e:
+        CHAT_REQUESTS.inc(provider=request.provider, model=request.model_name or "", status="400")
+        raise HTTPException(status_code=400, detail=str(e))
+    except AllTargetsFailed as e:
+        CHAT_REQUESTS.inc(provider=request.provider, model=request.model_name or "", status="502")
+        raise HTTPException(status_code=502, detail=str(e))
+    except Exception as e:
+        CHAT_REQUESTS.inc(provider=request.provider, model=request.model_name or "", status="500")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    await _finish_turn(session, request, result["message"])
+    # 按实际返回结果的提供商计数（可能是回退/对冲后的备选模型）
+    CHAT_REQUESTS.inc(provider=result["provider"], model=result["model"] or "", status="200")
+    with timed_stage("serialize", result["provider"]):
+        return FastJSONResponse({
             "status": "success",
-            "provider": request.provider,
-            "model": request.model_name,
-            "message": response
-        }
-    
+            "provider": result["provider"],
+            "model": result["model"],
+            "message": result["message"],
+            "attempts": result["attempts"],
+            "session_id": session.id if session else None,
+            "usage": usage
+        }, headers=_cache_headers(result["cache_status"]))
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    # 按 Server-Sent Events 格式编码单个事件
+    payload = json_dumps(data)
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {payload}\n\n"
+
+def _stream_model(request: ChatRequest, messages: List[dict]):
+    # auto 提供商按完整的提示词选择支持流式输出的具体模型
+    request.provider, request.model_name = resolve_target(
+        request.provider, request.model_name, messages, streaming=True
+    )
+    with timed_stage("factory", request.provider):
+        return AIModelFactory.get_model(request.provider, request.model_name)
+
+@app.post("/chat/stream")
+async def stream_chat_with_ai(request: ChatRequest):
+    # 会话的 auto 请求要等会话历史（持有会话锁后）组装完成才能按完整提示词选择模型
+    ai_model = None
+    if not (request.session_id and request.provider == AUTO):
+        try:
+            ai_model = _stream_model(request, [{"role": "user", "content": request.message}])
+        except ValueError as e:
+            # 不支持的提供商/模型等配置错误与 /chat 一致返回 400
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    # 新消息本身超出上下文时直接返回 413；会话历史会按预算裁剪，不会导致超限
+    await _check_prompt_size(request, [{"role": "user", "content": request.message}])
+    session = await get_session_store().aget_or_create(request.session_id) if request.session_id else None
+
+    cache = get_response_cache()
+
+    async def cache_lookup(messages):
+        if not cache.enabled or request.bypass_cache:
+            return None, None, "BYPASS"
+        key = make_cache_key(request.provider, request.model_name, messages)
+        value, tier = await cache.aget(key)
+        return key, value, f"HIT-{tier}" if value is not None else "MISS"
+
+    if session is None:
+        messages = [{"role": "user", "content": request.message}]
+        cache_key, cached, cache_status = await cache_lookup(messages)
+    else:
+        # 会话的上下文需要在持有会话锁后才能确定，缓存在流开始后再查询
+        messages, cache_key, cached, cache_status = None, None, None, None
+
+    async def generate():
+        nonlocal messages, cache_key, cached, ai_model
+        if messages is None:
+            messages = await _request_messages(request, session)
+            if ai_model is None:
+                # 包含会话历史和摘要的提示词，选中的模型必须能容纳；选择失败时以 error 事件返回
+                ai_model = _stream_model(request, messages)
+            cache_key, cached, _ = await cache_lookup(messages)
+        if cached is not None:
+            yield cached
+            await _finish_turn(session, request, cached)
+            return
+        chunks = []
+        start = time.perf_counter()
+        async for chunk in stream_with_limits(
+            request.provider, request.model_name, messages,
+            lambda: ai_model.stream_response(messages)
+        ):
+            chunks.append(chunk)
+            yield chunk
+        if cache_key and chunks:
+            await cache.aset(cache_key, "".join(chunks), time.perf_counter() - start)
+        await _finish_turn(session, request, "".join(chunks))
+
+    async def event_stream():
+        # 每个文本块作为一个 data 事件推送，结束时发送 done 事件，出错时发送 error 事件
+        try:
+            if session is not None:
+                async with session.lock:
+                    async for chunk in generate():
+                        yield _sse_event({"delta": chunk})
+            else:
+                async for chunk in generate():
+                    yield _sse_event({"delta": chunk})
+            yield _sse_event({
+                "status": "success",
+                "provider": request.provider,
+                "model": request.model_name,
+                "session_id": session.id if session else None
+            }, event="done")
+        except Exception as e:
+            yield _sse_event({"detail": str(e)}, event="error")
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if cache_status:
+        headers.update(_cache_headers(cache_status))
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+@app.post("/batch")
+async def run_batch_jobs(
+    request: Request,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    provider_concurrency: Optional[str] = None,
+    skip: Optional[str] = None
+):
+    # 请求体为 JSONL 任务文件；skip 为已完成的行号（如 "0-99,105"），用于断点续跑
+    try:
+        limits = parse_provider_concurrency(provider_concurrency)
+        skipped = parse_index_ranges(skip)
+        body = (await request.body()).decode("utf-8")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    jobs = load_jobs(body.splitlines(), skipped)
+
+    async def result_stream():
+        async for result in run_batch(jobs, concurrency, limits):
+            yield json_dumps(result) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+class EvaluateQuestion(BaseModel):
+    text: str
+    # 'Yes' 是否为正面答案，决定数据分块后各块答案的合并方向；未指定时按措辞判断
+    positive: Optional[bool] = None
+
+class EvaluateRequest(BaseModel):
+    aspect: str
+    definition: str
+    source: str
+    report: str
+    questions: List[Union[str, EvaluateQuestion]]
+    targets: List[ModelTarget]
+    mode: str = BATCHED
+    concurrency: int = 8
+    source_mode: str = "raw"
+    # 使用约束输出（JSON / 单 token 回答，支持时返回每题 P(Yes)）
+    constrained: bool = False
+    # checkeval.evaluate 模板版本，未指定时使用最新版本
+    prompt_version: Optional[int] = None
+
+@app.post("/evaluate")
+async def evaluate_report(request: EvaluateRequest):
+    try:
+        return await evaluate(
+            request.aspect,
+            request.definition,
+            request.source,
+            request.report,
+            [q if isinstance(q, str) else q.model_dump() for q in request.questions],
+            [(t.provider, t.model_name) for t in request.targets],
+            mode=request.mode,
+            concurrency=request.concurrency,
+            source_mode=request.source_mode,
+            constrained=request.constrained,
+            prompt_version=request.prompt_version
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class FanoutRequest(BaseModel):
+    message: str
+    targets: List[ModelTarget]
+    # 清单的问题数：设置后把每个模型的回答解析为逐题 Yes/No 并计算多数投票和一致性
+    questions: Optional[int] = None
+    bypass_cache: bool = False
+
+@app.post("/fanout")
+async def fanout(request: FanoutRequest):
+    # 同一提示词并发发给多个模型，每个模型完成时推送 result 事件，全部完成后推送 summary 事件
+    targets = [(t.provider, t.model_name) for t in request.targets]
+    if not targets:
+        raise HTTPException(status_code=400, detail="至少需要一个目标模型")
+    messages = [{"role": "user", "content": request.message}]
+    try:
+        # auto 目标各自展开为一个具体模型（不追加备选）
+        targets = [resolve_target(provider, model_name, messages) for provider, model_name in targets]
+        for provider, model_name in targets:
+            AIModelFactory.get_model(provider, model_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def event_stream():
+        async for item in fan_out(targets, messages, request.bypass_cache, request.questions):
+            yield _sse_event(item, event=item.pop("type"))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class SourceSummaryRequest(BaseModel):
+    source: str
+    mode: str = "summary"
+    freq: str = "6h"
+
+@app.post("/source/summary")
+async def summarize_source(request: SourceSummaryRequest):
+    # 将原始能源CSV压缩为统计摘要，减少提示词的token数
+    from app.energy_data import prepare_source
+    try:
+        summary = await asyncio.to_thread(prepare_source, request.source, request.mode, request.freq)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "mode": request.mode,
+        "summary": summary,
+        "source_chars": len(request.source),
+        "summary_chars": len(summary)
+    }
+
+class JobRequest(BaseModel):
+    # kind 为 chat 时 payload 同 /chat 的请求体，为 evaluate 时同 /evaluate 的请求体
+    kind: str = CHAT
+    payload: dict
+    # 优先级通道 interactive/bulk，默认 chat 为 interactive，evaluate 为 bulk
+    priority: Optional[str] = None
+
+def _job_payload(request: JobRequest) -> dict:
+    # 在提交时完成校验并解析默认值（如备选模型），worker 只需按 payload 执行
+    if request.kind == CHAT:
+        chat = ChatRequest(**request.payload)
+        if chat.session_id:
+            raise ValueError("后台任务不支持会话，请使用 /chat 或 /chat/stream")
+        return {
+            "targets": _route_targets(chat),
+            "messages": [{"role": "user", "content": chat.message}],
+            "hedge_delay": chat.hedge_delay if chat.hedge_delay is not None else default_hedge_delay(),
+            "attempt_timeout": chat.attempt_timeout if chat.attempt_timeout is not None else default_attempt_timeout(),
+            "bypass_cache": chat.bypass_cache
+        }
+    if request.kind == EVALUATE:
+        evaluation = EvaluateRequest(**request.payload)
+        return {
+            **evaluation.model_dump(exclude={"targets"}),
+            "targets": [(t.provider, t.model_name) for t in evaluation.targets]
+        }
+    raise ValueError(f"不支持的任务类型: {request.kind}")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    # 立即返回任务 id，由后台 worker 执行；通过 GET /jobs/{id} 轮询或流式获取进度
+    try:
+        return await get_job_queue().submit(request.kind, _job_payload(request), request.priority)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    queue = get_job_queue()
+    return {"stats": await queue.stats(), "jobs": await queue.recent(limit, status)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, stream: bool = False):
+    queue = get_job_queue()
+    job = await queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    if not stream:
+        return job
+
+    async def progress_stream():
+        # 状态或进度变化时推送 progress 事件，任务结束时推送 done 事件
+        async for snapshot in queue.watch(job_id):
+            event = "done" if snapshot["status"] in TERMINAL else "progress"
+            yield _sse_event(snapshot, event=event)
+
+    return StreamingResponse(
+        progress_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = await get_job_queue().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+@app.post("/sessions")
+async def create_session():
+    return {"session_id": (await get_session_store().aget_or_create()).id}
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = await get_session_store().aget(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    return session.to_dict()
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not await get_session_store().adelete(session_id):
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    return {"status": "success"}
+
+@app.get("/health")
+async def health():
+    # 多 worker 部署时每个请求由其中一个进程处理，pid 标识处理该请求的进程
+    state = get_shared_state()
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "workers": worker_count(),
+        "shared_state": type(state).__name__,
+        "jobs": await get_job_queue().stats()
+    }
+
+@app.get("/limits")
+async def get_limits():
+    # 各提供商的限流状态：并发上限、排队数、令牌余量，以及平均排队耗时与上游耗时
+    return limiter_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus 文本格式的指标
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return {**get_response_cache().stats(), "singleflight": inflight.stats()}
+
+@app.get("/recording/stats")
+async def get_recording_stats():
+    return get_recording().stats()
+
+@app.get("/prompts")
+async def get_prompts():
+    return {"templates": list_templates()}
+
+class PromptRenderRequest(BaseModel):
+    version: Optional[int] = None
+    params: dict = {}
+
+@app.post("/prompts/{name}/render")
+async def render_prompt_template(name: str, request: PromptRenderRequest):
+    try:
+        template = get_template(name, request.version)
+        prompt = template.render(request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"name": template.name, "version": template.version, "prompt": prompt, "chars": len(prompt)}
+
+@app.delete("/cache")
+async def clear_cache():
+    # 共享的磁盘层可能等待其他进程的写锁，在线程中清空
+    await asyncio.to_thread(get_response_cache().clear)
+    return {"status": "success"}
+
 @app.get("/providers")
 async def get_available_providers():
     return {
-        "providers": list(AIModelFactory._models.keys())
+        "providers": AIModelFactory.get_providers()
     }
 
 @app.get("/models/{provider}")
@@ -65,6 +558,14 @@ async def get_provider_models(provider: str):
 async def get_all_models():
     return AIModelFactory.get_provider_models()
 
+@app.get("/catalog")
+async def get_model_catalog():
+    # 各模型的上下文窗口、价格、能力和最近调用的耗时/错误率估计，以及 auto 提供商的候选模型
+    try:
+        return catalog()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # python main.py [--workers N] [--host 0.0.0.0] [--port 8000] [--drain-timeout 30]
+    run(parse_args(), app)
\ No newline at end of file